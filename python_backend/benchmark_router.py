@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""
+钉钉K8s运维机器人 - 意图路由微基准
+对比逐个关键词 `in` 扫描与 Aho-Corasick 自动机在不同关键词规模下的分类耗时
+"""
+
+import random
+import string
+import sys
+import time
+from loguru import logger
+
+from src.dingtalk.router import IntentRouter, IntentRouterConfig, DEFAULT_AI_KEYWORDS
+
+# 配置日志
+logger.remove()
+logger.add(sys.stdout, format="<green>{time:HH:mm:ss}</green> | <level>{level: <8}</level> | {message}")
+
+
+SAMPLE_MESSAGES = [
+    "帮我看一下default命名空间下的pod有没有异常",
+    "今天中午吃什么",
+    "nginx 的 deployment 需要扩缩容到5个副本",
+    "线上告警了，麻烦看看集群状态和最近的日志",
+    "收到，谢谢",
+    "please check why the payment service keeps restarting in production " * 3,
+]
+
+
+def generate_keywords(count: int) -> list:
+    """在内置关键词基础上生成指定数量的关键词"""
+    rng = random.Random(42)
+    keywords = list(DEFAULT_AI_KEYWORDS)
+    while len(keywords) < count:
+        keywords.append("".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10))))
+    return keywords
+
+
+def linear_scan(keywords: list, content: str) -> bool:
+    """原实现：逐个关键词做子串查找"""
+    lowered = content.lower()
+    return any(keyword in lowered for keyword in keywords)
+
+
+def bench(func, rounds: int) -> float:
+    """返回每条消息的平均耗时(µs)"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for message in SAMPLE_MESSAGES:
+            func(message)
+    return (time.perf_counter() - start) / (rounds * len(SAMPLE_MESSAGES)) * 1e6
+
+
+def main(rounds: int = 2000) -> None:
+    logger.info("🚀 意图路由微基准")
+    print("=" * 60)
+    print(f"  {'关键词数':>8} | {'线性扫描(µs)':>12} | {'自动机(µs)':>10} | {'加速比':>6}")
+    print("-" * 60)
+
+    for count in (10, 100, 1000, 5000):
+        keywords = generate_keywords(count)
+        router = IntentRouter(IntentRouterConfig(ai_keywords=keywords, help_keywords=[]))
+
+        linear = bench(lambda message: linear_scan(keywords, message), rounds)
+        automaton = bench(router.classify, rounds)
+
+        print(f"  {count:>8} | {linear:>12.2f} | {automaton:>10.2f} | {linear / automaton:>5.1f}x")
+
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -4,9 +4,10 @@ FastAPI 主应用入口
 """
 
 import os
+import shlex
 import asyncio
 from contextlib import asynccontextmanager
-from typing import Optional, Dict, Any
+from typing import Any, Callable, Dict, Optional
 from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -20,9 +21,22 @@ from pathlib import Path
 import logging
 
 from src.mcp.client import MCPClient
-from src.mcp.types import MCPClientConfig, LLMConfig
+from src.mcp.types import MCPClientConfig, MCPServerConfig, LLMConfig, ProviderConfig, ToolCachePolicy
 from src.llm.processor import EnhancedLLMProcessor
 from src.dingtalk.bot import DingTalkBot
+from src.dingtalk.dispatcher import DispatcherConfig
+from src.dingtalk.dedup import DedupConfig
+from src.dingtalk.sender import SenderConfig
+from src.dingtalk.chunking import ChunkingConfig
+from src.dingtalk.router import IntentRouterConfig
+from src.llm.memory import MemoryConfig
+from src.llm.compaction import CompactionConfig
+from src.llm.answer_cache import AnswerCacheConfig
+from src.llm.hedging import HedgingConfig
+from src.llm.tool_selection import ToolSelectionConfig
+from src.llm.usage import UsageLedgerConfig
+from src.dingtalk.streaming import StreamingConfig
+from src.dingtalk.http_client import DingTalkHTTPClient, HTTPClientConfig
 
 # 配置日志
 logging.basicConfig(
@@ -38,6 +52,14 @@ load_dotenv()
 mcp_client: Optional[MCPClient] = None
 llm_processor: Optional[EnhancedLLMProcessor] = None
 dingtalk_bot: Optional[DingTalkBot] = None
+dingtalk_http_client: Optional[DingTalkHTTPClient] = None
+
+# 各提供商未指定模型时使用的默认模型
+DEFAULT_PROVIDER_MODELS = {
+    "openai": "gpt-3.5-turbo",
+    "zhipu": "glm-4-flash",
+    "qwen": "qwen-plus",
+}
 
 # 配置存储
 config_file = "config.json"
@@ -48,15 +70,41 @@ default_config = {
         "api_key": "",
         "temperature": 0.7,
         "max_tokens": 2000,
-        "timeout": 30
+        "timeout": 30,
+        "max_concurrency": 8,
+        "max_agent_steps": 5,
+        "agent_token_budget": 20000,
+        "agent_deadline": 90,
+        "tool_result_max_tokens": 1500,
+        "answer_cache": True,
+        "answer_cache_ttl": 120,
+        "fallback_providers": [],
+        "circuit_failure_threshold": 3,
+        "circuit_cooldown": 30,
+        "hedge": False,
+        "hedge_percentile": 95,
+        "hedge_budget": 0.05,
+        "tool_selection": True,
+        "tool_selection_top_k": 6
     },
     "dingtalk": {
         "webhook_url": "",
         "secret": "",
         "enable_signature": True,
         "max_message_length": 4000,
+        "parts_per_reply": 3,
         "enable_markdown": True,
-        "enable_ai": True
+        "enable_ai": True,
+        "worker_count": 4,
+        "max_queue_size": 1000,
+        "request_deadline": 120,
+        "dedup_ttl_seconds": 600,
+        "dedup_max_entries": 10000,
+        "rate_per_minute": 20,
+        "enable_streaming": False,
+        "user_token_quota": 0,
+        "group_token_quota": 0,
+        "quota_mode": "soft"
     },
     "mcp": {
         "tools": []
@@ -143,47 +191,162 @@ app.add_middleware(
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
+def build_dingtalk_bot(overrides: Optional[Dict[str, Any]] = None) -> DingTalkBot:
+    """按环境变量构建钉钉机器人，启动和重新初始化共用
+
+    overrides 为管理页面保存的钉钉配置，同名项覆盖环境变量
+    """
+    overrides = overrides or {}
+    
+    def setting(key: str, env_name: str, default: str, cast: Callable[[Any], Any] = str) -> Any:
+        # overrides 中的值优先，其次环境变量，最后默认值
+        value = overrides.get(key)
+        if value is None or value == "":
+            value = os.getenv(env_name, default)
+        if cast is bool and isinstance(value, str):
+            return value.lower() == "true"
+        return cast(value)
+    
+    # 触发AI处理的关键词，逗号分隔，未配置时使用内置关键词
+    ai_keywords = overrides.get("ai_keywords") or [
+        k.strip() for k in os.getenv("DINGTALK_AI_KEYWORDS", "").split(",") if k.strip()
+    ]
+    
+    return DingTalkBot(
+        webhook_url=setting("webhook_url", "DINGTALK_WEBHOOK_URL", ""),
+        secret=setting("secret", "DINGTALK_SECRET", "") or None,
+        llm_processor=llm_processor,
+        dispatcher_config=DispatcherConfig(
+            worker_count=setting("worker_count", "DINGTALK_WORKER_COUNT", "4", int),
+            max_queue_size=setting("max_queue_size", "DINGTALK_MAX_QUEUE_SIZE", "1000", int),
+            request_deadline=setting("request_deadline", "DINGTALK_REQUEST_DEADLINE", "120", float)
+        ),
+        http_client=dingtalk_http_client,
+        dedup_config=DedupConfig(
+            ttl_seconds=setting("dedup_ttl_seconds", "DINGTALK_DEDUP_TTL", "600", float),
+            max_entries=setting("dedup_max_entries", "DINGTALK_DEDUP_MAX_ENTRIES", "10000", int)
+        ),
+        sender_config=SenderConfig(
+            rate_per_minute=setting("rate_per_minute", "DINGTALK_RATE_PER_MINUTE", "20", float),
+            burst=setting("rate_burst", "DINGTALK_RATE_BURST", "5", int)
+        ),
+        chunking_config=ChunkingConfig(
+            max_message_length=setting("max_message_length", "DINGTALK_MAX_MESSAGE_LENGTH", "4000", int),
+            parts_per_reply=setting("parts_per_reply", "DINGTALK_PARTS_PER_REPLY", "3", int)
+        ),
+        router_config=IntentRouterConfig(ai_keywords=ai_keywords) if ai_keywords else None,
+        memory_config=MemoryConfig(
+            default_token_budget=setting("history_token_budget", "LLM_HISTORY_TOKEN_BUDGET", "2000", int),
+            max_conversations=setting("memory_max_conversations", "LLM_MEMORY_MAX_CONVERSATIONS", "500", int),
+            llm_summary=setting("memory_llm_summary", "LLM_MEMORY_LLM_SUMMARY", "false", bool)
+        ),
+        streaming_config=StreamingConfig(
+            enabled=setting("enable_streaming", "DINGTALK_STREAMING", "false", bool),
+            min_interval=setting("streaming_interval", "DINGTALK_STREAMING_INTERVAL", "3", float)
+        ),
+        usage_config=UsageLedgerConfig(
+            user_token_quota=setting("user_token_quota", "LLM_USER_TOKEN_QUOTA", "0", int),
+            group_token_quota=setting("group_token_quota", "LLM_GROUP_TOKEN_QUOTA", "0", int),
+            quota_mode=setting("quota_mode", "LLM_QUOTA_MODE", "soft")
+        )
+    )
+
+
 async def initialize_services():
     """初始化所有服务"""
-    global mcp_client, llm_processor, dingtalk_bot
+    global mcp_client, llm_processor, dingtalk_bot, dingtalk_http_client
     
     try:
         # 1. 初始化 MCP 客户端
         mcp_config = MCPClientConfig(
-            timeout=30000,
-            retry_attempts=3,
+            timeout=int(os.getenv("MCP_TOOL_TIMEOUT", "30000")),
+            retry_attempts=int(os.getenv("MCP_RETRY_ATTEMPTS", "3")),
+            retry_delay=int(os.getenv("MCP_RETRY_DELAY", "1000")),
             max_concurrent_calls=5,
-            enable_cache=True
+            enable_cache=True,
+            cache_max_entries=int(os.getenv("MCP_CACHE_MAX_ENTRIES", "1000")),
+            cache_max_bytes=int(os.getenv("MCP_CACHE_MAX_MB", "32")) * 1024 * 1024,
+            # 按工具名覆盖缓存策略，JSON 对象，如 {"prod__k8s-get-pods": {"ttl": 120, "resource_kinds": ["pod"]}}
+            cache_policies={
+                name: ToolCachePolicy(**policy)
+                for name, policy in json.loads(os.getenv("MCP_CACHE_POLICIES") or "{}").items()
+            },
+            # 未配置时使用内置的模拟工具
+            transport=os.getenv("MCP_TRANSPORT", "mock"),
+            server_command=shlex.split(os.getenv("MCP_SERVER_COMMAND", "")),
+            server_url=os.getenv("MCP_SERVER_URL") or None,
+            # 多个服务器，JSON 数组，如 [{"name": "prod", "transport": "sse", "server_url": "...", "namespace": "prod"}]
+            servers=[MCPServerConfig(**server) for server in json.loads(os.getenv("MCP_SERVERS") or "[]")],
+            server_failure_threshold=int(os.getenv("MCP_SERVER_FAILURE_THRESHOLD", "3")),
+            server_retry_interval=float(os.getenv("MCP_SERVER_RETRY_INTERVAL", "30"))
         )
         mcp_client = MCPClient(mcp_config)
         await mcp_client.connect()
         logger.info("✅ MCP 客户端初始化成功")
         
         # 2. 初始化 LLM 处理器
+        # 备用后端，如 LLM_FALLBACK_PROVIDERS=zhipu,qwen，各自读取 ZHIPU_API_KEY / QWEN_MODEL 等
+        fallback_providers = [
+            ProviderConfig(
+                provider=name,
+                model=os.getenv(f"{name.upper()}_MODEL", DEFAULT_PROVIDER_MODELS.get(name, "")),
+                api_key=os.getenv(f"{name.upper()}_API_KEY", ""),
+                base_url=os.getenv(f"{name.upper()}_BASE_URL")
+            )
+            for name in (n.strip() for n in os.getenv("LLM_FALLBACK_PROVIDERS", "").split(","))
+            if name
+        ]
         llm_config = LLMConfig(
-            provider="openai",
+            provider=os.getenv("LLM_PROVIDER", "openai"),
             model=os.getenv("LLM_MODEL", "gpt-3.5-turbo"),
             api_key=os.getenv("LLM_API_KEY", ""),
             base_url=os.getenv("LLM_BASE_URL"),
             temperature=0.7,
-            max_tokens=2000
+            max_tokens=2000,
+            request_timeout=float(os.getenv("LLM_REQUEST_TIMEOUT", "60")),
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+            max_agent_steps=int(os.getenv("LLM_MAX_AGENT_STEPS", "5")),
+            agent_token_budget=int(os.getenv("LLM_AGENT_TOKEN_BUDGET", "20000")),
+            agent_deadline=float(os.getenv("LLM_AGENT_DEADLINE", "90")),
+            fallback_providers=fallback_providers,
+            circuit_failure_threshold=int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "3")),
+            circuit_cooldown=float(os.getenv("LLM_CIRCUIT_COOLDOWN", "30"))
         )
         
         if not llm_config.api_key:
             logger.warning("⚠️ LLM API Key 未配置，将使用模拟模式")
         
-        llm_processor = EnhancedLLMProcessor(llm_config, mcp_client)
+        llm_processor = EnhancedLLMProcessor(
+            llm_config,
+            mcp_client,
+            CompactionConfig(max_tokens=int(os.getenv("LLM_TOOL_RESULT_MAX_TOKENS", "1500"))),
+            AnswerCacheConfig(
+                enabled=os.getenv("LLM_ANSWER_CACHE", "true").lower() == "true",
+                ttl_seconds=float(os.getenv("LLM_ANSWER_CACHE_TTL", "120")),
+                max_entries=int(os.getenv("LLM_ANSWER_CACHE_MAX_ENTRIES", "500"))
+            ),
+            HedgingConfig(
+                enabled=os.getenv("LLM_HEDGE", "false").lower() == "true",
+                percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+                budget_ratio=float(os.getenv("LLM_HEDGE_BUDGET", "0.05"))
+            ),
+            ToolSelectionConfig(
+                enabled=os.getenv("LLM_TOOL_SELECTION", "true").lower() == "true",
+                top_k=int(os.getenv("LLM_TOOL_SELECTION_TOP_K", "6"))
+            )
+        )
         logger.info("✅ LLM 处理器初始化成功")
         
         # 3. 初始化钉钉机器人
-        dingtalk_webhook = os.getenv("DINGTALK_WEBHOOK_URL", "")
-        dingtalk_secret = os.getenv("DINGTALK_SECRET")
+        # 所有出站钉钉请求共享一个长连接池，由应用生命周期负责关闭
+        dingtalk_http_client = DingTalkHTTPClient(HTTPClientConfig(
+            max_connections=int(os.getenv("DINGTALK_HTTP_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(os.getenv("DINGTALK_HTTP_MAX_KEEPALIVE", "10")),
+            http2=os.getenv("DINGTALK_HTTP2", "false").lower() == "true"
+        ))
         
-        dingtalk_bot = DingTalkBot(
-            webhook_url=dingtalk_webhook,
-            secret=dingtalk_secret,
-            llm_processor=llm_processor
-        )
+        dingtalk_bot = build_dingtalk_bot()
+        await dingtalk_bot.start()
         logger.info("✅ 钉钉机器人初始化成功")
         
     except Exception as e:
@@ -193,7 +356,17 @@ async def initialize_services():
 
 async def cleanup_services():
     """清理服务"""
-    global mcp_client
+    global mcp_client, llm_processor, dingtalk_bot, dingtalk_http_client
+    
+    # 先停止消息处理，再断开下游依赖
+    if dingtalk_bot:
+        await dingtalk_bot.stop()
+    
+    if llm_processor:
+        await llm_processor.close()
+    
+    if dingtalk_http_client:
+        await dingtalk_http_client.close()
     
     if mcp_client:
         await mcp_client.disconnect()
@@ -352,15 +525,73 @@ async def dingtalk_webhook(request: Request):
         body = await request.body()
         headers = dict(request.headers)
         
-        # 处理钉钉消息
+        # 解析并入队，消息由后台worker处理，立即应答钉钉
         response = await dingtalk_bot.handle_webhook(body, headers)
         return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"钉钉Webhook处理失败: {e}")
         raise HTTPException(status_code=500, detail=f"处理失败: {e}")
 
 
+@app.get("/api/dingtalk/stats")
+async def get_dingtalk_stats():
+    """获取钉钉机器人运行统计"""
+    if not dingtalk_bot:
+        raise HTTPException(status_code=404, detail="钉钉机器人未初始化")
+    return dingtalk_bot.get_stats()
+
+
+@app.get("/api/usage")
+async def get_usage(dimension: str = "user", since: Optional[int] = None, limit: int = 20):
+    """按维度(user/group/shortcut/model)汇总token用量，since为最近多少秒"""
+    if not dingtalk_bot:
+        raise HTTPException(status_code=404, detail="钉钉机器人未初始化")
+    try:
+        return dingtalk_bot.usage.query(dimension, since, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/usage/{dimension}/{key}")
+async def get_usage_series(dimension: str, key: str):
+    """某个用户/群/指令/模型按时间桶的用量"""
+    if not dingtalk_bot:
+        raise HTTPException(status_code=404, detail="钉钉机器人未初始化")
+    return dingtalk_bot.usage.series(dimension, key)
+
+
+@app.get("/api/mcp/stats")
+async def get_mcp_stats():
+    """获取MCP工具调用、结果缓存和各服务器的健康、传输统计"""
+    if not mcp_client:
+        raise HTTPException(status_code=404, detail="MCP客户端未初始化")
+    return {
+        "status": mcp_client.status,
+        "client": mcp_client.get_stats(),
+        "cache": mcp_client.get_cache_stats(),
+        "servers": mcp_client.get_server_stats()
+    }
+
+
+@app.get("/api/llm/stats")
+async def get_llm_stats():
+    """获取LLM调用统计"""
+    if not llm_processor:
+        raise HTTPException(status_code=404, detail="LLM处理器未初始化")
+    return {
+        "client": llm_processor.get_stats(),
+        "providers": llm_processor.get_provider_stats(),
+        "tool_result_compaction": llm_processor.compactor.get_stats(),
+        "answer_cache": llm_processor.answer_cache.get_stats(),
+        "hedging": llm_processor.hedger.get_stats(),
+        "coalescing": llm_processor.single_flight.get_stats(),
+        "tool_selection": llm_processor.tool_selector.get_stats()
+    }
+
+
 async def reinitialize_llm_processor(llm_config: Dict[str, Any]):
     """重新初始化LLM处理器"""
     global llm_processor
@@ -371,10 +602,41 @@ async def reinitialize_llm_processor(llm_config: Dict[str, Any]):
             api_key=llm_config.get("api_key", ""),
             base_url=llm_config.get("base_url"),
             temperature=llm_config.get("temperature", 0.7),
-            max_tokens=llm_config.get("max_tokens", 2000)
+            max_tokens=llm_config.get("max_tokens", 2000),
+            request_timeout=llm_config.get("timeout", 60),
+            max_concurrency=llm_config.get("max_concurrency", 8),
+            max_agent_steps=llm_config.get("max_agent_steps", 5),
+            agent_token_budget=llm_config.get("agent_token_budget", 20000),
+            agent_deadline=llm_config.get("agent_deadline", 90),
+            fallback_providers=[ProviderConfig(**provider) for provider in llm_config.get("fallback_providers", [])],
+            circuit_failure_threshold=llm_config.get("circuit_failure_threshold", 3),
+            circuit_cooldown=llm_config.get("circuit_cooldown", 30)
         )
 
-        llm_processor = EnhancedLLMProcessor(config, mcp_client)
+        old_processor = llm_processor
+        llm_processor = EnhancedLLMProcessor(
+            config,
+            mcp_client,
+            CompactionConfig(max_tokens=llm_config.get("tool_result_max_tokens", 1500)),
+            AnswerCacheConfig(
+                enabled=llm_config.get("answer_cache", True),
+                ttl_seconds=llm_config.get("answer_cache_ttl", 120)
+            ),
+            HedgingConfig(
+                enabled=llm_config.get("hedge", False),
+                percentile=llm_config.get("hedge_percentile", 95),
+                budget_ratio=llm_config.get("hedge_budget", 0.05)
+            ),
+            ToolSelectionConfig(
+                enabled=llm_config.get("tool_selection", True),
+                top_k=llm_config.get("tool_selection_top_k", 6)
+            )
+        )
+        # 钉钉机器人切换到新实例后再关闭旧实例的连接池
+        if dingtalk_bot:
+            dingtalk_bot.set_llm_processor(llm_processor)
+        if old_processor:
+            await old_processor.close()
         logger.info("LLM处理器重新初始化成功")
     except Exception as e:
         logger.error(f"LLM处理器重新初始化失败: {e}")
@@ -384,12 +646,13 @@ async def reinitialize_dingtalk_bot(dingtalk_config: Dict[str, Any]):
     """重新初始化钉钉机器人"""
     global dingtalk_bot
     try:
+        # 停止旧实例的后台worker，已入队的消息会先处理完
+        if dingtalk_bot:
+            await dingtalk_bot.stop()
+            
         if dingtalk_config.get("webhook_url"):
-            dingtalk_bot = DingTalkBot(
-                webhook_url=dingtalk_config["webhook_url"],
-                secret=dingtalk_config.get("secret"),
-                llm_processor=llm_processor
-            )
+            dingtalk_bot = build_dingtalk_bot(dingtalk_config)
+            await dingtalk_bot.start()
             logger.info("钉钉机器人重新初始化成功")
         else:
             dingtalk_bot = None
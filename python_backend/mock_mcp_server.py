@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+"""
+测试用的 MCP 服务器
+直接运行时通过 stdin/stdout 按行收发 JSON-RPC 消息；test_system.py 也复用
+MCPServerSession 搭建 HTTP+SSE 形式的服务
+"""
+
+import asyncio
+import itertools
+import json
+import sys
+
+
+TOOLS = [
+    {
+        "name": "k8s-get-pods",
+        "annotations": {"readOnlyHint": True},
+        "description": "获取 Kubernetes Pod 列表",
+        "inputSchema": {
+            "type": "object",
+            "properties": {"namespace": {"type": "string", "description": "命名空间"}}
+        }
+    },
+    {
+        "name": "echo",
+        "annotations": {"readOnlyHint": True},
+        "description": "延迟 delay 秒后原样返回 value",
+        "inputSchema": {
+            "type": "object",
+            "properties": {"value": {"type": "string"}, "delay": {"type": "number"}},
+            "required": ["value"]
+        }
+    },
+    {
+        "name": "big-output",
+        "annotations": {"readOnlyHint": True},
+        "description": "返回 size 个字符的文本",
+        "inputSchema": {"type": "object", "properties": {"size": {"type": "number"}}}
+    },
+    {
+        "name": "fail",
+        "annotations": {"readOnlyHint": True},
+        "description": "总是返回错误",
+        "inputSchema": {"type": "object", "properties": {}}
+    },
+    {
+        "name": "ping-client",
+        "annotations": {"readOnlyHint": True},
+        "description": "向客户端发送 ping 请求，收到响应后返回",
+        "inputSchema": {"type": "object", "properties": {}}
+    },
+    {
+        "name": "k8s-scale-deployment",
+        "description": "扩缩容 Deployment，延迟 delay 秒后返回累计调用次数（不声明 annotations）",
+        "inputSchema": {
+            "type": "object",
+            "properties": {"name": {"type": "string"}, "replicas": {"type": "number"}, "delay": {"type": "number"}},
+            "required": ["name", "replicas"]
+        }
+    },
+    {
+        "name": "add-tool",
+        "description": "新增一个工具并发送 tools/list_changed 通知",
+        "inputSchema": {"type": "object", "properties": {"name": {"type": "string"}}, "required": ["name"]}
+    },
+]
+
+# tools/list 每页的工具数，用来覆盖分页
+PAGE_SIZE = 4
+
+
+class MCPServerSession:
+    """一个客户端连接上的 MCP 会话"""
+
+    def __init__(self, send):
+        # send(message) 是向客户端发送一条消息的协程函数
+        self.send = send
+        self.tools = [dict(tool) for tool in TOOLS]
+        self.cancelled = set()
+        self.scale_calls = 0
+        self.max_concurrent = 0
+        self._running = 0
+        self._ids = itertools.count(1)
+        self._pending = {}
+
+    async def handle(self, message):
+        """处理客户端发来的一条消息"""
+        if "method" not in message:
+            future = self._pending.pop(message.get("id"), None)
+            if future and not future.done():
+                future.set_result(message)
+            return
+
+        params = message.get("params") or {}
+        if "id" not in message:
+            if message["method"] == "notifications/cancelled":
+                self.cancelled.add(params.get("requestId"))
+            return
+
+        self._running += 1
+        self.max_concurrent = max(self.max_concurrent, self._running)
+        try:
+            result = await self.dispatch(message["method"], params)
+            reply = {"jsonrpc": "2.0", "id": message["id"], "result": result}
+        except KeyError as e:
+            reply = {"jsonrpc": "2.0", "id": message["id"], "error": {"code": -32601, "message": f"Unknown: {e}"}}
+        finally:
+            self._running -= 1
+        await self.send(reply)
+
+    async def dispatch(self, method, params):
+        if method == "initialize":
+            return {
+                "protocolVersion": params.get("protocolVersion", "2024-11-05"),
+                "capabilities": {"tools": {"listChanged": True}},
+                "serverInfo": {"name": "mock-k8s", "version": "0.1.0"}
+            }
+        if method == "tools/list":
+            start = int(params.get("cursor") or 0)
+            result = {"tools": self.tools[start:start + PAGE_SIZE]}
+            if start + PAGE_SIZE < len(self.tools):
+                result["nextCursor"] = str(start + PAGE_SIZE)
+            return result
+        if method == "tools/call":
+            return await self.call_tool(params["name"], params.get("arguments") or {})
+        if method == "ping":
+            return {}
+        raise KeyError(method)
+
+    async def call_tool(self, name, arguments):
+        if name == "k8s-get-pods":
+            namespace = arguments.get("namespace", "default")
+            return {
+                "content": [{"type": "text", "text": "2 pods"}],
+                "structuredContent": {"items": [
+                    {"metadata": {"name": f"web-{i}", "namespace": namespace}, "status": {"phase": "Running"}}
+                    for i in range(2)
+                ]}
+            }
+        if name == "echo":
+            await asyncio.sleep(arguments.get("delay", 0))
+            return {"content": [{"type": "text", "text": json.dumps({"echo": arguments["value"]})}]}
+        if name == "big-output":
+            return {"content": [{"type": "text", "text": "x" * int(arguments.get("size", 1000))}]}
+        if name == "fail":
+            return {"content": [{"type": "text", "text": "boom"}], "isError": True}
+        if name == "ping-client":
+            request_id = f"srv-{next(self._ids)}"
+            future = asyncio.get_running_loop().create_future()
+            self._pending[request_id] = future
+            await self.send({"jsonrpc": "2.0", "id": request_id, "method": "ping"})
+            reply = await future
+            return {"content": [{"type": "text", "text": json.dumps({"pong": "result" in reply})}]}
+        if name == "k8s-scale-deployment":
+            self.scale_calls += 1
+            await asyncio.sleep(arguments.get("delay", 0))
+            return {"content": [{"type": "text", "text": json.dumps({"calls": self.scale_calls})}]}
+        if name == "add-tool":
+            self.tools.append({
+                "name": arguments["name"],
+                "description": "动态新增的工具",
+                "inputSchema": {"type": "object", "properties": {}}
+            })
+            await self.send({"jsonrpc": "2.0", "method": "notifications/tools/list_changed"})
+            return {"content": [{"type": "text", "text": "ok"}]}
+        return {"content": [{"type": "text", "text": f"Unknown tool: {name}"}], "isError": True}
+
+
+async def main():
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=16 * 1024 * 1024)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    lock = asyncio.Lock()
+
+    async def send(message):
+        async with lock:
+            sys.stdout.buffer.write(json.dumps(message, ensure_ascii=False).encode() + b"\n")
+            sys.stdout.buffer.flush()
+
+    session = MCPServerSession(send)
+    tasks = set()
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        if line.strip():
+            # 每个请求单独处理，响应按完成顺序返回
+            task = asyncio.create_task(session.handle(json.loads(line)))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
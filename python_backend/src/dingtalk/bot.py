@@ -4,17 +4,38 @@
 """
 
 import json
+import asyncio
+import time
 import hashlib
 import hmac
 import base64
 from typing import Dict, List, Optional, Any
 from datetime import datetime
 from loguru import logger
-import httpx
 from pydantic import BaseModel
 
 from ..llm.processor import EnhancedLLMProcessor
-from ..mcp.types import ChatMessage, MCPException
+from ..llm.memory import ConversationMemory, MemoryConfig
+from ..llm.tokens import estimate_message_tokens
+from ..llm.usage import UsageLedger, UsageLedgerConfig
+from ..mcp.types import MCPException
+from ..mcp.deadline import deadline_scope
+from .dispatcher import MessageDispatcher, DispatcherConfig
+from .http_client import DingTalkHTTPClient
+from .dedup import MessageDeduplicator, DedupConfig
+from .sender import OutboundSender, SenderConfig
+from .chunking import ChunkingConfig, ContinuationCache, split_markdown
+from .router import Intent, IntentRouter, IntentRouterConfig, RouteResult
+from .streaming import StreamingConfig, StreamingMetrics, StreamingReply
+
+
+# 为"还有 N 段"提示预留的长度
+CONTINUATION_HINT_RESERVE = 64
+
+# 内置快捷指令，LLM处理器可用时会在启动时加载完整列表
+BASE_SHORTCUTS = ["/pods", "/logs", "/scale", "/status", "/help"]
+
+SYSTEM_PROMPT = "你是一个专业的Kubernetes运维助手，可以帮助用户管理和监控K8s集群。"
 
 
 class DingTalkMessage(BaseModel):
@@ -52,49 +73,240 @@ class DingTalkBot:
         self, 
         webhook_url: str,
         secret: Optional[str] = None,
-        llm_processor: Optional[EnhancedLLMProcessor] = None
+        llm_processor: Optional[EnhancedLLMProcessor] = None,
+        dispatcher_config: Optional[DispatcherConfig] = None,
+        http_client: Optional[DingTalkHTTPClient] = None,
+        dedup_config: Optional[DedupConfig] = None,
+        sender_config: Optional[SenderConfig] = None,
+        chunking_config: Optional[ChunkingConfig] = None,
+        router_config: Optional[IntentRouterConfig] = None,
+        memory_config: Optional[MemoryConfig] = None,
+        streaming_config: Optional[StreamingConfig] = None,
+        usage_config: Optional[UsageLedgerConfig] = None
     ):
         self.webhook_url = webhook_url
         self.secret = secret
         self.llm_processor = llm_processor
+        self.dispatcher = MessageDispatcher(self._process_claimed_message, dispatcher_config)
+        self.deduplicator = MessageDeduplicator(dedup_config)
+        # 出站客户端通常由应用生命周期统一创建和关闭；未传入时自建并自行关闭
+        self._owns_http_client = http_client is None
+        self.http_client = http_client or DingTalkHTTPClient()
+        self.sender = OutboundSender(self.http_client, sender_config)
+        self.chunking = chunking_config or ChunkingConfig()
+        self.continuations = ContinuationCache(
+            self.chunking.continuation_ttl_seconds,
+            self.chunking.max_conversations
+        )
+        self.router = IntentRouter(router_config, BASE_SHORTCUTS)
+        # 路由表对应的工具目录版本，目录更新后在下一条消息前重新加载
+        self._routes_version: Optional[int] = None
+        self.memory = ConversationMemory(memory_config)
+        self.set_llm_processor(llm_processor)
+        self.usage = UsageLedger(usage_config)
+        self.streaming = streaming_config or StreamingConfig()
+        self.streaming_metrics = StreamingMetrics()
+    
+    async def start(self) -> None:
+        """启动后台消息处理"""
+        await self.refresh_routes()
+        self.dispatcher.start()
+    
+    async def refresh_routes(self) -> None:
+        """从LLM处理器加载快捷指令（含动态的 /tool-* 指令）并更新路由表"""
+        if not self.llm_processor:
+            return
+        try:
+            shortcuts = await self.llm_processor.get_available_shortcuts()
+            self.router.update_shortcuts(shortcuts.keys())
+            self._routes_version = self.llm_processor.mcp_client.catalog.version
+        except Exception as e:
+            logger.warning(f"加载快捷指令失败，使用内置指令: {e}")
+    
+    def set_llm_processor(self, llm_processor: Optional[EnhancedLLMProcessor]) -> None:
+        """切换LLM处理器，会话摘要同时改由新实例生成"""
+        self.llm_processor = llm_processor
+        self.memory.set_summarizer(
+            llm_processor.summarize_history if llm_processor and self.memory.config.llm_summary else None
+        )
+    
+    async def stop(self) -> None:
+        """停止后台消息处理"""
+        await self.dispatcher.stop()
+        await self.memory.close()
+        await self.sender.close()
+        if self._owns_http_client:
+            await self.http_client.close()
+    
+    async def handle_webhook(self, body: bytes, headers: Dict[str, str]) -> Dict[str, Any]:
+        """处理原始Webhook请求：验签、解析后交给 process_webhook"""
+        timestamp = headers.get("timestamp")
+        signature = headers.get("sign")
+        if timestamp and signature and not self.verify_signature(timestamp, signature):
+            logger.warning("钉钉Webhook签名验证失败")
+            return {"success": False, "error": "签名验证失败"}
+        
+        try:
+            request_data = json.loads(body)
+        except ValueError as e:
+            logger.error(f"钉钉Webhook请求体解析失败: {e}")
+            return {"success": False, "error": "请求体不是有效的JSON"}
+        
+        return await self.process_webhook(request_data)
         
     async def process_webhook(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
-        """处理钉钉Webhook请求"""
+        """处理钉钉Webhook请求
+        
+        调度器运行时只做解析和入队并立即返回，消息由后台worker处理；
+        否则在当前请求内同步处理。相同 msgId 的重投消息不会被重复处理。
+        """
         try:
             # 解析请求
             webhook_request = DingTalkWebhookRequest(**request_data)
             logger.info(f"收到钉钉消息: {webhook_request.text.get('content', '')}")
             
-            # 处理消息
-            response_content = await self._process_message(webhook_request)
-            
-            # 构建响应
-            response = await self._build_response(webhook_request, response_content)
+            # 幂等检查，必须先于任何处理
+            previous = self.deduplicator.claim(webhook_request.msgId)
+            if previous is not None:
+                logger.info(f"忽略重复的钉钉消息: {webhook_request.msgId}")
+                if self.dispatcher.is_running:
+                    return {"success": True, "message": "重复消息，已忽略", "duplicate": True}
+                # 同步模式下附着到首个副本的处理结果
+                result = await asyncio.shield(previous)
+                return {**result, "duplicate": True}
             
-            # 发送响应
-            await self._send_response(webhook_request.sessionWebhook, response)
+            if self.dispatcher.is_running:
+                if not self.dispatcher.submit(webhook_request.conversationId, webhook_request):
+                    result = {"success": False, "error": "消息队列已满，请稍后重试"}
+                    self.deduplicator.release(webhook_request.msgId, result)
+                    return result
+                return {"success": True, "message": "消息已接收"}
             
-            return {"success": True, "message": "消息处理成功"}
+            with deadline_scope(time.monotonic() + self.dispatcher.config.request_deadline):
+                return await self._process_claimed_message(webhook_request)
             
         except Exception as e:
             logger.error(f"处理钉钉消息失败: {e}")
             return {"success": False, "error": str(e)}
     
-    async def _process_message(self, request: DingTalkWebhookRequest) -> str:
+    async def _process_claimed_message(self, request: DingTalkWebhookRequest) -> Dict[str, Any]:
+        """处理已通过幂等检查的消息，并把结果记录到去重索引"""
+        result = {"success": False, "error": "消息处理被取消"}
+        try:
+            await self.handle_message(request)
+            result = {"success": True, "message": "消息处理成功"}
+            return result
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+            raise
+        finally:
+            self.deduplicator.complete(request.msgId, result)
+    
+    async def handle_message(self, webhook_request: DingTalkWebhookRequest) -> None:
+        """处理单条消息：生成回复并发送到会话"""
+        if self.llm_processor and self.llm_processor.mcp_client.catalog.version != self._routes_version:
+            await self.refresh_routes()
+        route = self._route(webhook_request)
+        
+        # /more 直接从续页缓存翻页，不再调用LLM和工具
+        if route.intent == Intent.MORE:
+            await self._send_next_page(webhook_request)
+            return
+        
+        # 处理消息
+        response_content = await self._process_message(webhook_request, route)
+        if not response_content.strip():
+            # 流式模式下回复已全部推送
+            return
+        
+        # 按Markdown边界分段，前几段直接发送，其余存入续页缓存
+        chunks = split_markdown(
+            response_content,
+            self.chunking.max_message_length - CONTINUATION_HINT_RESERVE
+        )
+        head = chunks[:self.chunking.parts_per_reply]
+        tail = chunks[self.chunking.parts_per_reply:]
+        if tail:
+            self.continuations.put(webhook_request.conversationId, tail)
+        
+        await self._send_chunks(
+            webhook_request, head, len(tail), self._is_markdown_content(response_content)
+        )
+    
+    async def _send_next_page(self, request: DingTalkWebhookRequest) -> None:
+        """发送续页缓存中的下一页"""
+        chunks, remaining = self.continuations.take(
+            request.conversationId, self.chunking.parts_per_reply
+        )
+        if not chunks:
+            chunks = ["📭 没有更多内容了"]
+        await self._send_chunks(request, chunks, remaining)
+    
+    async def _send_chunks(
+        self,
+        request: DingTalkWebhookRequest,
+        chunks: List[str],
+        remaining: int,
+        markdown: Optional[bool] = None
+    ) -> None:
+        """按顺序发送分段，还有剩余时在最后一段附加翻页提示"""
+        chunks = list(chunks)
+        if remaining:
+            chunks[-1] += f"\n\n📄 还有 {remaining} 段内容，发送 /more 继续查看"
+        
+        for chunk in chunks:
+            # 构建响应
+            response = await self._build_response(request, chunk, markdown)
+            
+            # 发送响应
+            await self._send_response(request.sessionWebhook, response)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取机器人运行统计"""
+        return {
+            "dispatcher": self.dispatcher.get_stats().model_dump(),
+            "dedup": self.deduplicator.get_stats().model_dump(),
+            "sender": self.sender.get_stats().model_dump(),
+            "memory": self.memory.get_stats().model_dump(),
+            "streaming": self.streaming_metrics.get_stats().model_dump(),
+            "http": self.http_client.get_stats()
+        }
+    
+    def _route(self, request: DingTalkWebhookRequest) -> RouteResult:
+        """对消息做意图分类"""
+        return self.router.classify(
+            request.text.get("content", ""),
+            request.atUsers,
+            request.chatbotUserId
+        )
+    
+    async def _process_message(
+        self,
+        request: DingTalkWebhookRequest,
+        route: Optional[RouteResult] = None
+    ) -> str:
         """处理消息内容"""
         content = request.text.get("content", "").strip()
+        route = route or self._route(request)
         
-        if not content:
+        if route.intent == Intent.EMPTY:
             return "请发送有效的消息内容"
         
-        # 检查是否为快捷指令
-        if content.startswith("/"):
+        # 快捷指令，未注册的指令直接返回帮助，不交给LLM
+        if route.intent in (Intent.SHORTCUT, Intent.MORE):
+            if not route.known_command:
+                return f"❓ 未知指令: {route.command}\n\n" + self._get_help_message()
             return await self._process_shortcut_command(content, request)
         
-        # 检查是否需要AI处理
-        if self._should_process_with_ai(content, request):
+        # 需要AI处理（被@或命中关键词）
+        if route.intent == Intent.AI:
+            if route.matched_keywords:
+                logger.debug(f"命中关键词 {route.matched_keywords}，交给AI处理")
             return await self._process_with_llm(content, request)
         
+        if route.intent == Intent.HELP:
+            return self._get_help_message()
+        
         # 默认响应
         return self._get_default_response(content)
     
@@ -107,21 +319,43 @@ class DingTalkBot:
         if not self.llm_processor:
             return "❌ LLM处理器未配置，无法执行快捷指令"
         
-        parts = content.split(" ", 1)
-        shortcut = parts[0]
-        additional_content = parts[1] if len(parts) > 1 else ""
+        shortcut, additional_content = self.router.parse_command(content)
         
         try:
+            # 参数有歧义、需要交给 LLM 的指令和对话走同样的配额检查
+            enable_tools = True
+            llm_messages = self.llm_processor.shortcut_messages(shortcut, additional_content)
+            if llm_messages:
+                estimated = estimate_message_tokens(
+                    [m.model_dump() for m in llm_messages], self.llm_processor.config.model
+                )
+                quota = self.usage.check_quota(request.senderId, request.conversationId, estimated)
+                if not quota.allowed:
+                    logger.warning(f"{request.senderNick} 超出配额: {quota.reason}")
+                    return f"⚠️ {quota.reason}，请稍后再试"
+                if quota.degraded:
+                    logger.info(f"{request.senderNick} 超出配额，快捷指令降级处理: {quota.reason}")
+                    enable_tools = False
+            
             context = {
                 "user_id": request.senderId,
                 "user_name": request.senderNick,
                 "conversation_id": request.conversationId
             }
             
+            start_time = time.monotonic()
             result = await self.llm_processor.chat_with_shortcuts(
-                shortcut, additional_content, context
+                shortcut, additional_content, context, enable_tools=enable_tools
+            )
+            self.usage.record(
+                request.senderId, request.conversationId, self.llm_processor.config.model,
+                result, (time.monotonic() - start_time) * 1000, shortcut
             )
             
+            # 记录指令和工具结果，后续追问可以直接引用
+            await self.memory.record(
+                request.conversationId, content, result, self.llm_processor.config.model
+            )
             return result.content
             
         except MCPException as e:
@@ -141,20 +375,48 @@ class DingTalkBot:
             return "❌ LLM处理器未配置"
         
         try:
-            messages = [
-                ChatMessage(
-                    role="system",
-                    content="你是一个专业的Kubernetes运维助手，可以帮助用户管理和监控K8s集群。"
-                ),
-                ChatMessage(
-                    role="user", 
-                    content=content
+            # 带上本会话的历史（按模型token预算裁剪）
+            model = self.llm_processor.config.model
+            messages = self.memory.build_messages(
+                request.conversationId, SYSTEM_PROMPT, content, model
+            )
+            
+            # 发送前按本地估算检查配额：hard 模式拒绝，soft 模式降级为不带工具和历史的精简回答
+            estimated = estimate_message_tokens([m.model_dump() for m in messages], model)
+            quota = self.usage.check_quota(request.senderId, request.conversationId, estimated)
+            if not quota.allowed:
+                logger.warning(f"{request.senderNick} 超出配额: {quota.reason}")
+                return f"⚠️ {quota.reason}，请稍后再试"
+            enable_tools = True
+            if quota.degraded:
+                logger.info(f"{request.senderNick} 超出配额，降级处理: {quota.reason}")
+                messages = [messages[0], messages[-1]]
+                enable_tools = False
+            
+            start_time = time.monotonic()
+            if not self.streaming.enabled:
+                result = await self.llm_processor.chat(messages, enable_tools=enable_tools)
+                reply = None
+            else:
+                # 流式模式：工具进度和已生成的文本边生成边推送，只返回尚未推送的部分
+                reply = StreamingReply(
+                    lambda text: self._push_progress(request, text), self.streaming
                 )
-            ]
+                try:
+                    result = await self.llm_processor.chat(messages, enable_tools=enable_tools, progress=reply)
+                finally:
+                    self.streaming_metrics.record(reply)
             
-            # 启用工具调用
-            result = await self.llm_processor.chat(messages, enable_tools=True)
-            return result.content
+            self.usage.record(
+                request.senderId, request.conversationId, model, result,
+                (time.monotonic() - start_time) * 1000
+            )
+            await self.memory.record(request.conversationId, content, result, model)
+            
+            response = reply.remainder(result.content) if reply else result.content
+            if quota.degraded:
+                response += f"\n\n> ⚠️ {quota.reason}，已切换为精简回答（不调用工具）"
+            return response
             
         except MCPException as e:
             logger.error(f"LLM处理失败: {e}")
@@ -163,25 +425,15 @@ class DingTalkBot:
             logger.error(f"LLM处理异常: {e}")
             return f"❌ AI处理异常: {str(e)}"
     
-    def _should_process_with_ai(
-        self, 
-        content: str, 
-        request: DingTalkWebhookRequest
-    ) -> bool:
-        """判断是否需要AI处理"""
-        # 被@的情况
-        if request.atUsers and any(user.get("dingtalkId") == request.chatbotUserId for user in request.atUsers):
-            return True
-        
-        # 包含关键词的情况
-        keywords = ["帮助", "查看", "监控", "集群", "pod", "deployment", "日志", "状态", "扩缩容"]
-        return any(keyword in content.lower() for keyword in keywords)
+    async def _push_progress(self, request: DingTalkWebhookRequest, text: str) -> None:
+        """推送流式进度，入队即返回，不阻塞LLM流的读取"""
+        response = await self._build_response(request, text, markdown=True)
+        await self.sender.send(
+            request.sessionWebhook, response.model_dump(exclude_none=True), wait=False
+        )
     
     def _get_default_response(self, content: str) -> str:
         """获取默认响应"""
-        if "help" in content.lower() or "帮助" in content:
-            return self._get_help_message()
-        
         return f"收到消息: {content}\n\n💡 使用快捷指令或@我来获取AI助手服务！"
     
     def _get_help_message(self) -> str:
@@ -193,6 +445,7 @@ class DingTalkBot:
 • `/logs <pod名称>` - 查看Pod日志  
 • `/scale <deployment> <副本数>` - 扩缩容
 • `/status` - 集群状态检查
+• `/more` - 查看上一条长回复的剩余内容
 • `/help` - 显示此帮助
 
 **💬 智能对话:**
@@ -208,15 +461,15 @@ class DingTalkBot:
     async def _build_response(
         self, 
         request: DingTalkWebhookRequest, 
-        content: str
+        content: str,
+        markdown: Optional[bool] = None
     ) -> DingTalkMessage:
-        """构建响应消息"""
-        # 限制消息长度
-        if len(content) > 4000:
-            content = content[:3900] + "\n\n... (内容过长，已截断)"
+        """构建响应消息（超长内容已在发送前分段）"""
+        if markdown is None:
+            markdown = self._is_markdown_content(content)
         
         # Markdown格式支持
-        if self._is_markdown_content(content):
+        if markdown:
             return DingTalkMessage(
                 msgtype="markdown",
                 markdown={
@@ -232,27 +485,23 @@ class DingTalkBot:
     
     def _is_markdown_content(self, content: str) -> bool:
         """检查内容是否包含Markdown格式"""
-        markdown_indicators = ["**", "```", "###", "•", "📦", "✅", "❌"]
-        return any(indicator in content for indicator in markdown_indicators)
+        return self.router.is_markdown(content)
     
-    async def _send_response(self, session_webhook: str, message: DingTalkMessage) -> None:
-        """发送响应消息"""
+    async def _send_response(self, session_webhook: str, message: DingTalkMessage) -> bool:
+        """发送响应消息（经出站调度器限流、合并和重试）"""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    session_webhook,
-                    json=message.model_dump(exclude_none=True),
-                    headers={"Content-Type": "application/json"},
-                    timeout=30
-                )
+            success = await self.sender.send(
+                session_webhook,
+                message.model_dump(exclude_none=True)
+            )
+            
+            if success:
+                logger.info("钉钉消息发送成功")
+            return success
                 
-                if response.status_code == 200:
-                    logger.info("钉钉消息发送成功")
-                else:
-                    logger.error(f"钉钉消息发送失败: {response.status_code} - {response.text}")
-                    
         except Exception as e:
             logger.error(f"发送钉钉消息异常: {e}")
+            return False
     
     def verify_signature(self, timestamp: str, signature: str) -> bool:
         """验证钉钉签名"""
@@ -291,21 +540,14 @@ class DingTalkBot:
                     "isAtAll": False
                 }
             
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    webhook_url,
-                    json=message_data,
-                    headers={"Content-Type": "application/json"},
-                    timeout=30
-                )
+            success = await self.sender.send(webhook_url, message_data)
+            
+            if success:
+                logger.info("主动消息发送成功")
+            else:
+                logger.error("主动消息发送失败")
+            return success
                 
-                if response.status_code == 200:
-                    logger.info("主动消息发送成功")
-                    return True
-                else:
-                    logger.error(f"主动消息发送失败: {response.status_code} - {response.text}")
-                    return False
-                    
         except Exception as e:
             logger.error(f"发送主动消息异常: {e}")
             return False
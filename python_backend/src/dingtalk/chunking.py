@@ -0,0 +1,160 @@
+"""
+长消息分段发送
+按 Markdown 安全边界（代码块、列表项、标题、段落）切分超长回复，
+前几段直接发送，剩余部分存入会话续页缓存，由 /more 指令翻页
+"""
+
+import re
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from pydantic import BaseModel, Field
+
+
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+HEADING_PATTERN = re.compile(r"^\s{0,3}#{1,6}\s")
+LIST_ITEM_PATTERN = re.compile(r"^\s*([-*+•]|\d+[.)])\s")
+
+
+class ChunkingConfig(BaseModel):
+    """分段发送配置"""
+    max_message_length: int = Field(default=4000, ge=200, description="单条消息最大长度")
+    parts_per_reply: int = Field(default=3, ge=1, description="每次回复直接发送的段数")
+    continuation_ttl_seconds: float = Field(default=1800.0, gt=0, description="续页缓存保留时间(s)")
+    max_conversations: int = Field(default=500, ge=1, description="续页缓存最多保留的会话数")
+
+
+def split_markdown(content: str, max_length: int) -> List[str]:
+    """按 Markdown 安全边界把内容切分为不超过 max_length 的若干段"""
+    if len(content) <= max_length:
+        return [content]
+
+    chunks: List[str] = []
+    current = ""
+    for block in _parse_blocks(content):
+        for piece in _fit_block(block, max_length):
+            if not current:
+                current = piece
+            elif len(current) + 1 + len(piece) <= max_length:
+                current = f"{current}\n{piece}"
+            else:
+                chunks.append(current.rstrip())
+                current = piece
+    if current.strip():
+        chunks.append(current.rstrip())
+
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def _parse_blocks(content: str) -> List[List[str]]:
+    """把内容解析为块：代码块、标题、列表项（含缩进续行）、段落"""
+    blocks: List[List[str]] = []
+    current: List[str] = []
+    fence: Optional[str] = None
+
+    def flush():
+        nonlocal current
+        if current:
+            blocks.append(current)
+            current = []
+
+    for line in content.split("\n"):
+        if fence:
+            current.append(line)
+            if line.strip().startswith(fence):
+                fence = None
+                flush()
+            continue
+
+        match = FENCE_PATTERN.match(line)
+        if match:
+            flush()
+            fence = match.group(1)
+            current.append(line)
+        elif not line.strip():
+            current.append(line)
+            flush()
+        elif HEADING_PATTERN.match(line) or LIST_ITEM_PATTERN.match(line):
+            flush()
+            current.append(line)
+        else:
+            current.append(line)
+
+    flush()
+    return blocks
+
+
+def _fit_block(block: List[str], max_length: int) -> List[str]:
+    """把单个块拆成不超过 max_length 的片段，代码块拆开时补全围栏"""
+    text = "\n".join(block)
+    if len(text) <= max_length:
+        return [text]
+
+    opener, closer = "", ""
+    lines = block
+    if FENCE_PATTERN.match(block[0]):
+        opener = block[0]
+        fence = FENCE_PATTERN.match(block[0]).group(1)
+        closer = fence
+        lines = block[1:]
+        if lines and lines[-1].strip().startswith(fence):
+            lines = lines[:-1]
+
+    overhead = len(opener) + len(closer) + 2 if opener else 0
+    budget = max_length - overhead
+
+    pieces: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in lines:
+        # 单行超长时硬切
+        segments = [line[i:i + budget] for i in range(0, len(line), budget)] or [""]
+        for segment in segments:
+            if current and size + 1 + len(segment) > budget:
+                pieces.append(current)
+                current, size = [], 0
+            size += len(segment) + (1 if current else 0)
+            current.append(segment)
+    if current:
+        pieces.append(current)
+
+    if opener:
+        return ["\n".join([opener, *piece, closer]) for piece in pieces]
+    return ["\n".join(piece) for piece in pieces]
+
+
+class ContinuationCache:
+    """按会话保存未发送的分段，LRU + TTL 有界"""
+
+    def __init__(self, ttl_seconds: float = 1800.0, max_conversations: int = 500):
+        self.ttl_seconds = ttl_seconds
+        self.max_conversations = max_conversations
+        self._entries: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+
+    def put(self, conversation_id: str, chunks: List[str]) -> None:
+        """保存会话的剩余分段（覆盖之前未看完的内容）"""
+        self._entries[conversation_id] = (time.monotonic() + self.ttl_seconds, list(chunks))
+        self._entries.move_to_end(conversation_id)
+        while len(self._entries) > self.max_conversations:
+            self._entries.popitem(last=False)
+
+    def take(self, conversation_id: str, count: int) -> Tuple[List[str], int]:
+        """取出接下来的 count 段，返回 (分段, 剩余段数)"""
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return [], 0
+
+        expire_at, chunks = entry
+        if expire_at <= time.monotonic():
+            del self._entries[conversation_id]
+            return [], 0
+
+        page, rest = chunks[:count], chunks[count:]
+        if rest:
+            self.put(conversation_id, rest)
+        else:
+            del self._entries[conversation_id]
+        return page, len(rest)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,114 @@
+"""
+钉钉消息幂等去重
+按 msgId 记录已接收的消息，丢弃钉钉因超时重投的重复消息
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from pydantic import BaseModel, Field
+
+
+class DedupConfig(BaseModel):
+    """去重配置"""
+    ttl_seconds: float = Field(default=600.0, gt=0, description="msgId保留时间(s)")
+    max_entries: int = Field(default=10000, ge=1, description="最多保留的msgId数量")
+
+
+class DedupStats(BaseModel):
+    """去重统计信息"""
+    entries: int = Field(default=0, description="当前记录数")
+    in_flight: int = Field(default=0, description="处理中的消息数")
+    accepted: int = Field(default=0, description="首次接收的消息数")
+    duplicates: int = Field(default=0, description="丢弃的重复消息数")
+    attached: int = Field(default=0, description="附着到处理中结果的重复消息数")
+    expired: int = Field(default=0, description="过期清理的记录数")
+    evicted: int = Field(default=0, description="超出容量被淘汰的记录数")
+
+
+class _Entry:
+    """去重记录"""
+    __slots__ = ("future", "expire_at")
+
+    def __init__(self, future: asyncio.Future, expire_at: float):
+        self.future = future
+        self.expire_at = expire_at
+
+
+class MessageDeduplicator:
+    """基于 msgId 的有界 TTL 去重索引
+
+    记录按过期时间顺序保存在 OrderedDict 中，查找、插入和淘汰均为 O(1)；
+    每条记录持有一个 Future，重复消息可以等待首个副本的处理结果。
+    """
+
+    def __init__(self, config: Optional[DedupConfig] = None):
+        self.config = config or DedupConfig()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.stats = DedupStats()
+
+    def claim(self, msg_id: str) -> Optional[asyncio.Future]:
+        """登记消息
+
+        首次出现返回 None，调用方负责处理并在结束后调用 complete；
+        重复出现则返回首个副本的结果 Future（可能已完成，也可能仍在处理中）。
+        """
+        now = time.monotonic()
+        self._purge_expired(now)
+
+        entry = self._entries.get(msg_id)
+        if entry is not None:
+            self.stats.duplicates += 1
+            if not entry.future.done():
+                self.stats.attached += 1
+            return entry.future
+
+        self._entries[msg_id] = _Entry(
+            asyncio.get_running_loop().create_future(),
+            now + self.config.ttl_seconds
+        )
+        self.stats.accepted += 1
+
+        while len(self._entries) > self.config.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evicted += 1
+
+        return None
+
+    def complete(self, msg_id: str, result: Dict[str, Any]) -> None:
+        """记录处理结果；处理失败时移除记录，允许钉钉重投后重新处理"""
+        entry = self._entries.get(msg_id)
+        if entry is None:
+            return
+
+        if not entry.future.done():
+            entry.future.set_result(result)
+
+        if result.get("success"):
+            # 从完成时刻开始计算保留时间
+            entry.expire_at = time.monotonic() + self.config.ttl_seconds
+            self._entries.move_to_end(msg_id)
+        else:
+            del self._entries[msg_id]
+
+    def release(self, msg_id: str, result: Optional[Dict[str, Any]] = None) -> None:
+        """放弃已登记的消息（如入队失败），等待中的重复消息会收到 result"""
+        self.complete(msg_id, result or {"success": False, "error": "消息未被处理"})
+
+    def get_stats(self) -> DedupStats:
+        """获取统计信息"""
+        self._purge_expired(time.monotonic())
+        stats = self.stats.model_copy()
+        stats.entries = len(self._entries)
+        stats.in_flight = sum(1 for entry in self._entries.values() if not entry.future.done())
+        return stats
+
+    def _purge_expired(self, now: float) -> None:
+        """从最早的记录开始清理过期项"""
+        while self._entries:
+            msg_id, entry = next(iter(self._entries.items()))
+            if entry.expire_at > now:
+                break
+            self._entries.popitem(last=False)
+            self.stats.expired += 1
@@ -0,0 +1,167 @@
+"""
+钉钉消息调度器
+Webhook 只负责入队，由后台 asyncio worker 池异步处理消息；
+同一会话内严格按顺序处理，不同会话之间并行执行；
+每条消息从入队起有一个总的处理时限，随调用链传给 LLM 和工具调用
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from ..mcp.deadline import deadline_scope
+
+
+class DispatcherConfig(BaseModel):
+    """调度器配置"""
+    worker_count: int = Field(default=4, ge=1, description="后台worker数量")
+    max_queue_size: int = Field(default=1000, ge=1, description="最大排队消息数")
+    request_deadline: float = Field(
+        default=120.0, gt=0, description="消息从收到起的总处理时限(s)，排队时间也计算在内"
+    )
+
+
+class DispatcherStats(BaseModel):
+    """调度器统计信息"""
+    queue_depth: int = Field(default=0, description="当前排队消息数")
+    max_queue_depth: int = Field(default=0, description="历史最大排队消息数")
+    active_conversations: int = Field(default=0, description="有待处理消息的会话数")
+    enqueued: int = Field(default=0, description="入队消息数")
+    processed: int = Field(default=0, description="处理完成消息数")
+    failed: int = Field(default=0, description="处理失败消息数")
+    rejected: int = Field(default=0, description="队列已满被拒绝的消息数")
+    average_wait_time: float = Field(default=0, description="平均排队时间(ms)")
+    max_wait_time: float = Field(default=0, description="最大排队时间(ms)")
+    worker_count: int = Field(default=0, description="worker数量")
+    busy_workers: int = Field(default=0, description="正在处理消息的worker数")
+    worker_utilization: float = Field(default=0, description="worker利用率(0-1)")
+
+
+class MessageDispatcher:
+    """按会话保序的后台消息调度器"""
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[None]],
+        config: Optional[DispatcherConfig] = None
+    ):
+        self.config = config or DispatcherConfig()
+        self._handler = handler
+        # 每个会话一个待处理队列，元素为 (入队时间, 消息)
+        self._pending: Dict[str, Deque[Tuple[float, Any]]] = {}
+        # 就绪会话队列：同一会话同一时刻最多出现一次，保证会话内串行
+        self._ready: "asyncio.Queue[str]" = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self._depth = 0
+        self._busy = 0
+        self._busy_time = 0.0
+        self._started_at: Optional[float] = None
+        self._total_wait = 0.0
+        self._dequeued = 0
+        self.stats = DispatcherStats(worker_count=self.config.worker_count)
+
+    @property
+    def is_running(self) -> bool:
+        """调度器是否在运行"""
+        return bool(self._workers)
+
+    def start(self) -> None:
+        """启动 worker 池"""
+        if self._workers:
+            return
+        self._started_at = time.monotonic()
+        self._workers = [
+            asyncio.create_task(self._worker_loop(i), name=f"dingtalk-worker-{i}")
+            for i in range(self.config.worker_count)
+        ]
+        logger.info(f"钉钉消息调度器已启动，worker数量: {self.config.worker_count}")
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        """停止 worker 池，尽量先处理完已入队的消息"""
+        if not self._workers:
+            return
+
+        deadline = time.monotonic() + drain_timeout
+        while (self._depth > 0 or self._busy > 0) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        if self._depth > 0:
+            logger.warning(f"调度器停止时仍有 {self._depth} 条消息未处理")
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("钉钉消息调度器已停止")
+
+    def submit(self, key: str, item: Any) -> bool:
+        """提交消息，队列已满时返回 False"""
+        if self._depth >= self.config.max_queue_size:
+            self.stats.rejected += 1
+            logger.warning(f"消息队列已满({self._depth})，拒绝会话 {key} 的消息")
+            return False
+
+        queue = self._pending.get(key)
+        if queue is None:
+            # 会话当前空闲，加入就绪队列
+            queue = deque()
+            self._pending[key] = queue
+            self._ready.put_nowait(key)
+        queue.append((time.monotonic(), item))
+
+        self._depth += 1
+        self.stats.enqueued += 1
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, self._depth)
+        return True
+
+    def get_stats(self) -> DispatcherStats:
+        """获取统计信息"""
+        stats = self.stats.model_copy()
+        stats.queue_depth = self._depth
+        stats.active_conversations = len(self._pending)
+        stats.busy_workers = self._busy
+
+        if self._started_at is not None:
+            elapsed = time.monotonic() - self._started_at
+            capacity = elapsed * self.config.worker_count
+            if capacity > 0:
+                stats.worker_utilization = min(1.0, self._busy_time / capacity)
+        return stats
+
+    async def _worker_loop(self, index: int) -> None:
+        """worker 主循环"""
+        while True:
+            key = await self._ready.get()
+            queue = self._pending[key]
+            enqueued_at, item = queue.popleft()
+            self._depth -= 1
+
+            wait_time = (time.monotonic() - enqueued_at) * 1000
+            self._dequeued += 1
+            self._total_wait += wait_time
+            self.stats.average_wait_time = self._total_wait / self._dequeued
+            self.stats.max_wait_time = max(self.stats.max_wait_time, wait_time)
+
+            self._busy += 1
+            start_time = time.monotonic()
+            try:
+                with deadline_scope(enqueued_at + self.config.request_deadline):
+                    await self._handler(item)
+                self.stats.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats.failed += 1
+                logger.error(f"worker-{index} 处理会话 {key} 的消息失败: {e}")
+            finally:
+                self._busy -= 1
+                self._busy_time += time.monotonic() - start_time
+
+                # 会话还有消息则重新排到队尾，否则释放该会话
+                if queue:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._pending[key]
@@ -0,0 +1,133 @@
+"""
+钉钉出站 HTTP 客户端
+全局共享一个长连接池，避免每条消息都重新建立 TCP+TLS 连接
+"""
+
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+from loguru import logger
+import httpx
+import httpcore
+from pydantic import BaseModel, Field
+
+
+class HTTPClientConfig(BaseModel):
+    """出站 HTTP 客户端配置"""
+    max_connections: int = Field(default=20, ge=1, description="最大连接数")
+    max_keepalive_connections: int = Field(default=10, ge=0, description="最大保活连接数")
+    keepalive_expiry: float = Field(default=30.0, description="空闲连接保活时间(s)")
+    timeout: float = Field(default=30.0, description="请求超时时间(s)")
+    connect_timeout: float = Field(default=5.0, description="建连超时时间(s)")
+    http2: bool = Field(default=False, description="是否启用HTTP/2(需要安装h2)")
+
+
+class HostStats(BaseModel):
+    """单个目标主机的统计信息"""
+    requests: int = Field(default=0, description="请求次数")
+    errors: int = Field(default=0, description="失败次数")
+    in_flight: int = Field(default=0, description="进行中的请求数")
+    average_latency: float = Field(default=0, description="平均请求耗时(ms)")
+    connections: int = Field(default=0, description="连接池中的连接数")
+    idle_connections: int = Field(default=0, description="空闲连接数")
+
+
+class DingTalkHTTPClient:
+    """共享的钉钉出站 HTTP 客户端"""
+
+    def __init__(self, config: Optional[HTTPClientConfig] = None):
+        self.config = config or HTTPClientConfig()
+        self._hosts: Dict[str, HostStats] = {}
+        self._origins: Dict[str, httpcore.Origin] = {}
+        self._transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=self.config.max_connections,
+                max_keepalive_connections=self.config.max_keepalive_connections,
+                keepalive_expiry=self.config.keepalive_expiry
+            ),
+            http2=self._http2_available()
+        )
+        self._client = httpx.AsyncClient(
+            transport=self._transport,
+            timeout=httpx.Timeout(self.config.timeout, connect=self.config.connect_timeout),
+            headers={"Content-Type": "application/json"}
+        )
+
+    @property
+    def is_closed(self) -> bool:
+        """客户端是否已关闭"""
+        return self._client.is_closed
+
+    async def post_json(self, url: str, payload: Dict[str, Any]) -> httpx.Response:
+        """以 JSON 格式 POST 请求"""
+        host = self._track_host(url)
+        stats = self._hosts[host]
+        stats.in_flight += 1
+        start_time = time.monotonic()
+
+        try:
+            response = await self._client.post(url, json=payload)
+            if response.status_code >= 400:
+                stats.errors += 1
+            return response
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.in_flight -= 1
+            stats.requests += 1
+            latency = (time.monotonic() - start_time) * 1000
+            stats.average_latency += (latency - stats.average_latency) / stats.requests
+
+    async def close(self) -> None:
+        """关闭客户端，释放所有连接"""
+        if not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("钉钉出站HTTP客户端已关闭")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取按主机划分的连接池统计"""
+        connections = getattr(getattr(self._transport, "_pool", None), "connections", [])
+
+        hosts = {}
+        for host, stats in self._hosts.items():
+            host_stats = stats.model_copy()
+            origin = self._origins[host]
+            for connection in connections:
+                if connection.can_handle_request(origin):
+                    host_stats.connections += 1
+                    if connection.is_idle():
+                        host_stats.idle_connections += 1
+            hosts[host] = host_stats.model_dump()
+
+        return {
+            "http2": self._http2_available(),
+            "max_connections": self.config.max_connections,
+            "total_connections": len(connections),
+            "hosts": hosts
+        }
+
+    def _track_host(self, url: str) -> str:
+        """登记目标主机，返回主机标识"""
+        parts = urlsplit(url)
+        scheme = parts.scheme or "https"
+        port = parts.port or (443 if scheme == "https" else 80)
+        host = f"{parts.hostname}:{port}"
+        if host not in self._hosts:
+            self._hosts[host] = HostStats()
+            self._origins[host] = httpcore.Origin(
+                scheme.encode(), (parts.hostname or "").encode(), port
+            )
+        return host
+
+    def _http2_available(self) -> bool:
+        """检查是否可以启用 HTTP/2"""
+        if not self.config.http2:
+            return False
+        try:
+            import h2  # noqa: F401
+            return True
+        except ImportError:
+            logger.warning("未安装 h2，HTTP/2 已禁用，回退到 HTTP/1.1")
+            self.config.http2 = False
+            return False
@@ -0,0 +1,180 @@
+"""
+钉钉消息意图路由
+启动时把关键词、快捷指令和@规则预编译为路由表，
+关键词编译为 Aho-Corasick 多模式自动机，每条消息单次扫描完成分类
+"""
+
+from collections import deque
+from enum import Enum
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from pydantic import BaseModel, Field
+
+
+DEFAULT_AI_KEYWORDS = ["帮助", "查看", "监控", "集群", "pod", "deployment", "日志", "状态", "扩缩容"]
+DEFAULT_HELP_KEYWORDS = ["help", "帮助"]
+DEFAULT_MARKDOWN_INDICATORS = ["**", "```", "###", "•", "📦", "✅", "❌"]
+BUILTIN_COMMANDS = {"/more"}
+
+
+class Intent(str, Enum):
+    """消息意图"""
+    EMPTY = "empty"
+    MORE = "more"
+    SHORTCUT = "shortcut"
+    AI = "ai"
+    HELP = "help"
+    DEFAULT = "default"
+
+
+class IntentRouterConfig(BaseModel):
+    """意图路由配置"""
+    ai_keywords: List[str] = Field(default_factory=lambda: list(DEFAULT_AI_KEYWORDS), description="触发AI处理的关键词")
+    help_keywords: List[str] = Field(default_factory=lambda: list(DEFAULT_HELP_KEYWORDS), description="触发帮助信息的关键词")
+    markdown_indicators: List[str] = Field(
+        default_factory=lambda: list(DEFAULT_MARKDOWN_INDICATORS), description="判定为Markdown内容的标记"
+    )
+    respond_to_mention: bool = Field(default=True, description="被@时是否交给AI处理")
+
+
+class RouteResult(BaseModel):
+    """路由结果"""
+    intent: Intent = Field(..., description="消息意图")
+    command: Optional[str] = Field(None, description="指令名称(以/开头)")
+    argument: str = Field(default="", description="指令参数")
+    known_command: bool = Field(default=False, description="是否为已注册的快捷指令")
+    matched_keywords: List[str] = Field(default_factory=list, description="命中的关键词")
+
+
+class KeywordAutomaton:
+    """Aho-Corasick 多模式匹配自动机"""
+
+    def __init__(self, patterns: Iterable[Tuple[str, str]]):
+        """patterns 为 (关键词, 标签) 列表，关键词已按需归一化"""
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[str, str]]] = [[]]
+
+        for keyword, tag in patterns:
+            if keyword:
+                self._insert(keyword, tag)
+        self._build_fail_links()
+
+    def _insert(self, keyword: str, tag: str) -> None:
+        node = 0
+        for char in keyword:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append((keyword, tag))
+
+    def _build_fail_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def search(self, text: str) -> List[Tuple[str, str]]:
+        """单次扫描返回所有命中的 (关键词, 标签)，按首次出现顺序去重"""
+        matches: List[Tuple[str, str]] = []
+        seen: Set[Tuple[str, str]] = set()
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for match in output[node]:
+                if match not in seen:
+                    seen.add(match)
+                    matches.append(match)
+        return matches
+
+    def contains_any(self, text: str) -> bool:
+        """是否命中任意关键词（命中即停止扫描）"""
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                return True
+        return False
+
+
+class IntentRouter:
+    """消息意图路由器"""
+
+    def __init__(self, config: Optional[IntentRouterConfig] = None, shortcuts: Iterable[str] = ()):
+        self.config = config or IntentRouterConfig()
+        self._keywords = KeywordAutomaton(
+            [(k.lower(), Intent.AI.value) for k in self.config.ai_keywords] +
+            [(k.lower(), Intent.HELP.value) for k in self.config.help_keywords]
+        )
+        self._markdown = KeywordAutomaton((k, "markdown") for k in self.config.markdown_indicators)
+        self._shortcuts: Set[str] = set()
+        self.update_shortcuts(shortcuts)
+
+    def update_shortcuts(self, shortcuts: Iterable[str]) -> None:
+        """更新已注册的快捷指令（包括动态的 /tool-* 指令）"""
+        self._shortcuts = set(shortcuts) | BUILTIN_COMMANDS
+
+    @property
+    def shortcuts(self) -> Set[str]:
+        """已注册的快捷指令"""
+        return set(self._shortcuts)
+
+    def classify(
+        self,
+        content: str,
+        at_users: Optional[List[Dict[str, str]]] = None,
+        chatbot_user_id: Optional[str] = None
+    ) -> RouteResult:
+        """对消息分类"""
+        content = content.strip()
+        if not content:
+            return RouteResult(intent=Intent.EMPTY)
+
+        if content.startswith("/"):
+            command, argument = self.parse_command(content)
+            return RouteResult(
+                intent=Intent.MORE if command == "/more" else Intent.SHORTCUT,
+                command=command,
+                argument=argument,
+                known_command=command in self._shortcuts
+            )
+
+        if self.config.respond_to_mention and at_users and chatbot_user_id and any(
+            user.get("dingtalkId") == chatbot_user_id for user in at_users
+        ):
+            return RouteResult(intent=Intent.AI)
+
+        matches = self._keywords.search(content.lower())
+        tags = {tag for _, tag in matches}
+        keywords = [keyword for keyword, _ in matches]
+        if Intent.AI.value in tags:
+            return RouteResult(intent=Intent.AI, matched_keywords=keywords)
+        if Intent.HELP.value in tags:
+            return RouteResult(intent=Intent.HELP, matched_keywords=keywords)
+        return RouteResult(intent=Intent.DEFAULT)
+
+    def is_markdown(self, content: str) -> bool:
+        """内容是否包含Markdown格式"""
+        return self._markdown.contains_any(content)
+
+    @staticmethod
+    def parse_command(content: str) -> Tuple[str, str]:
+        """拆分指令名称和参数"""
+        parts = content.strip().split(None, 1)
+        return parts[0], parts[1].strip() if len(parts) > 1 else ""
@@ -0,0 +1,311 @@
+"""
+钉钉出站消息调度
+按 Webhook 做令牌桶限流（钉钉自定义机器人约 20 条/分钟），
+超限的消息排队发送，同一会话排队中的消息尽量合并为一条 Markdown，
+遇到限流响应时退避重试
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from .http_client import DingTalkHTTPClient
+
+
+# 钉钉限流错误码：发送过快
+THROTTLE_ERROR_CODES = {130101, 410100}
+
+MERGE_SEPARATOR = "\n\n---\n\n"
+
+
+class SenderConfig(BaseModel):
+    """出站消息调度配置"""
+    rate_per_minute: float = Field(default=20.0, gt=0, description="每个Webhook每分钟最多发送条数")
+    burst: int = Field(default=5, ge=1, description="令牌桶容量(允许的突发条数)")
+    max_queue_size: int = Field(default=100, ge=1, description="每个Webhook最多排队条数")
+    max_retries: int = Field(default=3, ge=0, description="限流或网络错误时的最大重试次数")
+    retry_backoff: float = Field(default=1.0, gt=0, description="重试退避基数(s)")
+    enable_merge: bool = Field(default=True, description="是否合并同一会话排队中的消息")
+    max_message_length: int = Field(default=4000, description="合并后消息的最大长度")
+    max_webhooks: int = Field(default=1000, ge=1, description="保留限流状态的Webhook数量上限")
+
+
+class SenderStats(BaseModel):
+    """出站消息统计信息"""
+    webhooks: int = Field(default=0, description="跟踪中的Webhook数")
+    queued: int = Field(default=0, description="当前排队消息数")
+    enqueued: int = Field(default=0, description="入队消息数")
+    sent: int = Field(default=0, description="成功发送的请求数")
+    merged: int = Field(default=0, description="被合并进其他消息的条数")
+    dropped: int = Field(default=0, description="丢弃的消息数(队列满或重试耗尽)")
+    failed: int = Field(default=0, description="发送失败的请求数")
+    throttled: int = Field(default=0, description="收到限流响应的次数")
+    retries: int = Field(default=0, description="重试次数")
+    average_queue_latency: float = Field(default=0, description="平均排队时间(ms)")
+    max_queue_latency: float = Field(default=0, description="最大排队时间(ms)")
+
+
+class TokenBucket:
+    """令牌桶"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        """获取一个令牌，不足时等待"""
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def drain(self) -> None:
+        """清空令牌（收到限流响应后放慢发送）"""
+        self._refill()
+        self.tokens = 0
+
+    def is_full(self) -> bool:
+        """令牌是否已补满"""
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class _OutboundMessage:
+    """排队中的出站消息"""
+    __slots__ = ("payload", "conversation_key", "enqueued_at", "future")
+
+    def __init__(self, payload: Dict[str, Any], conversation_key: str, future: asyncio.Future):
+        self.payload = payload
+        self.conversation_key = conversation_key
+        self.enqueued_at = time.monotonic()
+        self.future = future
+
+
+class _WebhookState:
+    """单个Webhook的限流状态和发送队列"""
+
+    def __init__(self, config: SenderConfig):
+        self.bucket = TokenBucket(config.rate_per_minute / 60, config.burst)
+        self.queue: Deque[_OutboundMessage] = deque()
+        self.worker: Optional[asyncio.Task] = None
+
+
+class OutboundSender:
+    """按 Webhook 限流、合并和重试的出站消息调度器"""
+
+    def __init__(self, http_client: DingTalkHTTPClient, config: Optional[SenderConfig] = None):
+        self.config = config or SenderConfig()
+        self.http_client = http_client
+        self._webhooks: Dict[str, _WebhookState] = {}
+        self._total_latency = 0.0
+        self._delivered = 0
+        self.stats = SenderStats()
+
+    async def send(
+        self,
+        webhook_url: str,
+        payload: Dict[str, Any],
+        conversation_key: Optional[str] = None,
+        wait: bool = True
+    ) -> bool:
+        """发送消息
+
+        消息按 Webhook 排队发送；wait=False 时入队后立即返回 True，
+        否则等待发送结果（被合并的消息随合并后的消息一起返回）。
+        """
+        if webhook_url not in self._webhooks and len(self._webhooks) >= self.config.max_webhooks:
+            self._purge_idle()
+
+        state = self._webhooks.setdefault(webhook_url, _WebhookState(self.config))
+        if len(state.queue) >= self.config.max_queue_size:
+            self.stats.dropped += 1
+            logger.error(f"钉钉出站队列已满({len(state.queue)})，丢弃消息")
+            return False
+
+        message = _OutboundMessage(
+            payload,
+            conversation_key or webhook_url,
+            asyncio.get_running_loop().create_future()
+        )
+        state.queue.append(message)
+        self.stats.enqueued += 1
+
+        if state.worker is None:
+            state.worker = asyncio.create_task(self._drain(webhook_url, state))
+
+        if not wait:
+            return True
+        return await asyncio.shield(message.future)
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """等待排队中的消息发送完毕后停止"""
+        workers = [state.worker for state in self._webhooks.values() if state.worker]
+        if not workers:
+            return
+
+        done, pending = await asyncio.wait(workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        for state in self._webhooks.values():
+            while state.queue:
+                self._resolve([state.queue.popleft()], False)
+                self.stats.dropped += 1
+
+    def get_stats(self) -> SenderStats:
+        """获取统计信息"""
+        stats = self.stats.model_copy()
+        stats.webhooks = len(self._webhooks)
+        stats.queued = sum(len(state.queue) for state in self._webhooks.values())
+        return stats
+
+    async def _drain(self, webhook_url: str, state: _WebhookState) -> None:
+        """依次发送某个Webhook排队中的消息"""
+        try:
+            while state.queue:
+                await state.bucket.acquire()
+                batch = self._take_batch(state)
+                payload = self._merge_payloads(batch)
+
+                now = time.monotonic()
+                for message in batch:
+                    latency = (now - message.enqueued_at) * 1000
+                    self._delivered += 1
+                    self._total_latency += latency
+                    self.stats.max_queue_latency = max(self.stats.max_queue_latency, latency)
+                self.stats.average_queue_latency = self._total_latency / self._delivered
+
+                try:
+                    success = await self._deliver(webhook_url, state, payload)
+                except asyncio.CancelledError:
+                    # 关闭时被取消：已取出的消息不在队列中，在这里通知等待方
+                    self.stats.dropped += len(batch)
+                    self._resolve(batch, False)
+                    raise
+                if not success:
+                    self.stats.dropped += len(batch)
+                self._resolve(batch, success)
+        finally:
+            state.worker = None
+
+    def _take_batch(self, state: _WebhookState) -> List[_OutboundMessage]:
+        """取出队首消息，并尽量合并同一会话排队中的后续消息"""
+        head = state.queue.popleft()
+        batch = [head]
+        if not self.config.enable_merge or not self._is_mergeable(head.payload):
+            return batch
+
+        length = len(self._message_text(head.payload))
+        remaining: Deque[_OutboundMessage] = deque()
+        while state.queue:
+            message = state.queue.popleft()
+            if (
+                message.conversation_key == head.conversation_key
+                and self._is_mergeable(message.payload)
+                and length + len(MERGE_SEPARATOR) + len(self._message_text(message.payload))
+                <= self.config.max_message_length
+            ):
+                batch.append(message)
+                length += len(MERGE_SEPARATOR) + len(self._message_text(message.payload))
+            else:
+                remaining.append(message)
+        state.queue.extend(remaining)
+
+        self.stats.merged += len(batch) - 1
+        return batch
+
+    def _merge_payloads(self, batch: List[_OutboundMessage]) -> Dict[str, Any]:
+        """把多条消息合并为一条 Markdown 消息"""
+        if len(batch) == 1:
+            return batch[0].payload
+
+        head = batch[0].payload
+        title = head.get("markdown", {}).get("title") or "K8s运维助手"
+        return {
+            "msgtype": "markdown",
+            "markdown": {
+                "title": title,
+                "text": MERGE_SEPARATOR.join(self._message_text(m.payload) for m in batch)
+            }
+        }
+
+    async def _deliver(self, webhook_url: str, state: _WebhookState, payload: Dict[str, Any]) -> bool:
+        """发送单条消息，限流或网络错误时退避重试"""
+        for attempt in range(self.config.max_retries + 1):
+            if attempt > 0:
+                self.stats.retries += 1
+                backoff = self.config.retry_backoff * (2 ** (attempt - 1))
+                await asyncio.sleep(backoff + random.uniform(0, backoff / 2))
+                await state.bucket.acquire()
+
+            try:
+                response = await self.http_client.post_json(webhook_url, payload)
+            except Exception as e:
+                logger.warning(f"发送钉钉消息异常(第{attempt + 1}次): {e}")
+                continue
+
+            errcode = self._error_code(response)
+            if response.status_code == 429 or errcode in THROTTLE_ERROR_CODES:
+                self.stats.throttled += 1
+                state.bucket.drain()
+                logger.warning(f"钉钉消息被限流(第{attempt + 1}次)，退避后重试")
+                continue
+
+            if response.status_code == 200 and not errcode:
+                self.stats.sent += 1
+                return True
+
+            # 其他错误重试也无济于事
+            self.stats.failed += 1
+            logger.error(f"钉钉消息发送失败: {response.status_code} - {response.text}")
+            return False
+
+        self.stats.failed += 1
+        logger.error(f"钉钉消息重试{self.config.max_retries}次后仍发送失败，已丢弃")
+        return False
+
+    def _purge_idle(self) -> None:
+        """清理空闲且令牌已补满的Webhook状态"""
+        for webhook_url in list(self._webhooks):
+            state = self._webhooks[webhook_url]
+            if not state.queue and state.worker is None and state.bucket.is_full():
+                del self._webhooks[webhook_url]
+
+    @staticmethod
+    def _resolve(batch: List[_OutboundMessage], success: bool) -> None:
+        for message in batch:
+            if not message.future.done():
+                message.future.set_result(success)
+
+    @staticmethod
+    def _is_mergeable(payload: Dict[str, Any]) -> bool:
+        """只有不带@的文本/Markdown消息可以合并"""
+        return payload.get("msgtype") in ("text", "markdown") and not payload.get("at")
+
+    @staticmethod
+    def _message_text(payload: Dict[str, Any]) -> str:
+        if payload.get("msgtype") == "markdown":
+            return payload.get("markdown", {}).get("text", "")
+        return payload.get("text", {}).get("content", "")
+
+    @staticmethod
+    def _error_code(response) -> Optional[int]:
+        """解析钉钉响应中的 errcode"""
+        try:
+            return response.json().get("errcode")
+        except Exception:
+            return None
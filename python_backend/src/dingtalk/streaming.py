@@ -0,0 +1,141 @@
+"""
+流式回复
+接收 LLM 处理器的进度事件：工具调用开始/结束时推送进度，
+回答文本按句子或段落边界节流推送，并记录首字节时间
+"""
+
+import re
+import time
+from typing import Awaitable, Callable, Optional
+from pydantic import BaseModel, Field
+
+from ..mcp.types import StreamEvent
+
+
+# 可以断开推送的位置：段落、换行、句末标点之后
+PARAGRAPH_BOUNDARY = re.compile(r"\n\n")
+SENTENCE_BOUNDARY = re.compile(r"[。！？!?；;]|\.(\s|$)|\n")
+
+
+class StreamingConfig(BaseModel):
+    """流式回复配置"""
+    enabled: bool = Field(default=False, description="是否启用流式回复")
+    min_interval: float = Field(default=3.0, ge=0, description="两次推送文本的最小间隔(s)")
+    min_chars: int = Field(default=80, ge=1, description="单次推送的最小字符数")
+    show_tool_progress: bool = Field(default=True, description="是否推送工具调用进度")
+
+
+class StreamingStats(BaseModel):
+    """流式回复统计信息"""
+    replies: int = Field(default=0, description="流式回复次数")
+    pushes: int = Field(default=0, description="推送的消息条数")
+    average_first_byte_ms: float = Field(default=0, description="平均首条推送时间(ms)")
+    max_first_byte_ms: float = Field(default=0, description="最大首条推送时间(ms)")
+    average_first_token_ms: float = Field(default=0, description="平均LLM首个文本增量时间(ms)")
+
+
+class StreamingReply:
+    """单次回复的流式推送状态，实例本身即为进度回调"""
+
+    def __init__(self, push: Callable[[str], Awaitable[None]], config: StreamingConfig):
+        self.config = config
+        self._push = push
+        self._started_at = time.monotonic()
+        self._last_push = 0.0
+        self._buffer = ""
+        # 当前这次 completion 已推送的文本，用于计算最终回复中尚未发送的部分
+        self._segment_sent = ""
+        self.pushes = 0
+        self.first_byte_ms: Optional[float] = None
+        self.first_token_ms: Optional[float] = None
+
+    async def __call__(self, event: StreamEvent) -> None:
+        if event.type == "text" and event.text:
+            if self.first_token_ms is None:
+                self.first_token_ms = self._elapsed_ms()
+            self._buffer += event.text
+            await self._flush_ready()
+
+        elif event.type == "tool_start":
+            # 工具调用后会开始新的 completion，之前未推送的文本不再属于最终回复
+            self._buffer = ""
+            self._segment_sent = ""
+            if self.config.show_tool_progress:
+                await self._send(f"🔧 正在调用 **{event.tool_name}** ...")
+
+        elif event.type == "tool_end" and self.config.show_tool_progress:
+            status = "✅ 完成" if event.success else "❌ 失败"
+            await self._send(f"{status} **{event.tool_name}** ({event.elapsed_ms or 0:.0f}ms)")
+
+    def remainder(self, final_content: str) -> str:
+        """返回最终回复中尚未推送的部分"""
+        if self._segment_sent and final_content.startswith(self._segment_sent):
+            return final_content[len(self._segment_sent):].lstrip("\n")
+        return final_content
+
+    async def _flush_ready(self) -> None:
+        """缓冲区足够长且距上次推送足够久时，推送到最后一个安全边界"""
+        if len(self._buffer) < self.config.min_chars:
+            return
+        if time.monotonic() - self._last_push < self.config.min_interval:
+            return
+
+        cut = self._find_boundary()
+        if cut <= 0:
+            return
+
+        text, self._buffer = self._buffer[:cut], self._buffer[cut:]
+        self._segment_sent += text
+        await self._send(text.rstrip())
+
+    def _find_boundary(self) -> int:
+        """优先在段落边界断开，其次句子边界；不在代码块内部断开"""
+        for pattern in (PARAGRAPH_BOUNDARY, SENTENCE_BOUNDARY):
+            for match in reversed(list(pattern.finditer(self._buffer))):
+                cut = match.end()
+                if (self._segment_sent + self._buffer[:cut]).count("```") % 2 == 0:
+                    return cut
+        return 0
+
+    async def _send(self, text: str) -> None:
+        if not text.strip():
+            return
+        if self.first_byte_ms is None:
+            self.first_byte_ms = self._elapsed_ms()
+        self._last_push = time.monotonic()
+        self.pushes += 1
+        await self._push(text)
+
+    def _elapsed_ms(self) -> float:
+        return (time.monotonic() - self._started_at) * 1000
+
+
+class StreamingMetrics:
+    """汇总各次流式回复的指标"""
+
+    def __init__(self):
+        self.stats = StreamingStats()
+        self._first_byte_total = 0.0
+        self._first_byte_count = 0
+        self._first_token_total = 0.0
+        self._first_token_count = 0
+
+    def record(self, reply: StreamingReply) -> None:
+        """记录一次流式回复"""
+        self.stats.replies += 1
+        self.stats.pushes += reply.pushes
+
+        if reply.first_byte_ms is not None:
+            self._first_byte_count += 1
+            self._first_byte_total += reply.first_byte_ms
+            self.stats.average_first_byte_ms = self._first_byte_total / self._first_byte_count
+            self.stats.max_first_byte_ms = max(self.stats.max_first_byte_ms, reply.first_byte_ms)
+
+        if reply.first_token_ms is not None:
+            self._first_token_count += 1
+            self._first_token_total += reply.first_token_ms
+            self.stats.average_first_token_ms = self._first_token_total / self._first_token_count
+
+    def get_stats(self) -> StreamingStats:
+        """获取统计信息"""
+        return self.stats.model_copy()
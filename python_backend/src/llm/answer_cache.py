@@ -0,0 +1,135 @@
+"""
+LLM 回答缓存
+以规范化后的消息列表、模型、温度和 MCP 数据版本为键缓存 chat 的结果，
+短 TTL + LRU（条数和内存上限），扩缩容等会修改集群状态的请求不走缓存
+"""
+
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from pydantic import BaseModel, Field
+
+from ..mcp.types import ChatMessage, ProcessResult
+
+
+# 规范化时去掉的结尾标点
+TRAILING_PUNCTUATION = "?？。.!！~～ "
+WHITESPACE = re.compile(r"\s+")
+
+
+class AnswerCacheConfig(BaseModel):
+    """LLM 回答缓存配置"""
+    enabled: bool = Field(default=True, description="是否启用回答缓存")
+    ttl_seconds: float = Field(default=120.0, gt=0, description="缓存有效期(s)")
+    max_entries: int = Field(default=500, ge=1, description="最多缓存的回答数")
+    max_bytes: int = Field(default=5 * 1024 * 1024, ge=1024, description="缓存占用内存上限(字节)")
+    bypass_keywords: List[str] = Field(
+        default_factory=lambda: ["扩容", "缩容", "扩缩容", "scale", "重启", "restart", "删除", "delete", "回滚", "rollback"],
+        description="用户消息包含这些关键词时不走缓存（会修改集群状态）"
+    )
+
+
+class AnswerCacheStats(BaseModel):
+    """LLM 回答缓存统计信息"""
+    lookups: int = Field(default=0, description="查询次数")
+    hits: int = Field(default=0, description="命中次数")
+    bypassed: int = Field(default=0, description="按规则跳过缓存的次数")
+    stores: int = Field(default=0, description="写入次数")
+    evictions: int = Field(default=0, description="LRU淘汰次数")
+    entries: int = Field(default=0, description="当前缓存条数")
+    bytes: int = Field(default=0, description="当前占用内存(字节)")
+    hit_rate: float = Field(default=0, description="命中率")
+    tokens_saved: int = Field(default=0, description="命中缓存节省的token数")
+
+
+class AnswerCache:
+    """带 TTL 和 LRU 淘汰的回答缓存"""
+
+    def __init__(self, config: Optional[AnswerCacheConfig] = None):
+        self.config = config or AnswerCacheConfig()
+        # key -> (过期时间, 结果, 占用字节数)
+        self._entries: "OrderedDict[str, Tuple[float, ProcessResult, int]]" = OrderedDict()
+        self._bytes = 0
+        self.stats = AnswerCacheStats()
+
+    def should_bypass(self, messages: List[ChatMessage]) -> bool:
+        """最后一条用户消息是修改类请求时不走缓存"""
+        user_content = next((m.content for m in reversed(messages) if m.role == "user"), "")
+        lowered = user_content.lower()
+        if any(keyword.lower() in lowered for keyword in self.config.bypass_keywords):
+            self.stats.bypassed += 1
+            return True
+        return False
+
+    @staticmethod
+    def make_key(
+        messages: List[ChatMessage],
+        model: str,
+        temperature: float,
+        data_version: str,
+        enable_tools: bool
+    ) -> str:
+        """生成缓存键"""
+        normalized = [
+            [message.role, WHITESPACE.sub(" ", message.content).strip().rstrip(TRAILING_PUNCTUATION).lower()]
+            for message in messages
+        ]
+        payload = json.dumps(
+            [normalized, model, temperature, data_version, enable_tools],
+            ensure_ascii=False, separators=(",", ":")
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[ProcessResult]:
+        """查询缓存，命中时返回结果副本"""
+        self.stats.lookups += 1
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expire_at, result, _ = entry
+        if expire_at <= time.monotonic():
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        self.stats.tokens_saved += (result.usage or {}).get("total_tokens", 0)
+        return result.model_copy(deep=True, update={"from_cache": True})
+
+    def put(self, key: str, result: ProcessResult) -> None:
+        """写入缓存"""
+        size = len(result.model_dump_json())
+        if size > self.config.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.config.ttl_seconds, result.model_copy(deep=True), size)
+        self._bytes += size
+        self.stats.stores += 1
+
+        while len(self._entries) > self.config.max_entries or self._bytes > self.config.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats.evictions += 1
+
+    def clear(self) -> None:
+        """清空缓存"""
+        self._entries.clear()
+        self._bytes = 0
+
+    def get_stats(self) -> AnswerCacheStats:
+        """获取统计信息"""
+        stats = self.stats.model_copy()
+        stats.entries = len(self._entries)
+        stats.bytes = self._bytes
+        stats.hit_rate = stats.hits / stats.lookups if stats.lookups else 0
+        return stats
+
+    def _remove(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
@@ -0,0 +1,213 @@
+"""
+工具结果压缩
+工具结果写入 tool 消息前：按工具投影 Kubernetes 对象的关键字段，
+同构列表渲染为表格，其余使用紧凑 JSON，超出 token 预算时截断并注明省略了什么
+"""
+
+import json
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, Field
+
+from .tokens import estimate_tokens
+
+
+# 各工具返回的 Kubernetes 对象保留的字段：列名 -> 字段路径（`[]` 表示对列表逐项取值）
+TOOL_PROJECTIONS: Dict[str, Dict[str, str]] = {
+    "k8s-get-pods": {
+        "name": "metadata.name",
+        "namespace": "metadata.namespace",
+        "phase": "status.phase",
+        "restarts": "status.containerStatuses[].restartCount",
+        "node": "spec.nodeName",
+        "images": "spec.containers[].image",
+    },
+    "k8s-describe-pod": {
+        "pod_name": "pod_name",
+        "namespace": "namespace",
+        "status": "status",
+        "node": "node",
+        "ip": "ip",
+        "containers": "containers",
+        "events": "events",
+    },
+}
+
+# 截断时保留末尾的工具（日志最新的内容在最后）
+TAIL_TRUNCATE_TOOLS = {"k8s-get-logs"}
+
+# 未配置投影的工具返回 Kubernetes 对象列表时使用的字段
+DEFAULT_K8S_PROJECTION: Dict[str, str] = {
+    "kind": "kind",
+    "name": "metadata.name",
+    "namespace": "metadata.namespace",
+    "phase": "status.phase",
+}
+
+
+class CompactionConfig(BaseModel):
+    """工具结果压缩配置"""
+    enabled: bool = Field(default=True, description="是否启用压缩，关闭时使用原始的缩进 JSON")
+    max_tokens: int = Field(default=1500, ge=50, description="单个工具结果的token上限")
+    table_min_rows: int = Field(default=2, ge=1, description="同构列表至少多少行时渲染为表格")
+    max_cell_chars: int = Field(default=120, ge=10, description="表格单元格的最大字符数")
+
+
+class CompactionStats(BaseModel):
+    """工具结果压缩统计信息"""
+    results: int = Field(default=0, description="压缩的工具结果数")
+    original_tokens: int = Field(default=0, description="压缩前的token总数(缩进JSON)")
+    compacted_tokens: int = Field(default=0, description="压缩后的token总数")
+    truncated: int = Field(default=0, description="因超出预算被截断的结果数")
+    saved_ratio: float = Field(default=0, description="节省的token比例")
+
+
+class ToolResultCompactor:
+    """把工具结果压缩为适合放入 LLM 上下文的文本"""
+
+    def __init__(self, config: Optional[CompactionConfig] = None):
+        self.config = config or CompactionConfig()
+        self.stats = CompactionStats()
+
+    def compact(self, tool_name: str, result: Any, model: str = "gpt-3.5-turbo") -> str:
+        """压缩单个工具结果"""
+        original = json.dumps(result, ensure_ascii=False, indent=2, default=str)
+        if not self.config.enabled:
+            return original
+
+        text = self._render(self._project(tool_name, result))
+        tokens = estimate_tokens(text, model)
+        if tokens > self.config.max_tokens:
+            text = self._truncate(text, tokens, model, tail=tool_name in TAIL_TRUNCATE_TOOLS)
+            tokens = estimate_tokens(text, model)
+            self.stats.truncated += 1
+
+        self.stats.results += 1
+        self.stats.original_tokens += estimate_tokens(original, model)
+        self.stats.compacted_tokens += tokens
+        return text
+
+    def get_stats(self) -> CompactionStats:
+        """获取统计信息"""
+        stats = self.stats.model_copy()
+        if stats.original_tokens:
+            stats.saved_ratio = 1 - stats.compacted_tokens / stats.original_tokens
+        return stats
+
+    def _project(self, tool_name: str, result: Any) -> Any:
+        """按工具投影需要的字段，Kubernetes 列表中的每一项都只保留投影字段"""
+        projection = TOOL_PROJECTIONS.get(tool_name)
+
+        if isinstance(result, dict) and isinstance(result.get("items"), list):
+            items = result["items"]
+            if items and all(isinstance(item, dict) and "metadata" in item for item in items):
+                fields = projection or DEFAULT_K8S_PROJECTION
+                items = self._drop_empty_columns([self._project_object(item, fields) for item in items])
+            return {**{k: v for k, v in result.items() if k != "items"}, "items": items}
+
+        if isinstance(result, dict) and projection and any(path.split(".")[0] in result for path in projection.values()):
+            return self._project_object(result, projection)
+
+        return result
+
+    def _project_object(self, obj: Dict[str, Any], fields: Dict[str, str]) -> Dict[str, Any]:
+        projected = {}
+        for column, path in fields.items():
+            value = _extract(obj, path.split("."))
+            if value not in (None, [], {}):
+                projected[column] = value
+        return projected
+
+    @staticmethod
+    def _drop_empty_columns(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """统一各行的列，所有行都缺失的列不保留"""
+        columns: List[str] = []
+        for row in rows:
+            columns.extend(column for column in row if column not in columns)
+        return [{column: row.get(column) for column in columns} for row in rows]
+
+    def _render(self, value: Any) -> str:
+        """同构列表渲染为表格，其余使用紧凑 JSON"""
+        if isinstance(value, dict) and isinstance(value.get("items"), list):
+            rest = {k: v for k, v in value.items() if k != "items"}
+            table = self._render_table(value["items"])
+            if table is not None:
+                head = _dumps(rest) + "\n" if rest else ""
+                return f"{head}items({len(value['items'])}):\n{table}"
+        if isinstance(value, list):
+            table = self._render_table(value)
+            if table is not None:
+                return f"items({len(value)}):\n{table}"
+        return _dumps(value)
+
+    def _render_table(self, rows: List[Any]) -> Optional[str]:
+        if len(rows) < self.config.table_min_rows or not all(isinstance(row, dict) for row in rows):
+            return None
+        columns = list(rows[0].keys())
+        if not columns or any(list(row.keys()) != columns for row in rows):
+            return None
+
+        lines = ["|".join(columns)]
+        for row in rows:
+            lines.append("|".join(self._render_cell(row[column]) for column in columns))
+        return "\n".join(lines)
+
+    def _render_cell(self, value: Any) -> str:
+        if value is None:
+            text = "-"
+        elif isinstance(value, list) and all(not isinstance(v, (dict, list)) for v in value):
+            text = ",".join(str(v) for v in value)
+        elif isinstance(value, (dict, list)):
+            text = _dumps(value)
+        else:
+            text = str(value)
+        text = text.replace("|", "/").replace("\n", " ")
+        if len(text) > self.config.max_cell_chars:
+            text = text[:self.config.max_cell_chars - 1] + "…"
+        return text
+
+    def _truncate(self, text: str, tokens: int, model: str, tail: bool = False) -> str:
+        """截断到 token 预算内：表格按行截断，其余按字符截断，并注明省略的内容"""
+        budget = self.config.max_tokens
+        lines = text.split("\n")
+        header_index = next((i for i, line in enumerate(lines) if line.startswith("items(")), None)
+
+        if header_index is not None and len(lines) > header_index + 2:
+            head, rows = lines[:header_index + 2], lines[header_index + 2:]
+            used = estimate_tokens("\n".join(head), model)
+            kept = 0
+            for row in rows:
+                cost = estimate_tokens(row, model) + 1
+                if used + cost > budget:
+                    break
+                used += cost
+                kept += 1
+            note = f"[已截断: 共 {len(rows)} 行，仅保留前 {kept} 行，其余 {len(rows) - kept} 行已省略]"
+            return "\n".join(head + rows[:kept] + [note])
+
+        keep_chars = max(int(len(text) * budget / tokens) - 40, 0)
+        if tail:
+            note = f"[已截断: 原结果约 {tokens} tokens，仅保留最后 {keep_chars} 个字符]"
+            return note + "\n" + text[len(text) - keep_chars:]
+        note = f"[已截断: 原结果约 {tokens} tokens，仅保留前 {keep_chars} 个字符]"
+        return text[:keep_chars] + "\n" + note
+
+
+def _extract(value: Any, path: List[str]) -> Any:
+    """按路径取值，`key[]` 表示对列表中的每一项继续取值"""
+    for index, key in enumerate(path):
+        each = key.endswith("[]")
+        if each:
+            key = key[:-2]
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+        if each:
+            if not isinstance(value, list):
+                return None
+            values = [_extract(item, path[index + 1:]) for item in value]
+            return [v for v in values if v is not None]
+    return value
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
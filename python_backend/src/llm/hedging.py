@@ -0,0 +1,130 @@
+"""
+LLM 对冲请求
+非流式调用超过近期延迟的指定分位数仍未返回时，向同一后端再发一个相同的请求，
+取先完成的结果并取消另一个；对冲请求数受预算（占正常请求的比例）限制
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+from pydantic import BaseModel, Field
+
+
+T = TypeVar("T")
+
+# 每个后端保留的最近延迟样本数
+LATENCY_WINDOW = 200
+
+# 对冲额度的累积上限，避免长时间空闲后集中对冲
+MAX_HEDGE_CREDIT = 10.0
+
+
+class HedgingConfig(BaseModel):
+    """对冲请求配置"""
+    enabled: bool = Field(default=False, description="是否启用对冲请求")
+    percentile: float = Field(default=95.0, gt=0, lt=100, description="超过近期延迟的该分位数仍未返回时发出对冲请求")
+    min_samples: int = Field(default=20, ge=1, description="延迟样本数达到多少后才开始对冲")
+    min_delay: float = Field(default=0.5, ge=0, description="发出对冲请求前的最短等待时间(s)")
+    budget_ratio: float = Field(default=0.05, ge=0, le=1, description="对冲请求数占正常请求数的比例上限")
+
+
+class HedgingStats(BaseModel):
+    """对冲请求统计信息"""
+    requests: int = Field(default=0, description="可对冲的调用数")
+    hedged: int = Field(default=0, description="发出对冲请求的次数")
+    hedge_wins: int = Field(default=0, description="对冲请求先返回的次数")
+    budget_exhausted: int = Field(default=0, description="达到对冲条件但预算不足的次数")
+    hedge_rate: float = Field(default=0, description="对冲率")
+    win_rate: float = Field(default=0, description="对冲请求的胜出率")
+    hedge_delay_ms: Dict[str, float] = Field(default_factory=dict, description="各后端当前的对冲等待时间(ms)")
+    latency_p50_ms: float = Field(default=0, description="调用耗时P50(ms)")
+    latency_p90_ms: float = Field(default=0, description="调用耗时P90(ms)")
+    latency_p99_ms: float = Field(default=0, description="调用耗时P99(ms)")
+
+
+class Hedger:
+    """按后端统计延迟并执行对冲调用"""
+
+    def __init__(self, config: Optional[HedgingConfig] = None):
+        self.config = config or HedgingConfig()
+        self.stats = HedgingStats()
+        # 后端名称 -> 最近成功调用的耗时(s)，包含对冲后的实际耗时
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._credit = 0.0
+
+    def hedge_delay(self, key: str) -> Optional[float]:
+        """发出对冲请求前的等待时间，样本不足时返回 None（不对冲）"""
+        samples = self._latencies.get(key)
+        if not samples or len(samples) < self.config.min_samples:
+            return None
+        return max(_percentile(sorted(samples), self.config.percentile), self.config.min_delay)
+
+    async def run(self, key: str, make_call: Callable[[], Awaitable[T]]) -> T:
+        """执行调用，超过对冲等待时间仍未返回时再发一个相同的请求，返回先成功的结果"""
+        self.stats.requests += 1
+        self._credit = min(self._credit + self.config.budget_ratio, MAX_HEDGE_CREDIT)
+        delay = self.hedge_delay(key)
+        start_time = time.monotonic()
+
+        primary = asyncio.ensure_future(make_call())
+        tasks = [primary]
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if not done:
+                    if self._credit >= 1:
+                        self._credit -= 1
+                        self.stats.hedged += 1
+                        tasks.append(asyncio.ensure_future(make_call()))
+                    else:
+                        self.stats.budget_exhausted += 1
+
+            # 任一请求成功即返回；全部失败时抛出最后一个错误
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.stats.hedge_wins += 1
+                        self._observe(key, time.monotonic() - start_time)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()  # 标记已读取，避免未处理异常的警告
+
+    def get_stats(self) -> HedgingStats:
+        """获取统计信息"""
+        stats = self.stats.model_copy()
+        if stats.requests:
+            stats.hedge_rate = stats.hedged / stats.requests
+        if stats.hedged:
+            stats.win_rate = stats.hedge_wins / stats.hedged
+        stats.hedge_delay_ms = {
+            key: delay * 1000
+            for key in self._latencies
+            if (delay := self.hedge_delay(key)) is not None
+        }
+
+        samples = sorted(latency for window in self._latencies.values() for latency in window)
+        if samples:
+            stats.latency_p50_ms = _percentile(samples, 50) * 1000
+            stats.latency_p90_ms = _percentile(samples, 90) * 1000
+            stats.latency_p99_ms = _percentile(samples, 99) * 1000
+        return stats
+
+    def _observe(self, key: str, latency: float) -> None:
+        self._latencies.setdefault(key, deque(maxlen=LATENCY_WINDOW)).append(latency)
+
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    """最近秩法求分位数"""
+    index = max(int(len(sorted_values) * percentile / 100 + 0.5) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
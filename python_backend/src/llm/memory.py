@@ -0,0 +1,274 @@
+"""
+会话记忆
+按 conversationId 保存最近的对话轮次和工具结果，
+构建上下文时按模型的 token 预算裁剪，超过条数或 token 阈值后把较早的轮次压缩为摘要
+（先写入抽取式摘要，LLM 摘要在后台生成后再替换）；
+会话之间 LRU 淘汰，并对全部会话占用的 token 总量设硬上限
+"""
+
+import asyncio
+import json
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from ..mcp.types import ChatMessage, ProcessResult
+from .tokens import estimate_tokens, MESSAGE_OVERHEAD_TOKENS
+
+
+class MemoryConfig(BaseModel):
+    """会话记忆配置"""
+    max_turns: int = Field(default=20, ge=2, description="每个会话保留的最大消息条数")
+    default_token_budget: int = Field(default=2000, ge=100, description="历史上下文默认token预算")
+    model_token_budgets: Dict[str, int] = Field(
+        default_factory=lambda: {"gpt-3.5-turbo": 2000, "gpt-4": 4000, "gpt-4o": 6000, "gpt-4o-mini": 4000},
+        description="各模型的历史上下文token预算"
+    )
+    summarize_ratio: float = Field(default=0.8, gt=0, le=1, description="历史超过预算的该比例时压缩较早轮次")
+    keep_recent: int = Field(default=6, ge=1, description="压缩时保留的最近消息条数")
+    max_message_chars: int = Field(default=1200, ge=100, description="单条记忆消息的最大字符数")
+    max_summary_chars: int = Field(default=800, ge=100, description="摘要的最大字符数")
+    llm_summary: bool = Field(default=False, description="是否由LLM生成摘要（失败时改用抽取式摘要）")
+    max_conversations: int = Field(default=500, ge=1, description="最多保留的会话数")
+    max_total_tokens: int = Field(default=500000, ge=1000, description="全部会话记忆的token总量上限")
+
+
+class MemoryStats(BaseModel):
+    """会话记忆统计信息"""
+    conversations: int = Field(default=0, description="会话数")
+    total_tokens: int = Field(default=0, description="记忆占用的token总量")
+    summaries: int = Field(default=0, description="压缩摘要次数")
+    evictions: int = Field(default=0, description="LRU淘汰的会话数")
+
+
+class _Turn:
+    """一条记忆消息"""
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: str, content: str, tokens: int):
+        self.role = role
+        self.content = content
+        self.tokens = tokens
+
+
+class _Conversation:
+    """单个会话的记忆"""
+
+    def __init__(self):
+        # 不设 maxlen：超出 max_turns 的轮次由压缩移入摘要，而不是被静默丢弃
+        self.turns: Deque[_Turn] = deque()
+        self.summary = ""
+        self.summary_tokens = 0
+        # 每次压缩递增，后台生成的摘要只在版本未变时写回
+        self.version = 0
+        self.summary_task: Optional[asyncio.Task] = None
+
+    @property
+    def tokens(self) -> int:
+        return self.summary_tokens + sum(turn.tokens for turn in self.turns)
+
+
+Summarizer = Callable[[str, List[ChatMessage]], Awaitable[str]]
+
+
+class ConversationMemory:
+    """按会话保存的有界对话记忆"""
+
+    def __init__(self, config: Optional[MemoryConfig] = None, summarizer: Optional[Summarizer] = None):
+        self.config = config or MemoryConfig()
+        self._summarizer = summarizer
+        self._conversations: "OrderedDict[str, _Conversation]" = OrderedDict()
+        self._total_tokens = 0
+        self._summary_tasks: Set[asyncio.Task] = set()
+        self.stats = MemoryStats()
+
+    def set_summarizer(self, summarizer: Optional[Summarizer]) -> None:
+        """更换摘要生成函数（LLM处理器重建后重新绑定）"""
+        self._summarizer = summarizer
+
+    def token_budget(self, model: str) -> int:
+        """获取模型的历史上下文token预算"""
+        return self.config.model_token_budgets.get(model, self.config.default_token_budget)
+
+    def build_messages(
+        self,
+        conversation_id: str,
+        system_prompt: str,
+        user_content: str,
+        model: str
+    ) -> List[ChatMessage]:
+        """构建带历史的消息列表：system + 摘要 + 预算内的最近轮次 + 本次用户消息"""
+        messages = [ChatMessage(role="system", content=system_prompt)]
+
+        conversation = self._conversations.get(conversation_id)
+        if conversation is not None:
+            self._conversations.move_to_end(conversation_id)
+            budget = self.token_budget(model)
+
+            if conversation.summary:
+                messages.append(ChatMessage(
+                    role="system",
+                    content=f"以下是本会话较早内容的摘要:\n{conversation.summary}"
+                ))
+                budget -= conversation.summary_tokens
+
+            # 从最近的轮次往前取，直到用完预算
+            history: List[ChatMessage] = []
+            for turn in reversed(conversation.turns):
+                if turn.tokens > budget:
+                    break
+                budget -= turn.tokens
+                history.append(ChatMessage(role=turn.role, content=turn.content))
+            messages.extend(reversed(history))
+
+        messages.append(ChatMessage(role="user", content=user_content))
+        return messages
+
+    async def record(
+        self,
+        conversation_id: str,
+        user_content: str,
+        result: ProcessResult,
+        model: str = "gpt-3.5-turbo"
+    ) -> None:
+        """记录一轮对话（用户消息、工具结果和回复），不等待LLM摘要"""
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            conversation = _Conversation()
+            self._conversations[conversation_id] = conversation
+        self._conversations.move_to_end(conversation_id)
+
+        before = conversation.tokens
+        self._append(conversation, "user", user_content, model)
+        for call in result.function_calls or []:
+            if call.error:
+                note = f"🔧 {call.function_call.name}({call.function_call.arguments}) 失败: {call.error}"
+            else:
+                compact = json.dumps(call.result, ensure_ascii=False, separators=(",", ":"), default=str)
+                note = f"🔧 {call.function_call.name}({call.function_call.arguments}) 结果: {compact}"
+            self._append(conversation, "assistant", note, model)
+        self._append(conversation, "assistant", result.content, model)
+
+        if (
+            len(conversation.turns) > self.config.max_turns
+            or conversation.tokens > self.token_budget(model) * self.config.summarize_ratio
+        ):
+            self._summarize(conversation_id, conversation, model)
+
+        self._total_tokens += conversation.tokens - before
+        self._enforce_limits()
+
+    def clear(self, conversation_id: str) -> None:
+        """清除会话记忆"""
+        conversation = self._conversations.pop(conversation_id, None)
+        if conversation is not None:
+            self._total_tokens -= conversation.tokens
+            self._cancel_summary(conversation)
+
+    async def close(self) -> None:
+        """取消尚未完成的后台摘要"""
+        tasks = list(self._summary_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> MemoryStats:
+        """获取统计信息"""
+        stats = self.stats.model_copy()
+        stats.conversations = len(self._conversations)
+        stats.total_tokens = self._total_tokens
+        return stats
+
+    def _append(self, conversation: _Conversation, role: str, content: str, model: str) -> None:
+        """追加一条消息，超长内容截断"""
+        if len(content) > self.config.max_message_chars:
+            content = content[:self.config.max_message_chars] + "…(已截断)"
+        conversation.turns.append(
+            _Turn(role, content, estimate_tokens(content, model) + MESSAGE_OVERHEAD_TOKENS)
+        )
+
+    def _summarize(self, conversation_id: str, conversation: _Conversation, model: str) -> None:
+        """把最近 keep_recent 条之前的消息压缩进摘要
+
+        先同步写入抽取式摘要，保证被移出的轮次不会丢失；配置了 summarizer 时再在后台
+        生成LLM摘要，完成后替换
+        """
+        keep = min(self.config.keep_recent, self.config.max_turns)
+        if len(conversation.turns) <= keep:
+            return
+
+        older = [conversation.turns.popleft() for _ in range(len(conversation.turns) - keep)]
+        messages = [ChatMessage(role=turn.role, content=turn.content) for turn in older]
+        previous = conversation.summary
+
+        conversation.version += 1
+        self._set_summary(conversation, self._extractive_summary(previous, messages), model)
+        self.stats.summaries += 1
+
+        if self._summarizer:
+            # 新一轮压缩已包含上一轮的内容，旧的后台摘要不再需要
+            self._cancel_summary(conversation)
+            task = asyncio.create_task(self._summarize_with_llm(
+                conversation_id, conversation, conversation.version, previous, messages, model
+            ))
+            conversation.summary_task = task
+            self._summary_tasks.add(task)
+            task.add_done_callback(self._summary_tasks.discard)
+
+    async def _summarize_with_llm(
+        self,
+        conversation_id: str,
+        conversation: _Conversation,
+        version: int,
+        previous: str,
+        messages: List[ChatMessage],
+        model: str
+    ) -> None:
+        """后台调用 summarizer，会话未被再次压缩或淘汰时用结果替换抽取式摘要"""
+        try:
+            summary = await self._summarizer(previous, messages)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"会话 {conversation_id} 摘要生成失败，保留抽取式摘要: {e}")
+            return
+        if not summary or conversation.version != version:
+            return
+
+        before = conversation.summary_tokens
+        self._set_summary(conversation, summary, model)
+        # 已被淘汰或清除的会话不再计入总量
+        if self._conversations.get(conversation_id) is conversation:
+            self._total_tokens += conversation.summary_tokens - before
+            self._enforce_limits()
+
+    def _set_summary(self, conversation: _Conversation, summary: str, model: str) -> None:
+        conversation.summary = summary[-self.config.max_summary_chars:]
+        conversation.summary_tokens = estimate_tokens(conversation.summary, model) + MESSAGE_OVERHEAD_TOKENS
+
+    @staticmethod
+    def _cancel_summary(conversation: _Conversation) -> None:
+        if conversation.summary_task and not conversation.summary_task.done():
+            conversation.summary_task.cancel()
+        conversation.summary_task = None
+
+    def _extractive_summary(self, previous: str, messages: List[ChatMessage]) -> str:
+        """取每条消息的首行作为摘要"""
+        lines = [previous] if previous else []
+        for message in messages:
+            first_line = message.content.strip().split("\n", 1)[0][:120]
+            speaker = "用户" if message.role == "user" else "助手"
+            lines.append(f"- {speaker}: {first_line}")
+        return "\n".join(lines)
+
+    def _enforce_limits(self) -> None:
+        """按 LRU 淘汰会话，直到满足会话数和token总量上限"""
+        while self._conversations and (
+            len(self._conversations) > self.config.max_conversations
+            or self._total_tokens > self.config.max_total_tokens
+        ):
+            _, conversation = self._conversations.popitem(last=False)
+            self._total_tokens -= conversation.tokens
+            self._cancel_summary(conversation)
+            self.stats.evictions += 1
@@ -3,207 +3,783 @@ LLM 处理器 - Python版本
 支持多种 LLM 提供商，集成 MCP 工具调用功能
 """
 
+import asyncio
 import json
 import time
-from typing import Dict, List, Optional, Any
+from typing import Awaitable, Callable, Dict, List, Optional, Any, Set, Tuple
 from loguru import logger
+from pydantic import BaseModel, Field
+import httpx
 import openai
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import RetryCallState, retry, retry_if_exception, stop_after_attempt, wait_exponential
 
 from ..mcp.types import (
     LLMConfig, ChatMessage, ProcessResult, FunctionCall, FunctionCallResult,
-    MCPException
+    MCPException, StreamEvent, StepTiming
 )
 from ..mcp.client import MCPClient
+from ..mcp.deadline import clamp_timeout, time_remaining
+from .shortcuts import ShortcutCall, parse_shortcut_call, TOOL_SHORTCUT_PREFIX
+from .tokens import estimate_tokens, estimate_message_tokens
+from .compaction import ToolResultCompactor, CompactionConfig
+from .answer_cache import AnswerCache, AnswerCacheConfig
+from .providers import ProviderBackend, ProviderPool, ProviderStats
+from .hedging import Hedger, HedgingConfig
+from .singleflight import SingleFlight
+from .tool_selection import ToolSelector, ToolSelectionConfig
+
+
+# 进度回调：流式模式下接收文本增量和工具调用进度
+ProgressCallback = Callable[[StreamEvent], Awaitable[None]]
+
+# (文本, 工具调用列表, token用量)
+CompletionOutput = Tuple[str, List[Dict[str, str]], Optional[Dict[str, int]]]
+
+# 参数有歧义、交给 LLM 处理的快捷指令提示词
+SHORTCUT_PROMPTS = {
+    "/pods": "请获取Kubernetes集群中的Pod列表，并以易读的格式展示",
+    "/logs": "请获取指定Pod的最新日志",
+    "/scale": "请扩缩容指定的Deployment",
+    "/status": "请检查集群状态和健康情况",
+    "/help": "显示所有可用的快捷指令"
+}
+
+# 会话记忆摘要的提示词
+SUMMARY_PROMPT = (
+    "请把以下运维对话压缩为简洁的中文摘要，保留涉及的命名空间、资源名称、关键数值和结论，"
+    "以便后续对话引用。只输出摘要内容。"
+)
+
+
+def _stop_at_request_deadline(retry_state: RetryCallState) -> bool:
+    """请求剩余时间不够等待下一次重试时不再重试"""
+    remaining = time_remaining()
+    return remaining is not None and remaining <= retry_state.upcoming_sleep
+
+
+def _is_retryable(error: BaseException) -> bool:
+    """取消和处理器已关闭时不重试"""
+    return isinstance(error, Exception) and not (isinstance(error, MCPException) and error.code == "LLM_CLOSED")
+
+
+class LLMClientStats(BaseModel):
+    """LLM 调用统计信息"""
+    in_flight: int = Field(default=0, description="进行中的调用数")
+    waiting: int = Field(default=0, description="等待并发名额的调用数")
+    max_in_flight: int = Field(default=0, description="最大同时进行的调用数")
+    completed: int = Field(default=0, description="成功完成的调用数")
+    failed: int = Field(default=0, description="失败的调用数")
+    timeouts: int = Field(default=0, description="超时的调用数")
+    cancelled: int = Field(default=0, description="被取消的调用数")
+    average_latency: float = Field(default=0, description="平均调用耗时(ms)")
 
 
 class EnhancedLLMProcessor:
     """增强版 LLM 处理器，支持 MCP 工具调用"""
     
-    def __init__(self, llm_config: LLMConfig, mcp_client: MCPClient):
+    def __init__(
+        self,
+        llm_config: LLMConfig,
+        mcp_client: MCPClient,
+        compaction_config: Optional[CompactionConfig] = None,
+        answer_cache_config: Optional[AnswerCacheConfig] = None,
+        hedging_config: Optional[HedgingConfig] = None,
+        tool_selection_config: Optional[ToolSelectionConfig] = None
+    ):
         self.config = llm_config
         self.mcp_client = mcp_client
-        self.client = self._initialize_client()
-        
-    def _initialize_client(self):
-        """初始化 LLM 客户端"""
-        if self.config.provider == "openai":
-            return openai.OpenAI(
-                api_key=self.config.api_key,
-                base_url=self.config.base_url
+        self.providers = self._initialize_providers()
+        self.compactor = ToolResultCompactor(compaction_config)
+        self.answer_cache = AnswerCache(answer_cache_config)
+        self.hedger = Hedger(hedging_config)
+        self.single_flight: SingleFlight[ProcessResult] = SingleFlight()
+        self.tool_selector = ToolSelector(tool_selection_config)
+        self.stats = LLMClientStats()
+        self._semaphore = asyncio.Semaphore(self.config.max_concurrency)
+        self._in_flight_tasks: Set[asyncio.Future] = set()
+        self._closed = False
+        self._latency_total = 0.0
+        
+    def _initialize_providers(self) -> ProviderPool:
+        """初始化 LLM 后端：主后端加上 fallback_providers，全部共享一个连接池"""
+        # 重试由 tenacity 负责，各后端关闭 SDK 自带的重试
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.config.max_connections,
+                max_keepalive_connections=self.config.max_keepalive_connections
             )
-        else:
-            # 支持其他提供商
-            raise NotImplementedError(f"Provider {self.config.provider} not implemented yet")
+        )
+        return ProviderPool(self.config, self._http_client)
+    
+    async def close(self) -> None:
+        """取消进行中的调用并关闭连接池，调用方收到 LLM_CLOSED 错误"""
+        self._closed = True
+        for task in list(self._in_flight_tasks):
+            task.cancel()
+        await self._http_client.aclose()
+        logger.info("LLM 客户端已关闭")
+    
+    def get_stats(self) -> LLMClientStats:
+        """获取统计信息"""
+        return self.stats.model_copy()
+    
+    def get_provider_stats(self) -> List[ProviderStats]:
+        """获取各 LLM 后端的路由和熔断统计"""
+        return self.providers.get_stats()
     
     async def chat(
         self,
         messages: List[ChatMessage],
-        enable_tools: bool = False
+        enable_tools: bool = False,
+        progress: Optional[ProgressCallback] = None
     ) -> ProcessResult:
-        """普通聊天处理"""
-        try:
-            if enable_tools and self.mcp_client.status.value == "connected":
-                return await self._chat_with_tools(messages)
-            else:
-                return await self._chat_without_tools(messages)
-        except Exception as e:
-            logger.error(f"LLM 处理失败: {e}")
-            raise MCPException("LLM_PROCESSING_FAILED", "LLM processing failed", str(e))
+        """普通聊天处理
+        
+        传入 progress 时使用流式模式，文本增量和工具调用进度通过回调实时推送。
+        结果按规范化的消息、模型、温度和 MCP 数据版本缓存，命中时不再调用 LLM；
+        同样的请求并发到达时合并为一次处理。
+        """
+        use_tools = enable_tools and self.mcp_client.status.value == "connected"
+        estimated_prompt_tokens = estimate_message_tokens(
+            self._convert_messages_to_openai(messages), self.config.model
+        )
+        request_key = self._request_key(messages, use_tools)
+        cache_key = request_key if self.answer_cache.config.enabled else None
+        if cache_key:
+            cached = self.answer_cache.get(cache_key)
+            if cached:
+                logger.info("命中回答缓存")
+                await self._emit(progress, StreamEvent(type="text", text=cached.content))
+                cached.estimated_prompt_tokens = estimated_prompt_tokens
+                return cached
+        
+        async def process() -> ProcessResult:
+            try:
+                if use_tools:
+                    result = await self._chat_with_tools(messages, progress)
+                else:
+                    result = await self._chat_without_tools(messages, progress)
+            except MCPException:
+                raise
+            except Exception as e:
+                logger.error(f"LLM 处理失败: {e}")
+                raise MCPException("LLM_PROCESSING_FAILED", "LLM processing failed", str(e))
+            
+            if cache_key and self._is_cacheable(result):
+                self.answer_cache.put(cache_key, result)
+            return result
+        
+        result = await self._coalesce(request_key and f"chat:{request_key}", process, progress)
+        result.estimated_prompt_tokens = estimated_prompt_tokens
+        return result
+    
+    def _request_key(self, messages: List[ChatMessage], use_tools: bool) -> Optional[str]:
+        """规范化后的请求键，回答缓存和请求合并共用；修改类请求返回 None"""
+        if self.answer_cache.should_bypass(messages):
+            return None
+        return self.answer_cache.make_key(
+            messages, self.config.model, self.config.temperature, self.mcp_client.data_version, use_tools
+        )
+    
+    async def _coalesce(
+        self,
+        key: Optional[str],
+        process: Callable[[], Awaitable[ProcessResult]],
+        progress: Optional[ProgressCallback] = None
+    ) -> ProcessResult:
+        """键相同的并发请求只处理一次
+        
+        流式进度只推送给发起处理的请求方，合并进来的请求方在完成后一次性收到全部文本。
+        """
+        if key is None:
+            return await process()
+        
+        result, shared = await self.single_flight.do(key, process)
+        if shared:
+            # 用量只计入发起处理的请求方
+            result = result.model_copy(deep=True, update={"coalesced": True, "usage": None})
+            await self._emit(progress, StreamEvent(type="text", text=result.content))
+        return result
+    
+    def _is_cacheable(self, result: ProcessResult) -> bool:
+        """只缓存完整、成功且没有修改集群状态的回答"""
+        if result.stop_reason not in (None, "completed") or not result.content:
+            return False
+        for call in result.function_calls or []:
+            if call.error or self.mcp_client.is_mutating(call.function_call.name):
+                return False
+        return True
     
     async def chat_with_shortcuts(
         self,
         shortcut: str,
         content: str,
-        context: Optional[Dict[str, Any]] = None
+        context: Optional[Dict[str, Any]] = None,
+        progress: Optional[ProgressCallback] = None,
+        enable_tools: bool = True
     ) -> ProcessResult:
-        """快捷指令处理"""
-        shortcut_prompts = {
-            "/pods": "请获取Kubernetes集群中的Pod列表，并以易读的格式展示",
-            "/logs": "请获取指定Pod的最新日志",
-            "/scale": "请扩缩容指定的Deployment",
-            "/status": "请检查集群状态和健康情况",
-            "/help": "显示所有可用的快捷指令"
-        }
+        """快捷指令处理
         
-        prompt = shortcut_prompts.get(shortcut)
-        if not prompt:
+        参数明确的指令直接调用对应的 MCP 工具并格式化结果，
+        只有参数有歧义时才交给 LLM 理解。
+        """
+        if shortcut == "/help":
+            return ProcessResult(content=self._format_shortcut_help(await self.get_available_shortcuts()))
+        
+        call = self._direct_shortcut_call(shortcut, content)
+        if call:
+            # 只读指令合并并发请求，发起处理的请求方的 context 用于工具调用
+            key = None
+            if not self.mcp_client.is_mutating(call.tool_name):
+                key = "shortcut:" + json.dumps(
+                    [call.shortcut, call.tool_name, call.parameters, self.mcp_client.data_version],
+                    ensure_ascii=False, sort_keys=True
+                )
+            return await self._coalesce(key, lambda: self._run_shortcut_directly(call, context))
+        
+        messages = self._shortcut_llm_messages(shortcut, content)
+        if messages is None:
             return ProcessResult(
                 content=f"未知的快捷指令: {shortcut}\n\n可用指令:\n" + 
-                       "\n".join(f"- {k}: {v}" for k, v in shortcut_prompts.items())
+                       "\n".join(f"- {k}: {v}" for k, v in SHORTCUT_PROMPTS.items())
             )
         
-        # 构建消息
-        messages = [
+        return await self.chat(messages, enable_tools=enable_tools, progress=progress)
+    
+    def shortcut_messages(self, shortcut: str, content: str) -> Optional[List[ChatMessage]]:
+        """快捷指令需要交给 LLM 时返回要发送的消息，直接执行或无需调用 LLM 时返回 None（用于配额预估）"""
+        if shortcut == "/help" or self._direct_shortcut_call(shortcut, content):
+            return None
+        return self._shortcut_llm_messages(shortcut, content)
+    
+    def _direct_shortcut_call(self, shortcut: str, content: str) -> Optional[ShortcutCall]:
+        """参数明确、可以直接调用工具时返回对应的调用"""
+        if not self.config.shortcut_direct_mode or self.mcp_client.status.value != "connected":
+            return None
+        return parse_shortcut_call(shortcut, content, self.mcp_client.get_catalog().by_name)
+    
+    def _shortcut_llm_messages(self, shortcut: str, content: str) -> Optional[List[ChatMessage]]:
+        """构建交给 LLM 处理的快捷指令消息，未知指令返回 None"""
+        prompt = SHORTCUT_PROMPTS.get(shortcut)
+        tool_name = shortcut[len(TOOL_SHORTCUT_PREFIX):] if shortcut.startswith(TOOL_SHORTCUT_PREFIX) else None
+        if not prompt and tool_name and self.mcp_client.get_tool(tool_name):
+            prompt = f"请调用工具 {tool_name} 完成用户的请求"
+        if not prompt:
+            return None
+        
+        return [
             ChatMessage(role="system", content="你是一个专业的Kubernetes运维助手，擅长使用K8s工具来管理集群。"),
             ChatMessage(role="user", content=f"{prompt}\n\n用户补充信息: {content}")
         ]
+    
+    async def _run_shortcut_directly(
+        self,
+        call: ShortcutCall,
+        context: Optional[Dict[str, Any]] = None
+    ) -> ProcessResult:
+        """直接执行快捷指令对应的工具调用"""
+        function_call = FunctionCall(
+            name=call.tool_name,
+            arguments=json.dumps(call.parameters, ensure_ascii=False)
+        )
+        
+        try:
+            result = await self.mcp_client.call_tool(call.tool_name, call.parameters, context)
+        except MCPException as e:
+            logger.error(f"快捷指令 {call.shortcut} 调用工具失败: {e}")
+            return ProcessResult(
+                content=f"❌ 指令执行失败: {e.message}",
+                function_calls=[FunctionCallResult(function_call=function_call, error=e.message)]
+            )
+        
+        if call.shortcut == "/status":
+            content = self._format_cluster_status(result)
+        else:
+            content = self.format_tool_result(result)
+        
+        return ProcessResult(
+            content=content,
+            function_calls=[FunctionCallResult(function_call=function_call, result=result)]
+        )
+    
+    def _format_cluster_status(self, result: Any) -> str:
+        """把 Pod 列表汇总为集群状态"""
+        items = result.get("items", []) if isinstance(result, dict) else []
+        if not items:
+            return "📭 未找到任何Pod"
+        
+        phases: Dict[str, int] = {}
+        abnormal = []
+        for item in items:
+            phase = item.get("status", {}).get("phase", "Unknown")
+            phases[phase] = phases.get(phase, 0) + 1
+            if phase not in ("Running", "Succeeded"):
+                abnormal.append(item.get("metadata", {}).get("name", "Unknown"))
         
-        return await self.chat(messages, enable_tools=True)
+        healthy = not abnormal
+        formatted = f"{'✅' if healthy else '⚠️'} **集群状态: {'健康' if healthy else '存在异常'}**\n\n"
+        formatted += f"📦 Pod 总数: {len(items)}\n"
+        for phase, count in sorted(phases.items()):
+            formatted += f"• {phase}: {count}\n"
+        
+        if abnormal:
+            formatted += "\n**异常Pod:**\n" + "\n".join(f"• {name}" for name in abnormal[:10])
+        
+        return formatted
+    
+    def _format_shortcut_help(self, shortcuts: Dict[str, str]) -> str:
+        """格式化快捷指令列表"""
+        return "🚀 **可用的快捷指令:**\n\n" + \
+               "\n".join(f"• `{name}` - {description}" for name, description in shortcuts.items())
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=60))
-    async def _chat_without_tools(self, messages: List[ChatMessage]) -> ProcessResult:
+    @retry(stop=stop_after_attempt(3) | _stop_at_request_deadline, wait=wait_exponential(multiplier=1, min=1, max=60),
+           retry=retry_if_exception(_is_retryable), reraise=True)
+    async def _complete_with_retry(self, openai_messages: List[Dict[str, Any]]) -> CompletionOutput:
+        """非流式调用失败时重试（流式输出已推送给用户，不能重试）"""
+        return await self._complete(openai_messages)
+    
+    async def summarize_history(self, previous: str, messages: List[ChatMessage]) -> str:
+        """把较早的对话压缩为摘要，供会话记忆使用（单次调用，不使用工具和回答缓存，失败由调用方降级）"""
+        transcript = "\n".join(
+            f"{'用户' if m.role == 'user' else '助手'}: {m.content}" for m in messages
+        )
+        if previous:
+            transcript = f"已有摘要:\n{previous}\n\n新的对话:\n{transcript}"
+        content, _, _ = await self._complete(self._convert_messages_to_openai([
+            ChatMessage(role="system", content=SUMMARY_PROMPT),
+            ChatMessage(role="user", content=transcript)
+        ]))
+        return content.strip()
+    
+    async def _chat_without_tools(
+        self,
+        messages: List[ChatMessage],
+        progress: Optional[ProgressCallback] = None
+    ) -> ProcessResult:
         """不使用工具的聊天"""
         openai_messages = self._convert_messages_to_openai(messages)
         
-        response = await self.client.chat.completions.acreate(
-            model=self.config.model,
-            messages=openai_messages,
-            temperature=self.config.temperature,
-            max_tokens=self.config.max_tokens
+        if progress:
+            content, _, usage = await self._complete(openai_messages, progress)
+        else:
+            content, _, usage = await self._complete_with_retry(openai_messages)
+        
+        return ProcessResult(content=content, usage=usage)
+    
+    async def _chat_with_tools(
+        self,
+        messages: List[ChatMessage],
+        progress: Optional[ProgressCallback] = None
+    ) -> ProcessResult:
+        """使用工具的聊天
+        
+        模型每一步可以请求工具调用，结果加入上下文后进入下一步，直到模型给出回答。
+        超过 max_agent_steps 轮后最后一次调用不再提供工具；累计 token 或总耗时超出预算时，
+        直接基于已获取的工具结果生成回答。工具较多时只提供与请求相关的子集，
+        模型请求了子集之外的工具时之后改为提供全部工具。
+        """
+        # 工具目录中预先生成了 OpenAI 格式的 schema
+        catalog = self.mcp_client.get_catalog()
+        if not catalog.openai_tools:
+            return await self._chat_without_tools(messages, progress)
+        
+        query = next((m.content for m in reversed(messages) if m.role == "user"), "")
+        selection = self.tool_selector.select(catalog, query, self.config.model)
+        openai_messages = self._convert_messages_to_openai(messages)
+        
+        # 不超过请求的剩余时间
+        deadline = time.monotonic() + clamp_timeout(self.config.agent_deadline)
+        usage: Dict[str, int] = {}
+        steps: List[StepTiming] = []
+        function_results: List[FunctionCallResult] = []
+        stop_reason = "max_steps"
+        content = ""
+        
+        for step in range(1, self.config.max_agent_steps + 2):
+            budget_reason = self._check_budget(deadline, usage)
+            if budget_reason:
+                stop_reason = budget_reason
+                break
+            
+            # 工具轮数用完后，最后一次调用不再提供工具，要求模型基于已有结果回答
+            step_tools = selection.tools if step <= self.config.max_agent_steps else None
+            if step_tools is not None:
+                self.tool_selector.record_call(selection)
+            timing = StepTiming(step=step)
+            steps.append(timing)
+            
+            start_time = time.monotonic()
+            try:
+                content, tool_calls, step_usage = await self._complete(
+                    openai_messages, progress, step_tools,
+                    timeout=min(self.config.request_timeout, deadline - start_time)
+                )
+            except MCPException as e:
+                # 总耗时超限时保留已获取的结果，否则照常抛出
+                if e.code != "LLM_TIMEOUT" or not function_results or time.monotonic() < deadline:
+                    raise
+                stop_reason = "deadline"
+                break
+            timing.llm_ms = (time.monotonic() - start_time) * 1000
+            timing.tokens = self._accumulate_usage(usage, step_usage, openai_messages, content, tool_calls)
+            
+            if step_tools is None:
+                break
+            if not tool_calls:
+                stop_reason = "completed"
+                break
+            
+            if selection.is_subset and any(
+                call["name"] not in selection.names and call["name"] in catalog.by_name for call in tool_calls
+            ):
+                selection = self.tool_selector.record_miss(catalog)
+            
+            # 并行执行工具调用，结果按原顺序返回
+            start_time = time.monotonic()
+            try:
+                step_results = await asyncio.wait_for(
+                    self._execute_tool_calls(tool_calls, progress),
+                    timeout=max(deadline - start_time, 0)
+                )
+            except asyncio.TimeoutError:
+                stop_reason = "deadline"
+                break
+            timing.tool_ms = (time.monotonic() - start_time) * 1000
+            timing.tool_calls = [tool_call["name"] for tool_call in tool_calls]
+            function_results.extend(step_results)
+            
+            self._append_tool_messages(openai_messages, content, tool_calls, step_results)
+        
+        self.tool_selector.record_usage([result.function_call.name for result in function_results])
+        logger.info(
+            f"工具调用循环结束: {stop_reason}, {len(steps)} 步, "
+            f"{len(function_results)} 次工具调用, {usage.get('total_tokens', 0)} tokens"
         )
         
+        if not function_results:
+            return ProcessResult(content=content, usage=usage or None, steps=steps, stop_reason=stop_reason)
+        
+        if stop_reason in ("token_budget", "deadline") or not content:
+            content = self._format_partial_answer(stop_reason, function_results)
+        
         return ProcessResult(
-            content=response.choices[0].message.content,
-            usage=response.usage.model_dump() if response.usage else None
+            content=self._format_response_with_tools(content, function_results),
+            function_calls=function_results,
+            usage=usage or None,
+            steps=steps,
+            stop_reason=stop_reason
         )
     
-    async def _chat_with_tools(self, messages: List[ChatMessage]) -> ProcessResult:
-        """使用工具的聊天"""
-        # 获取可用工具
-        tools = await self.mcp_client.list_tools()
-        if not tools:
-            return await self._chat_without_tools(messages)
+    def _check_budget(self, deadline: float, usage: Dict[str, int]) -> Optional[str]:
+        """检查总耗时和累计 token 预算，超出时返回结束原因"""
+        if time.monotonic() >= deadline:
+            return "deadline"
+        if usage.get("total_tokens", 0) >= self.config.agent_token_budget:
+            return "token_budget"
+        return None
+    
+    def _accumulate_usage(
+        self,
+        usage: Dict[str, int],
+        step_usage: Optional[Dict[str, int]],
+        openai_messages: List[Dict[str, Any]],
+        content: str,
+        tool_calls: List[Dict[str, str]]
+    ) -> int:
+        """累加本步 token 用量并返回本步消耗；服务端未返回用量时按估算计"""
+        if not step_usage:
+            prompt_tokens = estimate_message_tokens(openai_messages, self.config.model)
+            completion_tokens = estimate_tokens(content, self.config.model) + sum(
+                estimate_tokens(tool_call["arguments"], self.config.model) for tool_call in tool_calls
+            )
+            step_usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        for key, value in step_usage.items():
+            usage[key] = usage.get(key, 0) + value
+        return step_usage.get("total_tokens", 0)
+    
+    def _append_tool_messages(
+        self,
+        openai_messages: List[Dict[str, Any]],
+        content: str,
+        tool_calls: List[Dict[str, str]],
+        function_results: List[FunctionCallResult]
+    ) -> None:
+        """一条 assistant 消息携带全部 tool_calls，随后每个调用各一条 tool 消息"""
+        openai_messages.append({
+            "role": "assistant",
+            "content": content or None,
+            "tool_calls": [
+                {
+                    "id": tool_call["id"],
+                    "type": "function",
+                    "function": {"name": tool_call["name"], "arguments": tool_call["arguments"]}
+                }
+                for tool_call in tool_calls
+            ]
+        })
+        for tool_call, function_result in zip(tool_calls, function_results):
+            if function_result.error:
+                tool_content = json.dumps({"error": function_result.error}, ensure_ascii=False)
+            else:
+                tool_content = self.compactor.compact(tool_call["name"], function_result.result, self.config.model)
+            openai_messages.append({
+                "role": "tool",
+                "tool_call_id": tool_call["id"],
+                "content": tool_content
+            })
+    
+    def _format_partial_answer(self, stop_reason: str, function_results: List[FunctionCallResult]) -> str:
+        """预算用完时，直接用已获取的工具结果组成回答"""
+        reasons = {"max_steps": "工具调用轮数上限", "token_budget": "Token预算", "deadline": "处理时间上限"}
+        formatted = f"⚠️ 已达到{reasons.get(stop_reason, stop_reason)}，以下是目前已获取的信息:\n\n"
+        for result in function_results:
+            if result.error:
+                continue
+            formatted += f"**{result.function_call.name}**\n{self.format_tool_result(result.result)}\n\n"
+        return formatted.rstrip()
+    
+    async def _execute_tool_calls(
+        self,
+        tool_calls: List[Dict[str, str]],
+        progress: Optional[ProgressCallback] = None
+    ) -> List[FunctionCallResult]:
+        """并行执行工具调用，并发数受 MCPClient 的 max_concurrent_calls 限制
         
-        # 转换工具为 OpenAI 格式
-        openai_tools = self._convert_tools_to_openai(tools)
-        openai_messages = self._convert_messages_to_openai(messages)
+        单个调用失败只记录在对应结果中，不影响其他调用。
+        """
+        return list(await asyncio.gather(*[
+            self._execute_tool_call(tool_call, progress) for tool_call in tool_calls
+        ]))
+    
+    async def _execute_tool_call(
+        self,
+        tool_call: Dict[str, str],
+        progress: Optional[ProgressCallback] = None
+    ) -> FunctionCallResult:
+        """执行单个工具调用"""
+        function_call = FunctionCall(name=tool_call["name"], arguments=tool_call["arguments"])
+        await self._emit(progress, StreamEvent(
+            type="tool_start", tool_name=tool_call["name"], arguments=tool_call["arguments"]
+        ))
+        start_time = time.monotonic()
+        try:
+            # 解析参数
+            parameters = json.loads(tool_call["arguments"] or "{}")
+            
+            # 调用 MCP 工具
+            result = await self.mcp_client.call_tool(tool_call["name"], parameters)
+            function_result = FunctionCallResult(function_call=function_call, result=result)
+            
+        except Exception as e:
+            logger.error(f"工具调用失败 {tool_call['name']}: {e}")
+            function_result = FunctionCallResult(function_call=function_call, error=str(e))
         
-        # 调用 LLM
-        response = await self.client.chat.completions.acreate(
-            model=self.config.model,
-            messages=openai_messages,
-            temperature=self.config.temperature,
-            max_tokens=self.config.max_tokens,
-            tools=openai_tools,
-            tool_choice="auto"
-        )
+        await self._emit(progress, StreamEvent(
+            type="tool_end", tool_name=tool_call["name"], success=function_result.error is None,
+            elapsed_ms=(time.monotonic() - start_time) * 1000
+        ))
+        return function_result
+    
+    async def _complete(
+        self,
+        openai_messages: List[Dict[str, Any]],
+        progress: Optional[ProgressCallback] = None,
+        tools: Optional[List[Dict[str, Any]]] = None,
+        timeout: Optional[float] = None
+    ) -> CompletionOutput:
+        """调用一次 Chat Completion，返回 (文本, 工具调用列表, token用量)
         
-        message = response.choices[0].message
+        受 max_concurrency 限制，整次调用（含排队和流式读取）不超过 timeout（默认 request_timeout）
+        和请求的剩余时间；调用方任务被取消时请求随之中断，并发名额立即释放。
+        """
+        if self._closed:
+            raise MCPException("LLM_CLOSED", "LLM processor is closed")
+        timeout = max(clamp_timeout(self.config.request_timeout if timeout is None else timeout), 0.001)
+        deadline = time.monotonic() + timeout
+        self.stats.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            raise MCPException("LLM_TIMEOUT", f"LLM call timed out after {timeout:.1f}s waiting for a free slot")
+        finally:
+            self.stats.waiting -= 1
         
-        # 如果没有工具调用，直接返回
-        if not message.tool_calls:
-            return ProcessResult(
-                content=message.content,
-                usage=response.usage.model_dump() if response.usage else None
+        # 调用放在单独的任务中，close() 只取消调用本身，不影响调用方（调度器的 worker）
+        task = asyncio.ensure_future(self._complete_with_failover(openai_messages, progress, tools, deadline))
+        self._in_flight_tasks.add(task)
+        self.stats.in_flight += 1
+        self.stats.max_in_flight = max(self.stats.max_in_flight, self.stats.in_flight)
+        start_time = time.monotonic()
+        try:
+            output = await task
+        except asyncio.CancelledError:
+            self.stats.cancelled += 1
+            if self._closed and task.cancelled():
+                raise MCPException("LLM_CLOSED", "LLM processor was closed during the call")
+            raise
+        except (asyncio.TimeoutError, openai.APITimeoutError) as e:
+            self.stats.timeouts += 1
+            raise MCPException(
+                "LLM_TIMEOUT",
+                f"LLM call timed out after {timeout:.1f}s",
+                str(e)
             )
+        except Exception:
+            self.stats.failed += 1
+            raise
+        finally:
+            self.stats.in_flight -= 1
+            self._in_flight_tasks.discard(task)
+            self._semaphore.release()
+        
+        self.stats.completed += 1
+        self._latency_total += (time.monotonic() - start_time) * 1000
+        self.stats.average_latency = self._latency_total / self.stats.completed
+        return output
+    
+    async def _complete_with_failover(
+        self,
+        openai_messages: List[Dict[str, Any]],
+        progress: Optional[ProgressCallback],
+        tools: Optional[List[Dict[str, Any]]],
+        deadline: float
+    ) -> CompletionOutput:
+        """按得分依次尝试各后端
         
-        # 执行工具调用
-        function_results = []
-        for tool_call in message.tool_calls:
+        还有备用后端时，当前后端最多占用剩余时间的 failover_ratio，失败或超时即切换到下一个；
+        流式输出已推送给用户后不再切换；启用对冲时，非流式调用在单个后端内由 Hedger 对冲。
+        """
+        candidates = self.providers.candidates()
+        last_error: Optional[BaseException] = None
+        
+        for index, backend in enumerate(candidates):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            budget = remaining if index == len(candidates) - 1 else remaining * self.config.failover_ratio
+            
+            streamed = False
+            
+            async def attempt_progress(event: StreamEvent) -> None:
+                nonlocal streamed
+                streamed = True
+                await progress(event)
+            
+            self.providers.begin(backend)
+            start_time = time.monotonic()
             try:
-                # 解析参数
-                parameters = json.loads(tool_call.function.arguments)
-                
-                # 调用 MCP 工具
-                result = await self.mcp_client.call_tool(
-                    tool_call.function.name,
-                    parameters
-                )
-                
-                function_results.append(FunctionCallResult(
-                    function_call=FunctionCall(
-                        name=tool_call.function.name,
-                        arguments=tool_call.function.arguments
-                    ),
-                    result=result
-                ))
-                
-                # 将工具结果添加到消息历史
-                openai_messages.append({
-                    "role": "assistant",
-                    "content": message.content,
-                    "tool_calls": [{
-                        "id": tool_call.id,
-                        "type": "function",
-                        "function": {
-                            "name": tool_call.function.name,
-                            "arguments": tool_call.function.arguments
-                        }
-                    }]
-                })
-                
-                openai_messages.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "content": json.dumps(result, ensure_ascii=False, indent=2)
-                })
-                
+                if progress is None and self.hedger.config.enabled:
+                    # 只对冲非流式调用，流式输出已推送给用户，无法再换成另一个请求的结果
+                    call = self.hedger.run(
+                        backend.name, lambda: self._run_completion(backend, openai_messages, None, tools)
+                    )
+                else:
+                    call = self._run_completion(backend, openai_messages, attempt_progress if progress else None, tools)
+                output = await asyncio.wait_for(call, timeout=budget)
+            except asyncio.CancelledError:
+                self.providers.cancel(backend)
+                raise
             except Exception as e:
-                logger.error(f"工具调用失败 {tool_call.function.name}: {e}")
-                function_results.append(FunctionCallResult(
-                    function_call=FunctionCall(
-                        name=tool_call.function.name,
-                        arguments=tool_call.function.arguments
-                    ),
-                    error=str(e)
-                ))
-        
-        # 如果有工具调用结果，再次调用 LLM 生成最终回复
-        if function_results:
-            final_response = await self.client.chat.completions.acreate(
-                model=self.config.model,
-                messages=openai_messages,
-                temperature=self.config.temperature,
-                max_tokens=self.config.max_tokens
-            )
+                self.providers.record_failure(backend, (time.monotonic() - start_time) * 1000)
+                last_error = e
+                if streamed:
+                    raise
+                if index < len(candidates) - 1:
+                    logger.warning(f"LLM 后端 {backend.name} 调用失败，切换到下一个后端: {e!r}")
+                continue
             
-            final_content = self._format_response_with_tools(
-                final_response.choices[0].message.content,
-                function_results
-            )
-            
-            return ProcessResult(
-                content=final_content,
-                function_calls=function_results,
-                usage=final_response.usage.model_dump() if final_response.usage else None
-            )
+            self.providers.record_success(backend, (time.monotonic() - start_time) * 1000)
+            return output
         
-        return ProcessResult(
-            content=message.content or "执行完成",
-            function_calls=function_results,
-            usage=response.usage.model_dump() if response.usage else None
+        raise last_error or asyncio.TimeoutError()
+    
+    async def _run_completion(
+        self,
+        backend: ProviderBackend,
+        openai_messages: List[Dict[str, Any]],
+        progress: Optional[ProgressCallback],
+        tools: Optional[List[Dict[str, Any]]]
+    ) -> CompletionOutput:
+        """在指定后端上发起请求并解析结果，传入 progress 时以 stream=True 请求，文本增量实时回调"""
+        kwargs: Dict[str, Any] = {
+            "model": backend.model,
+            "messages": openai_messages,
+            "temperature": self.config.temperature,
+            "max_tokens": self.config.max_tokens
+        }
+        if tools:
+            kwargs["tools"] = tools
+            kwargs["tool_choice"] = "auto"
+        
+        if progress is None:
+            response = await self._create_completion(backend, **kwargs)
+            message = response.choices[0].message
+            tool_calls = [
+                {"id": tc.id, "name": tc.function.name, "arguments": tc.function.arguments}
+                for tc in message.tool_calls or []
+            ]
+            return message.content or "", tool_calls, self._usage_to_dict(response.usage)
+        
+        stream = await self._create_completion(
+            backend,
+            **kwargs,
+            stream=True,
+            extra_body={"stream_options": {"include_usage": True}}
         )
+        
+        parts: List[str] = []
+        calls: Dict[int, Dict[str, str]] = {}
+        usage = None
+        try:
+            async for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    usage = self._usage_to_dict(chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    parts.append(delta.content)
+                    await self._emit(progress, StreamEvent(type="text", text=delta.content))
+                # 工具调用参数分多个增量到达，按 index 拼接
+                for tc in delta.tool_calls or []:
+                    call = calls.setdefault(tc.index, {"id": "", "name": "", "arguments": ""})
+                    if tc.id:
+                        call["id"] = tc.id
+                    if tc.function and tc.function.name:
+                        call["name"] += tc.function.name
+                    if tc.function and tc.function.arguments:
+                        call["arguments"] += tc.function.arguments
+        finally:
+            # 超时或取消时关闭响应，连接归还连接池
+            await stream.close()
+        
+        return "".join(parts), [calls[i] for i in sorted(calls)], usage
+    
+    async def _create_completion(self, backend: ProviderBackend, **kwargs):
+        """发起 Chat Completion 请求"""
+        return await backend.client.chat.completions.create(**kwargs)
+    
+    async def _emit(self, progress: Optional[ProgressCallback], event: StreamEvent) -> None:
+        """推送进度事件，回调异常不影响主流程"""
+        if progress is None:
+            return
+        try:
+            await progress(event)
+        except Exception as e:
+            logger.warning(f"推送进度事件失败: {e}")
+    
+    @staticmethod
+    def _usage_to_dict(usage: Any) -> Optional[Dict[str, int]]:
+        """提取 token 用量中的整数字段"""
+        if not usage:
+            return None
+        data = usage.model_dump() if hasattr(usage, "model_dump") else dict(usage)
+        return {key: value for key, value in data.items() if isinstance(value, int)}
     
     def _convert_messages_to_openai(self, messages: List[ChatMessage]) -> List[Dict[str, Any]]:
         """转换消息格式为 OpenAI 格式"""
@@ -227,20 +803,6 @@ class EnhancedLLMProcessor:
         
         return result
     
-    def _convert_tools_to_openai(self, tools) -> List[Dict[str, Any]]:
-        """转换 MCP 工具为 OpenAI 工具格式"""
-        result = []
-        for tool in tools:
-            result.append({
-                "type": "function",
-                "function": {
-                    "name": tool.name,
-                    "description": tool.description,
-                    "parameters": tool.input_schema
-                }
-            })
-        return result
-    
     def _format_response_with_tools(
         self,
         content: str,
@@ -280,11 +842,9 @@ class EnhancedLLMProcessor:
             "/help": "显示帮助信息"
         }
         
-        # 如果 MCP 客户端连接，添加工具相关的快捷指令
+        # 如果 MCP 客户端连接，添加工具目录中的快捷指令
         if self.mcp_client.status.value == "connected":
-            tools = await self.mcp_client.list_tools()
-            for tool in tools:
-                shortcuts[f"/tool-{tool.name}"] = f"直接调用工具: {tool.description}"
+            shortcuts.update(self.mcp_client.get_catalog().shortcuts)
         
         return shortcuts
     
@@ -0,0 +1,158 @@
+"""
+LLM 提供商
+OpenAI、智谱、通义千问均提供 OpenAI 兼容接口，每个后端一个 AsyncOpenAI 客户端（共享连接池）；
+按观测到的延迟和错误率的 EWMA 选择后端，连续失败的后端由熔断器暂时摘除
+"""
+
+import time
+from enum import Enum
+from typing import Dict, List, Optional
+import httpx
+import openai
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from ..mcp.types import LLMConfig, ProviderConfig
+
+
+# 各提供商的 OpenAI 兼容接口地址
+DEFAULT_BASE_URLS: Dict[str, Optional[str]] = {
+    "openai": None,
+    "zhipu": "https://open.bigmodel.cn/api/paas/v4/",
+    "qwen": "https://dashscope.aliyuncs.com/compatible-mode/v1",
+}
+
+# 打分时错误率的权重：错误率 50% 的后端按延迟翻 3 倍计
+ERROR_RATE_PENALTY = 4.0
+
+
+class CircuitState(str, Enum):
+    """熔断器状态"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class ProviderStats(BaseModel):
+    """单个后端的统计信息"""
+    name: str = Field(..., description="后端名称")
+    provider: str = Field(..., description="提供商")
+    model: str = Field(..., description="模型")
+    state: CircuitState = Field(default=CircuitState.CLOSED, description="熔断器状态")
+    requests: int = Field(default=0, description="请求数")
+    failures: int = Field(default=0, description="失败数")
+    ewma_latency_ms: float = Field(default=0, description="延迟的EWMA(ms)")
+    ewma_error_rate: float = Field(default=0, description="错误率的EWMA")
+    circuit_opens: int = Field(default=0, description="熔断次数")
+
+
+class ProviderBackend:
+    """一个已配置的 LLM 后端"""
+
+    def __init__(self, config: ProviderConfig, http_client: httpx.AsyncClient, llm_config: LLMConfig):
+        self.config = config
+        self.name = config.name or config.provider
+        self.model = config.model
+        self.client = openai.AsyncOpenAI(
+            api_key=config.api_key,
+            base_url=config.base_url or DEFAULT_BASE_URLS.get(config.provider),
+            http_client=http_client,
+            timeout=httpx.Timeout(llm_config.request_timeout, connect=llm_config.connect_timeout),
+            max_retries=0
+        )
+        self.stats = ProviderStats(name=self.name, provider=config.provider, model=config.model)
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        # 已观测到的调用结果数（不含被取消的调用）
+        self.samples = 0
+
+    def score(self) -> float:
+        """越小越优先：延迟 EWMA 按错误率加权；尚未观测过的后端排在所有已观测的后端之后"""
+        if not self.samples:
+            return float("inf")
+        return self.stats.ewma_latency_ms * (1 + ERROR_RATE_PENALTY * self.stats.ewma_error_rate)
+
+
+class ProviderPool:
+    """多个后端的路由、熔断和统计"""
+
+    def __init__(self, llm_config: LLMConfig, http_client: httpx.AsyncClient):
+        self.config = llm_config
+        primary = ProviderConfig(
+            name=llm_config.provider,
+            provider=llm_config.provider,
+            model=llm_config.model,
+            api_key=llm_config.api_key,
+            base_url=llm_config.base_url
+        )
+        self.backends = [
+            ProviderBackend(backend_config, http_client, llm_config)
+            for backend_config in [primary, *llm_config.fallback_providers]
+        ]
+
+    def candidates(self) -> List[ProviderBackend]:
+        """按得分排序的可用后端；冷却期已过的熔断后端作为半开探测加入，全部熔断时仍返回全部后端"""
+        now = time.monotonic()
+        available = []
+        for backend in self.backends:
+            if backend.stats.state == CircuitState.OPEN and now - backend.opened_at >= self.config.circuit_cooldown:
+                backend.stats.state = CircuitState.HALF_OPEN
+            if backend.stats.state == CircuitState.CLOSED:
+                available.append(backend)
+            elif backend.stats.state == CircuitState.HALF_OPEN and not backend.probing:
+                available.append(backend)
+
+        if not available:
+            logger.warning("所有 LLM 后端均已熔断，仍按得分依次尝试")
+            available = list(self.backends)
+        # sorted 是稳定排序，得分相同（包括都未观测过）时保持配置顺序（主后端优先）
+        return sorted(available, key=lambda backend: backend.score())
+
+    def begin(self, backend: ProviderBackend) -> None:
+        """开始一次调用，半开状态下只放行一个探测请求"""
+        backend.stats.requests += 1
+        if backend.stats.state == CircuitState.HALF_OPEN:
+            backend.probing = True
+
+    def record_success(self, backend: ProviderBackend, latency_ms: float) -> None:
+        """记录成功调用"""
+        self._observe(backend, latency_ms, False)
+        backend.consecutive_failures = 0
+        backend.probing = False
+        if backend.stats.state != CircuitState.CLOSED:
+            logger.info(f"LLM 后端 {backend.name} 恢复")
+            backend.stats.state = CircuitState.CLOSED
+
+    def record_failure(self, backend: ProviderBackend, latency_ms: float) -> None:
+        """记录失败调用，连续失败达到阈值或半开探测失败时熔断"""
+        self._observe(backend, latency_ms, True)
+        backend.stats.failures += 1
+        backend.consecutive_failures += 1
+        backend.probing = False
+        if backend.stats.state == CircuitState.HALF_OPEN or \
+                backend.consecutive_failures >= self.config.circuit_failure_threshold:
+            if backend.stats.state != CircuitState.OPEN:
+                backend.stats.circuit_opens += 1
+                logger.warning(f"LLM 后端 {backend.name} 连续失败 {backend.consecutive_failures} 次，熔断 "
+                               f"{self.config.circuit_cooldown:g}s")
+            backend.stats.state = CircuitState.OPEN
+            backend.opened_at = time.monotonic()
+
+    def cancel(self, backend: ProviderBackend) -> None:
+        """调用被取消，不计入成功或失败"""
+        backend.probing = False
+
+    def get_stats(self) -> List[ProviderStats]:
+        """获取各后端统计信息"""
+        return [backend.stats.model_copy() for backend in self.backends]
+
+    def _observe(self, backend: ProviderBackend, latency_ms: float, failed: bool) -> None:
+        alpha = self.config.ewma_alpha
+        stats = backend.stats
+        if not backend.samples:
+            stats.ewma_latency_ms = latency_ms
+        else:
+            stats.ewma_latency_ms = alpha * latency_ms + (1 - alpha) * stats.ewma_latency_ms
+        backend.samples += 1
+        stats.ewma_error_rate = alpha * float(failed) + (1 - alpha) * stats.ewma_error_rate
@@ -0,0 +1,115 @@
+"""
+快捷指令直达解析
+把 /pods、/logs、/scale、/status 以及 /tool-* 指令的参数直接解析为 MCP 工具调用，
+只有参数无法确定时才交给 LLM 理解
+"""
+
+import json
+import re
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from pydantic import BaseModel, Field
+
+from ..mcp.catalog import TOOL_SHORTCUT_PREFIX
+from ..mcp.types import MCPTool
+
+
+# Kubernetes 资源名称（RFC 1123），位置参数必须符合，否则视为自然语言
+K8S_NAME_PATTERN = re.compile(r"^[a-z0-9]([-a-z0-9.]*[a-z0-9])?$")
+
+# 快捷指令 -> (工具名称, 位置参数顺序)
+SHORTCUT_TOOLS: Dict[str, Tuple[str, List[str]]] = {
+    "/pods": ("k8s-get-pods", ["namespace"]),
+    "/status": ("k8s-get-pods", ["namespace"]),
+    "/logs": ("k8s-get-logs", ["pod_name", "namespace", "lines"]),
+    "/scale": ("k8s-scale-deployment", ["name", "replicas", "namespace"]),
+}
+
+
+class ShortcutCall(BaseModel):
+    """解析后的快捷指令工具调用"""
+    shortcut: str = Field(..., description="快捷指令")
+    tool_name: str = Field(..., description="工具名称")
+    parameters: Dict[str, Any] = Field(default_factory=dict, description="调用参数")
+
+
+def parse_shortcut_call(
+    shortcut: str,
+    content: str,
+    tools: Mapping[str, MCPTool]
+) -> Optional[ShortcutCall]:
+    """把快捷指令解析为确定的工具调用，参数有歧义时返回 None"""
+    content = content.strip()
+
+    if shortcut.startswith(TOOL_SHORTCUT_PREFIX):
+        tool_name = shortcut[len(TOOL_SHORTCUT_PREFIX):]
+        positional: List[str] = []
+    elif shortcut in SHORTCUT_TOOLS:
+        tool_name, positional = SHORTCUT_TOOLS[shortcut]
+    else:
+        return None
+
+    tool = tools.get(tool_name)
+    if not tool:
+        return None
+
+    parameters = _parse_arguments(content, positional, tool)
+    if parameters is None:
+        return None
+
+    required = tool.input_schema.get("required", [])
+    if any(name not in parameters for name in required):
+        return None
+
+    return ShortcutCall(shortcut=shortcut, tool_name=tool_name, parameters=parameters)
+
+
+def _parse_arguments(content: str, positional: List[str], tool: MCPTool) -> Optional[Dict[str, Any]]:
+    """解析 JSON 对象、key=value 或位置参数"""
+    if not content:
+        return {}
+
+    properties = tool.input_schema.get("properties", {})
+
+    if content.startswith("{"):
+        try:
+            parameters = json.loads(content)
+        except ValueError:
+            return None
+        if not isinstance(parameters, dict) or any(name not in properties for name in parameters):
+            return None
+        return parameters
+
+    parameters: Dict[str, Any] = {}
+    index = 0
+    for token in content.split():
+        name, sep, raw = token.partition("=")
+        if sep:
+            if name not in properties or not raw:
+                return None
+            value = _coerce(raw, properties[name], strict=False)
+        else:
+            if index >= len(positional):
+                return None
+            name, raw = positional[index], token
+            index += 1
+            value = _coerce(raw, properties.get(name, {}), strict=True)
+
+        if value is None or name in parameters:
+            return None
+        parameters[name] = value
+
+    return parameters
+
+
+def _coerce(raw: str, schema: Dict[str, Any], strict: bool) -> Optional[Any]:
+    """按参数 schema 转换取值；strict 时字符串必须是合法的资源名称"""
+    if schema.get("type") in ("number", "integer"):
+        try:
+            value = int(raw)
+        except ValueError:
+            return None
+        return value if value >= 0 else None
+
+    if strict and not K8S_NAME_PATTERN.match(raw):
+        return None
+    return raw
@@ -0,0 +1,81 @@
+"""
+请求合并（single-flight）
+键相同的并发请求共享同一个进行中的计算，每个请求方都拿到结果；
+请求方可以各自取消，所有请求方都取消后才取消底层计算
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Tuple, TypeVar
+from pydantic import BaseModel, Field
+
+
+T = TypeVar("T")
+
+
+class SingleFlightStats(BaseModel):
+    """请求合并统计信息"""
+    calls: int = Field(default=0, description="请求数")
+    executions: int = Field(default=0, description="实际执行的计算数")
+    coalesced: int = Field(default=0, description="合并到进行中计算的请求数")
+    in_flight: int = Field(default=0, description="进行中的计算数")
+    cancelled_waiters: int = Field(default=0, description="中途取消的请求数")
+    abandoned: int = Field(default=0, description="所有请求方都取消而被取消的计算数")
+
+
+class _Flight(Generic[T]):
+    """一个进行中的计算及其请求方数量"""
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Future[T]"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(Generic[T]):
+    """按键合并并发请求"""
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight[T]] = {}
+        self.stats = SingleFlightStats()
+
+    async def do(self, key: str, make_call: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """执行或加入键相同的计算，返回 (结果, 是否与其他请求共享)"""
+        self.stats.calls += 1
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(make_call()))
+            self._flights[key] = flight
+            self.stats.executions += 1
+            flight.task.add_done_callback(lambda _: self._finish(key, flight))
+        else:
+            self.stats.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            # shield：单个请求方被取消不影响其他请求方
+            return await asyncio.shield(flight.task), shared
+        except asyncio.CancelledError:
+            if not flight.task.done():
+                self.stats.cancelled_waiters += 1
+            raise
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+                self.stats.abandoned += 1
+                # 等底层计算处理完取消（释放并发名额等）后再返回
+                await asyncio.wait({flight.task})
+
+    def get_stats(self) -> SingleFlightStats:
+        """获取统计信息"""
+        stats = self.stats.model_copy()
+        stats.in_flight = len(self._flights)
+        return stats
+
+    def _finish(self, key: str, flight: _Flight[T]) -> None:
+        """计算结束后移除，之后的请求重新执行"""
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            flight.task.exception()  # 标记已读取，避免所有请求方都已离开时的未处理异常警告
@@ -0,0 +1,52 @@
+"""
+Token 估算
+安装了 tiktoken 时使用对应模型的编码器，否则按字符类型近似估算
+（CJK 字符约 1 token/字，其余约 4 字符/token）
+"""
+
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken 是可选依赖
+    tiktoken = None
+
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=16)
+def _get_encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def estimate_tokens(text: Optional[str], model: str = "gpt-3.5-turbo") -> int:
+    """估算文本的 token 数"""
+    if not text:
+        return 0
+
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+
+    cjk = sum(1 for char in text if "⺀" <= char <= "鿿" or "가" <= char <= "힯")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_message_tokens(messages: List[Dict[str, Any]], model: str = "gpt-3.5-turbo") -> int:
+    """估算 OpenAI 格式消息列表的 token 数"""
+    total = 0
+    for message in messages:
+        total += MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message.get("content") or "", model)
+        for tool_call in message.get("tool_calls") or []:
+            function = tool_call.get("function", {})
+            total += estimate_tokens(function.get("name", ""), model)
+            total += estimate_tokens(function.get("arguments", ""), model)
+    return total
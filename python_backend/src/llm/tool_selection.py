@@ -0,0 +1,142 @@
+"""
+工具子集选择
+工具较多时只把与请求相关的 top-k 个工具的 schema 发给 LLM：按工具目录的检索索引打分，
+再按近期请求中工具的共同使用情况加分；得分过低（置信度不足）时仍发送全部工具
+"""
+
+import json
+from collections import deque
+from typing import Any, Deque, Dict, FrozenSet, List, Optional, Tuple
+from pydantic import BaseModel, Field
+
+from ..mcp.catalog import ToolCatalog
+from .tokens import estimate_tokens
+
+
+class ToolSelectionConfig(BaseModel):
+    """工具子集选择配置"""
+    enabled: bool = Field(default=True, description="是否启用工具子集选择")
+    top_k: int = Field(default=6, ge=1, description="每个请求最多发送的工具数")
+    min_catalog_size: int = Field(default=10, ge=1, description="工具数超过该值时才进行选择")
+    min_score: float = Field(default=2.0, ge=0, description="最高得分低于该值时认为置信度不足，发送全部工具")
+    co_usage_weight: float = Field(default=0.5, ge=0, description="近期共同使用加分的权重")
+    co_usage_window: int = Field(default=200, ge=1, description="统计共同使用的最近请求数")
+
+
+class ToolSelectionStats(BaseModel):
+    """工具子集选择统计信息"""
+    requests: int = Field(default=0, description="带工具的请求数")
+    subset_requests: int = Field(default=0, description="只发送工具子集的请求数")
+    full_fallbacks: int = Field(default=0, description="置信度不足而发送全部工具的请求数")
+    misses: int = Field(default=0, description="模型请求了子集之外的工具的次数")
+    miss_rate: float = Field(default=0, description="未命中率")
+    tools_offered: int = Field(default=0, description="子集请求累计发送的工具数")
+    prompt_tokens_saved: int = Field(default=0, description="累计节省的提示词token数(估算)")
+
+
+class ToolSelection:
+    """一次请求选中的工具"""
+
+    __slots__ = ("tools", "names", "saved_tokens")
+
+    def __init__(self, tools: List[Dict[str, Any]], names: Optional[FrozenSet[str]] = None, saved_tokens: int = 0):
+        self.tools = tools
+        # 为 None 时表示全部工具
+        self.names = names
+        # 每次 LLM 调用节省的 token 数
+        self.saved_tokens = saved_tokens
+
+    @property
+    def is_subset(self) -> bool:
+        return self.names is not None
+
+
+class ToolSelector:
+    """按相关度和近期共同使用选择工具子集"""
+
+    def __init__(self, config: Optional[ToolSelectionConfig] = None):
+        self.config = config or ToolSelectionConfig()
+        self.stats = ToolSelectionStats()
+        # 最近请求中实际使用的工具集合
+        self._recent: Deque[FrozenSet[str]] = deque(maxlen=self.config.co_usage_window)
+        # (工具目录指纹, 模型) -> (各工具 schema 的 token 数, 全部工具的 token 数)
+        self._token_costs: Dict[Tuple[str, str], Tuple[Dict[str, int], int]] = {}
+
+    def select(self, catalog: ToolCatalog, query: str, model: str) -> ToolSelection:
+        """为请求选择工具"""
+        self.stats.requests += 1
+        full = ToolSelection(list(catalog.openai_tools))
+        if not self.config.enabled or len(catalog) <= self.config.min_catalog_size:
+            return full
+
+        lexical = catalog.index.score(query)
+        if not lexical or lexical[0][1] < self.config.min_score:
+            self.stats.full_fallbacks += 1
+            return full
+
+        scores = dict(lexical)
+        for name, boost in self._co_usage_boost(lexical[:self.config.top_k]).items():
+            scores[name] = scores.get(name, 0.0) + boost
+        ranked = sorted(scores, key=lambda name: scores[name], reverse=True)
+        names = frozenset(ranked[:self.config.top_k])
+
+        # 保持工具目录中的顺序，相同子集的请求前缀一致
+        tools = [tool for tool in catalog.openai_tools if tool["function"]["name"] in names]
+        tool_tokens, total_tokens = self._costs(catalog, model)
+        saved = total_tokens - sum(tool_tokens[name] for name in names)
+
+        self.stats.subset_requests += 1
+        self.stats.tools_offered += len(tools)
+        return ToolSelection(tools, names, max(saved, 0))
+
+    def record_call(self, selection: ToolSelection) -> None:
+        """记录一次带工具的 LLM 调用"""
+        if selection.is_subset:
+            self.stats.prompt_tokens_saved += selection.saved_tokens
+
+    def record_miss(self, catalog: ToolCatalog) -> ToolSelection:
+        """模型请求了子集之外的工具：计入未命中，之后的调用改为发送全部工具"""
+        self.stats.misses += 1
+        return ToolSelection(list(catalog.openai_tools))
+
+    def record_usage(self, tool_names: List[str]) -> None:
+        """记录一次请求实际使用的工具"""
+        if tool_names:
+            self._recent.append(frozenset(tool_names))
+
+    def get_stats(self) -> ToolSelectionStats:
+        """获取统计信息"""
+        stats = self.stats.model_copy()
+        if stats.subset_requests:
+            stats.miss_rate = stats.misses / stats.subset_requests
+        return stats
+
+    def _co_usage_boost(self, top: List[Tuple[str, float]]) -> Dict[str, float]:
+        """与高分工具经常一起使用的工具按条件概率加分"""
+        if not self.config.co_usage_weight or not self._recent:
+            return {}
+        boosts: Dict[str, float] = {}
+        for name, score in top:
+            used = [tools for tools in self._recent if name in tools]
+            if not used:
+                continue
+            counts: Dict[str, int] = {}
+            for tools in used:
+                for other in tools:
+                    if other != name:
+                        counts[other] = counts.get(other, 0) + 1
+            for other, count in counts.items():
+                boosts[other] = boosts.get(other, 0.0) + self.config.co_usage_weight * score * count / len(used)
+        return boosts
+
+    def _costs(self, catalog: ToolCatalog, model: str) -> Tuple[Dict[str, int], int]:
+        key = (catalog.fingerprint, model)
+        if key not in self._token_costs:
+            if len(self._token_costs) >= 8:
+                self._token_costs.clear()
+            tool_tokens = {
+                tool["function"]["name"]: estimate_tokens(json.dumps(tool, ensure_ascii=False), model)
+                for tool in catalog.openai_tools
+            }
+            self._token_costs[key] = (tool_tokens, estimate_tokens(catalog.openai_tools_json, model))
+        return self._token_costs[key]
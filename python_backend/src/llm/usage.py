@@ -0,0 +1,182 @@
+"""
+Token 用量账本
+按 senderId、conversationId、快捷指令和模型分时间桶累计请求数、token（发送前本地估算 +
+服务端返回）和耗时，并按用户/群配额判断是否放行或降级
+"""
+
+import time
+from typing import Dict, List, Literal, Optional, Tuple
+from pydantic import BaseModel, Field
+
+from ..mcp.types import ProcessResult
+
+
+DIMENSIONS = ("user", "group", "shortcut", "model")
+
+# 每个时间桶的计数器下标
+REQUESTS, ESTIMATED_PROMPT, PROMPT, COMPLETION, LATENCY_MS, CACHED = range(6)
+
+
+class UsageLedgerConfig(BaseModel):
+    """用量账本配置"""
+    bucket_seconds: int = Field(default=3600, ge=60, description="时间桶长度(s)")
+    retention_buckets: int = Field(default=48, ge=1, description="保留的时间桶数")
+    quota_window_seconds: int = Field(default=86400, ge=60, description="配额统计窗口(s)")
+    user_token_quota: int = Field(default=0, ge=0, description="每个用户在窗口内的token配额，0表示不限")
+    group_token_quota: int = Field(default=0, ge=0, description="每个会话(群)在窗口内的token配额，0表示不限")
+    quota_mode: Literal["soft", "hard"] = Field(
+        default="soft", description="超出配额时 soft 降级为不带工具和历史的精简回答，hard 直接拒绝"
+    )
+
+
+class UsageSummary(BaseModel):
+    """某个维度取值的用量汇总"""
+    dimension: str = Field(..., description="维度")
+    key: str = Field(..., description="维度取值")
+    requests: int = Field(default=0, description="请求数")
+    estimated_prompt_tokens: int = Field(default=0, description="发送前估算的提示词token数")
+    prompt_tokens: int = Field(default=0, description="服务端统计的提示词token数")
+    completion_tokens: int = Field(default=0, description="服务端统计的生成token数")
+    total_tokens: int = Field(default=0, description="服务端统计的token总数")
+    cached: int = Field(default=0, description="命中回答缓存或合并到其他请求的请求数")
+    average_latency_ms: float = Field(default=0, description="平均耗时(ms)")
+
+
+class QuotaDecision(BaseModel):
+    """配额检查结果"""
+    allowed: bool = Field(default=True, description="是否放行")
+    degraded: bool = Field(default=False, description="是否降级处理")
+    reason: Optional[str] = Field(None, description="限制原因")
+    user_tokens: int = Field(default=0, description="用户窗口内已用token")
+    group_tokens: int = Field(default=0, description="会话窗口内已用token")
+
+
+class UsageLedger:
+    """分时间桶的用量账本"""
+
+    def __init__(self, config: Optional[UsageLedgerConfig] = None):
+        self.config = config or UsageLedgerConfig()
+        # (维度, 取值) -> {桶起始时间: 计数器}
+        self._series: Dict[Tuple[str, str], Dict[int, List[int]]] = {}
+        self._oldest_bucket = self._bucket(time.time())
+
+    def record(
+        self,
+        sender_id: str,
+        conversation_id: str,
+        model: str,
+        result: Optional[ProcessResult],
+        latency_ms: float,
+        shortcut: Optional[str] = None
+    ) -> None:
+        """记录一次请求"""
+        now = time.time()
+        self._prune(now)
+
+        values = [0] * 6
+        values[REQUESTS] = 1
+        values[LATENCY_MS] = int(latency_ms)
+        if result and (result.from_cache or result.coalesced):
+            # 缓存或合并得到的回答本次没有消耗token，不计入用量和配额
+            values[CACHED] = 1
+        else:
+            usage = (result.usage if result else None) or {}
+            values[ESTIMATED_PROMPT] = (result.estimated_prompt_tokens if result else None) or 0
+            values[PROMPT] = usage.get("prompt_tokens", 0)
+            values[COMPLETION] = usage.get("completion_tokens", 0)
+
+        bucket = self._bucket(now)
+        keys = {"user": sender_id, "group": conversation_id, "shortcut": shortcut or "chat", "model": model}
+        for dimension, key in keys.items():
+            counters = self._series.setdefault((dimension, key or "unknown"), {}).setdefault(bucket, [0] * 6)
+            for index, value in enumerate(values):
+                counters[index] += value
+
+    def check_quota(self, sender_id: str, conversation_id: str, estimated_tokens: int = 0) -> QuotaDecision:
+        """按窗口内已用token加上本次估算检查用户和会话配额"""
+        since = time.time() - self.config.quota_window_seconds
+        decision = QuotaDecision(
+            user_tokens=self._tokens_since("user", sender_id, since),
+            group_tokens=self._tokens_since("group", conversation_id, since)
+        )
+
+        if self.config.user_token_quota and \
+                decision.user_tokens + estimated_tokens > self.config.user_token_quota:
+            decision.reason = f"用户token额度已用完 ({decision.user_tokens}/{self.config.user_token_quota})"
+        elif self.config.group_token_quota and \
+                decision.group_tokens + estimated_tokens > self.config.group_token_quota:
+            decision.reason = f"本群token额度已用完 ({decision.group_tokens}/{self.config.group_token_quota})"
+
+        if decision.reason:
+            if self.config.quota_mode == "soft":
+                decision.degraded = True
+            else:
+                decision.allowed = False
+        return decision
+
+    def query(self, dimension: str, since_seconds: Optional[int] = None, limit: int = 20) -> List[UsageSummary]:
+        """按维度汇总用量，按token总数降序"""
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"未知的维度: {dimension}，可选 {', '.join(DIMENSIONS)}")
+        since = time.time() - since_seconds if since_seconds else 0
+
+        summaries = []
+        for (series_dimension, key), buckets in self._series.items():
+            if series_dimension != dimension:
+                continue
+            totals = [0] * 6
+            for bucket, counters in buckets.items():
+                if bucket + self.config.bucket_seconds > since:
+                    for index, value in enumerate(counters):
+                        totals[index] += value
+            if totals[REQUESTS]:
+                summaries.append(self._summary(dimension, key, totals))
+
+        summaries.sort(key=lambda s: (s.total_tokens, s.requests), reverse=True)
+        return summaries[:limit]
+
+    def series(self, dimension: str, key: str) -> List[Dict[str, int]]:
+        """某个维度取值按时间桶的用量"""
+        buckets = self._series.get((dimension, key), {})
+        return [
+            {"bucket": bucket, **self._summary(dimension, key, counters).model_dump(exclude={"dimension", "key"})}
+            for bucket, counters in sorted(buckets.items())
+        ]
+
+    def _tokens_since(self, dimension: str, key: str, since: float) -> int:
+        buckets = self._series.get((dimension, key), {})
+        return sum(
+            counters[PROMPT] + counters[COMPLETION]
+            for bucket, counters in buckets.items()
+            if bucket + self.config.bucket_seconds > since
+        )
+
+    def _summary(self, dimension: str, key: str, counters: List[int]) -> UsageSummary:
+        return UsageSummary(
+            dimension=dimension,
+            key=key,
+            requests=counters[REQUESTS],
+            estimated_prompt_tokens=counters[ESTIMATED_PROMPT],
+            prompt_tokens=counters[PROMPT],
+            completion_tokens=counters[COMPLETION],
+            total_tokens=counters[PROMPT] + counters[COMPLETION],
+            cached=counters[CACHED],
+            average_latency_ms=counters[LATENCY_MS] / counters[REQUESTS] if counters[REQUESTS] else 0
+        )
+
+    def _bucket(self, timestamp: float) -> int:
+        return int(timestamp) // self.config.bucket_seconds * self.config.bucket_seconds
+
+    def _prune(self, now: float) -> None:
+        """进入新的时间桶时删除超出保留期的桶"""
+        oldest = self._bucket(now) - (self.config.retention_buckets - 1) * self.config.bucket_seconds
+        if oldest <= self._oldest_bucket:
+            return
+        self._oldest_bucket = oldest
+
+        for series_key in list(self._series):
+            buckets = self._series[series_key]
+            for bucket in [b for b in buckets if b < oldest]:
+                del buckets[bucket]
+            if not buckets:
+                del self._series[series_key]
@@ -0,0 +1,49 @@
+"""
+工具目录
+工具集合变化时一次性生成 OpenAI 格式的工具 schema、快捷指令表、序列化 JSON 和检索索引，
+生成后的快照只读，由所有请求共享
+"""
+
+import hashlib
+import json
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, Mapping, Tuple
+
+from .types import MCPTool
+from .tool_index import ToolIndex
+
+
+TOOL_SHORTCUT_PREFIX = "/tool-"
+
+
+class ToolCatalog:
+    """某一版本工具集合的只读快照"""
+
+    __slots__ = (
+        "version", "tools", "by_name", "openai_tools", "openai_tools_json", "shortcuts", "index", "fingerprint"
+    )
+
+    def __init__(self, tools: Iterable[MCPTool], version: int = 0):
+        self.tools: Tuple[MCPTool, ...] = tuple(tools)
+        self.by_name: Mapping[str, MCPTool] = MappingProxyType({tool.name: tool for tool in self.tools})
+        self.openai_tools: Tuple[Dict[str, Any], ...] = tuple(
+            {
+                "type": "function",
+                "function": {
+                    "name": tool.name,
+                    "description": tool.description,
+                    "parameters": tool.input_schema
+                }
+            }
+            for tool in self.tools
+        )
+        self.openai_tools_json = json.dumps(self.openai_tools, ensure_ascii=False, sort_keys=True)
+        self.shortcuts: Mapping[str, str] = MappingProxyType({
+            f"{TOOL_SHORTCUT_PREFIX}{tool.name}": f"直接调用工具: {tool.description}" for tool in self.tools
+        })
+        self.index = ToolIndex(self.tools)
+        self.fingerprint = hashlib.sha256(self.openai_tools_json.encode()).hexdigest()[:16]
+        self.version = version
+
+    def __len__(self) -> int:
+        return len(self.tools)
@@ -9,13 +9,24 @@ import json
 import time
 import hashlib
 from typing import Dict, List, Optional, Any
-from datetime import datetime, timedelta
+from datetime import datetime
 from loguru import logger
 
 from .types import (
-    MCPTool, MCPToolCall, MCPToolResult, MCPClientConfig,
-    MCPConnectionStatus, MCPStats, MCPException
+    MCPTool, MCPToolCall, MCPToolResult, MCPClientConfig, MCPServerConfig,
+    MCPConnectionStatus, MCPStats, MCPException, ToolCachePolicy
 )
+from .catalog import ToolCatalog
+from .pool import MCPServerPool, ServerStats, SERVER_ERROR_CODES
+from .deadline import clamp_timeout, time_remaining
+from .result_cache import ResultCache, ResultCacheStats
+
+
+# 可以重试的错误：超时、断连和暂无可用服务器，工具本身返回的错误不重试
+RETRYABLE_ERROR_CODES = SERVER_ERROR_CODES | {"SERVER_UNAVAILABLE"}
+
+# 缓存未命中的标记，区分缓存的空结果
+_MISS = object()
 
 
 class MCPClient:
@@ -25,9 +36,16 @@ class MCPClient:
         self.config = config
         self.status = MCPConnectionStatus.DISCONNECTED
         self.tools: Dict[str, MCPTool] = {}
-        self.cache: Dict[str, Dict[str, Any]] = {}
+        self.catalog = ToolCatalog(())
+        # 修改类工具调用成功的次数，与目录版本一起组成数据版本
+        self._mutation_epoch = 0
+        self.cache = ResultCache(config.cache_max_entries, config.cache_max_bytes)
         self.stats = MCPStats()
+        self._total_execution_time = 0.0
+        self._cache_hits = 0
         self._semaphore = asyncio.Semaphore(config.max_concurrent_calls)
+        # 配置了 MCP 服务器时的服务器池，mock 模式为 None
+        self.pool: Optional[MCPServerPool] = None
         
     async def connect(self) -> None:
         """连接到 MCP 服务器"""
@@ -45,12 +63,14 @@ class MCPClient:
         except Exception as e:
             self.status = MCPConnectionStatus.ERROR
             logger.error(f"MCP 连接失败: {e}")
+            await self._close_pool()
             raise MCPException("CONNECTION_FAILED", "Failed to connect to MCP server", str(e))
     
     async def disconnect(self) -> None:
         """断开连接"""
+        await self._close_pool()
         self.status = MCPConnectionStatus.DISCONNECTED
-        self.tools.clear()
+        self._set_tools([])
         self.cache.clear()
         logger.info("MCP 客户端已断开连接")
     
@@ -60,6 +80,17 @@ class MCPClient:
             raise MCPException("NOT_CONNECTED", "MCP client is not connected")
         return list(self.tools.values())
     
+    @property
+    def data_version(self) -> str:
+        """当前工具集合和集群数据的版本，工具目录更新或修改类工具调用成功后变化"""
+        return f"{self.catalog.version}.{self._mutation_epoch}"
+    
+    def get_catalog(self) -> ToolCatalog:
+        """获取当前版本的工具目录（只读，可跨请求共享）"""
+        if self.status != MCPConnectionStatus.CONNECTED:
+            raise MCPException("NOT_CONNECTED", "MCP client is not connected")
+        return self.catalog
+    
     def get_tool(self, name: str) -> Optional[MCPTool]:
         """获取特定工具信息"""
         return self.tools.get(name)
@@ -70,61 +101,93 @@ class MCPClient:
         parameters: Dict[str, Any],
         context: Optional[Dict[str, Any]] = None
     ) -> Any:
-        """调用 MCP 工具"""
-        async with self._semaphore:
-            start_time = time.time()
-            call_id = self._generate_call_id()
+        """调用 MCP 工具
+        
+        每次尝试（含等待并发名额）不超过 timeout 和请求的剩余时间，超时即取消；
+        声明了只读或幂等的工具遇到超时、断连等错误时，在剩余时间内按带抖动的指数退避重试，
+        修改类工具和未声明的远程工具不重试。
+        结果按工具的缓存策略缓存；修改类工具调用成功（或超时、断连导致结果未知）后，依赖被修改资源的缓存立即失效。
+        """
+        start_time = time.time()
+        call_id = self._generate_call_id()
+        
+        try:
+            # 验证工具存在性
+            tool = self.tools.get(name)
+            if not tool:
+                raise MCPException("TOOL_NOT_FOUND", f"Tool '{name}' not found", tool_name=name)
             
-            try:
-                # 验证工具存在性
-                tool = self.tools.get(name)
-                if not tool:
-                    raise MCPException("TOOL_NOT_FOUND", f"Tool '{name}' not found", tool_name=name)
-                
-                # 验证参数
-                self._validate_parameters(tool, parameters)
-                
-                # 检查缓存
-                if self.config.enable_cache:
-                    cached_result = self._get_cached_result(name, parameters)
-                    if cached_result:
-                        self._update_stats(True, (time.time() - start_time) * 1000, True)
-                        return cached_result
-                
-                # 创建工具调用对象
-                tool_call = MCPToolCall(
-                    id=call_id,
-                    name=name,
-                    parameters=parameters,
-                    context=context
+            # 验证参数
+            self._validate_parameters(tool, parameters)
+            
+            # 检查缓存
+            policy = self._cache_policy(tool)
+            mutating = self._is_mutating(tool, policy)
+            use_cache = self.config.enable_cache and policy.cacheable and not mutating
+            if use_cache:
+                cache_key = self._generate_cache_key(name, parameters, policy.key_params)
+                cached_result = self.cache.get(cache_key, _MISS)
+                if cached_result is not _MISS:
+                    self._update_stats(True, (time.time() - start_time) * 1000, True)
+                    return cached_result
+            # 执行期间有修改类调用成功时，本次结果可能已过时，不写入缓存
+            epoch = self._mutation_epoch
+            
+            # 创建工具调用对象
+            tool_call = MCPToolCall(
+                id=call_id,
+                name=name,
+                parameters=parameters,
+                context=context
+            )
+            
+            # 执行工具调用，声明了只读或幂等的工具失败时重试
+            attempts = 1 + self.config.retry_attempts if self._is_retryable(tool, mutating) else 1
+            for attempt in range(attempts):
+                result = await self._execute_with_timeout(tool_call)
+                if not result.success and result.error.code == "TIMEOUT":
+                    self.stats.timeouts += 1
+                if result.success or attempt == attempts - 1 or result.error.code not in RETRYABLE_ERROR_CODES:
+                    break
+                delay = self._retry_backoff(attempt)
+                remaining = time_remaining()
+                if remaining is not None and remaining <= delay:
+                    break
+                self.stats.retries += 1
+                logger.warning(f"工具 {name} 调用失败({result.error.code})，{delay:.2f}s 后第 {attempt + 1} 次重试")
+                await asyncio.sleep(delay)
+            
+            # 缓存结果
+            if use_cache and result.success and epoch == self._mutation_epoch:
+                self.cache.put(
+                    cache_key, result.result, policy.ttl or self.config.cache_timeout / 1000,
+                    self._resource_tags(policy.resource_kinds, policy, parameters, for_read=True)
+                )
+            
+            # 修改类调用超时或断连时结果未知，可能已在服务端生效，同样让相关缓存失效
+            if mutating and (result.success or result.error.code in SERVER_ERROR_CODES):
+                self._mutation_epoch += 1
+                self._invalidate_cache(name, policy, parameters)
+            
+            if not result.success:
+                raise MCPException(
+                    "TIMEOUT" if result.error.code == "TIMEOUT" else "EXECUTION_FAILED",
+                    result.error.message,
+                    result.error.details,
+                    name
                 )
-                
-                # 执行工具调用
-                result = await self._execute_tool_call(tool_call)
-                
-                # 缓存结果
-                if self.config.enable_cache and result.success:
-                    self._cache_result(name, parameters, result.result)
-                
-                execution_time = (time.time() - start_time) * 1000
-                self._update_stats(result.success, execution_time, False)
-                
-                if not result.success:
-                    raise MCPException(
-                        "EXECUTION_FAILED", 
-                        result.error.message if result.error else "Tool execution failed",
-                        result.error.details if result.error else None,
-                        name
-                    )
-                
-                return result.result
-                
-            except MCPException:
-                raise
-            except Exception as e:
-                execution_time = (time.time() - start_time) * 1000
-                self._update_stats(False, execution_time, False)
-                raise MCPException("EXECUTION_FAILED", "Tool execution failed", str(e), name)
+            
+            self._update_stats(True, (time.time() - start_time) * 1000, False)
+            return result.result
+            
+        except MCPException:
+            # 包括工具不存在、参数错误和已过截止时间等未发起调用的失败
+            self._update_stats(False, (time.time() - start_time) * 1000, False)
+            raise
+        except Exception as e:
+            execution_time = (time.time() - start_time) * 1000
+            self._update_stats(False, execution_time, False)
+            raise MCPException("EXECUTION_FAILED", "Tool execution failed", str(e), name)
     
     async def call_tools_batch(
         self, 
@@ -172,20 +235,67 @@ class MCPClient:
         """获取统计信息"""
         return self.stats.model_copy()
     
+    def get_server_stats(self) -> List[ServerStats]:
+        """获取各 MCP 服务器的统计信息，mock 模式返回空列表"""
+        return self.pool.get_stats() if self.pool else []
+    
+    def get_cache_stats(self) -> ResultCacheStats:
+        """获取工具结果缓存的统计信息"""
+        return self.cache.get_stats()
+    
     def reset_stats(self) -> None:
         """重置统计信息"""
         self.stats = MCPStats(active_tools=len(self.tools))
+        self._total_execution_time = 0.0
+        self._cache_hits = 0
     
     # 私有方法
     
     async def _initialize_mcp_connection(self) -> None:
-        """初始化 MCP 连接"""
-        # 模拟连接延迟
-        await asyncio.sleep(0.1)
+        """初始化 MCP 连接：连接配置的所有 MCP 服务器"""
+        servers = self._server_configs()
+        if not servers:
+            # 未配置 MCP 服务器，模拟连接延迟
+            await asyncio.sleep(0.1)
+            return
+        
+        pool = MCPServerPool(self.config, servers, self._handle_tools_changed)
+        self.pool = pool
+        await pool.connect()
+    
+    def _server_configs(self) -> List[MCPServerConfig]:
+        """配置了 servers 时使用多服务器，否则按 transport 等字段连接单个服务器"""
+        if self.config.servers:
+            return list(self.config.servers)
+        if self.config.transport == "mock":
+            return []
+        return [MCPServerConfig(
+            name="default",
+            transport=self.config.transport,
+            server_command=self.config.server_command,
+            server_env=self.config.server_env,
+            server_url=self.config.server_url
+        )]
+    
+    async def _close_pool(self) -> None:
+        if self.pool:
+            pool, self.pool = self.pool, None
+            await pool.close()
+    
+    def _handle_tools_changed(self) -> None:
+        """某个服务器的工具列表变化、断开或重连后重建工具集合"""
+        if self.pool and self.status == MCPConnectionStatus.CONNECTED:
+            self._set_tools(self.pool.build_tools())
+            logger.info(f"MCP 工具集合已更新，共 {len(self.tools)} 个工具")
     
     async def _discover_tools(self) -> None:
         """发现可用工具"""
-        # 模拟工具发现过程，注册 K8s 相关工具
+        if self.pool:
+            self._set_tools(self.pool.build_tools())
+            logger.info(f"发现 {len(self.tools)} 个可用工具")
+            return
+        
+        # 未配置 MCP 服务器时注册模拟的 K8s 工具
         mock_tools = [
             MCPTool(
                 name="k8s-get-pods",
@@ -197,7 +307,8 @@ class MCPClient:
                         "label_selector": {"type": "string", "description": "标签选择器"}
                     }
                 },
-                category="kubernetes"
+                category="kubernetes",
+                cache_policy=ToolCachePolicy(ttl=60, resource_kinds=["pod"])
             ),
             MCPTool(
                 name="k8s-scale-deployment",
@@ -211,7 +322,8 @@ class MCPClient:
                     },
                     "required": ["name", "replicas"]
                 },
-                category="kubernetes"
+                category="kubernetes",
+                cache_policy=ToolCachePolicy(cacheable=False, invalidates=["deployment", "pod"])
             ),
             MCPTool(
                 name="k8s-get-logs",
@@ -225,7 +337,9 @@ class MCPClient:
                     },
                     "required": ["pod_name"]
                 },
-                category="kubernetes"
+                category="kubernetes",
+                # 日志持续追加，只短暂缓存
+                cache_policy=ToolCachePolicy(ttl=10, resource_kinds=["pod"])
             ),
             MCPTool(
                 name="k8s-describe-pod",
@@ -238,16 +352,24 @@ class MCPClient:
                     },
                     "required": ["pod_name"]
                 },
-                category="kubernetes"
+                category="kubernetes",
+                cache_policy=ToolCachePolicy(ttl=60, key_params=["pod_name", "namespace"], resource_kinds=["pod"])
             )
         ]
         
-        for tool in mock_tools:
-            self.tools[tool.name] = tool
-        
-        self.stats.active_tools = len(self.tools)
+        self._set_tools(mock_tools)
         logger.info(f"发现 {len(self.tools)} 个可用工具")
     
+    def _set_tools(self, tools: List[MCPTool]) -> None:
+        """替换工具集合，内容有变化时生成新版本的工具目录"""
+        self.tools = {tool.name: tool for tool in tools}
+        self.stats.active_tools = len(self.tools)
+        
+        catalog = ToolCatalog(self.tools.values(), self.catalog.version + 1)
+        if catalog.fingerprint != self.catalog.fingerprint:
+            self.catalog = catalog
+            logger.debug(f"工具目录更新为 v{catalog.version} ({len(catalog)} 个工具)")
+    
     def _validate_parameters(self, tool: MCPTool, parameters: Dict[str, Any]) -> None:
         """验证参数"""
         required = tool.input_schema.get("required", [])
@@ -259,38 +381,52 @@ class MCPClient:
                     tool_name=tool.name
                 )
     
-    def _get_cached_result(self, name: str, parameters: Dict[str, Any]) -> Optional[Any]:
-        """获取缓存结果"""
-        cache_key = self._generate_cache_key(name, parameters)
-        cached = self.cache.get(cache_key)
-        
-        if cached and cached["expire_at"] > datetime.now():
-            cached["hit_count"] += 1
-            return cached["result"]
-        
-        if cached:
-            del self.cache[cache_key]
+    async def _execute_with_timeout(self, call: MCPToolCall) -> MCPToolResult:
+        """执行一次尝试：等待并发名额和执行合计不超过 timeout 和请求的剩余时间
         
-        return None
+        连接了 MCP 服务器时由传输层计时，超时的请求会通知服务端取消，并计入该服务器的健康状态。
+        """
+        timeout = clamp_timeout(self.config.timeout / 1000)
+        if timeout <= 0:
+            raise MCPException("DEADLINE_EXCEEDED", "Request deadline exceeded", tool_name=call.name)
+        expires = time.monotonic() + timeout
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return MCPToolResult(
+                id=call.id,
+                tool_name=call.name,
+                success=False,
+                error={
+                    "code": "TIMEOUT",
+                    "message": f"Timed out after {timeout:.1f}s waiting for a free tool call slot",
+                    "details": None
+                },
+                execution_time=timeout * 1000,
+                timestamp=datetime.now()
+            )
+        try:
+            return await self._execute_tool_call(call, max(expires - time.monotonic(), 0.001))
+        finally:
+            self._semaphore.release()
     
-    def _cache_result(self, name: str, parameters: Dict[str, Any], result: Any) -> None:
-        """缓存结果"""
-        cache_key = self._generate_cache_key(name, parameters)
-        expire_at = datetime.now() + timedelta(milliseconds=self.config.cache_timeout)
-        
-        self.cache[cache_key] = {
-            "result": result,
-            "expire_at": expire_at,
-            "hit_count": 0
-        }
-    
-    async def _execute_tool_call(self, call: MCPToolCall) -> MCPToolResult:
-        """执行工具调用"""
+    def _retry_backoff(self, attempt: int) -> float:
+        """第 attempt 次重试前的等待时间：指数退避，在后一半区间内随机，避免同时重试"""
+        delay = self.config.retry_delay / 1000 * (2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+    
+    async def _execute_tool_call(self, call: MCPToolCall, timeout: float) -> MCPToolResult:
+        """执行工具调用，超过 timeout 时取消"""
         start_time = time.time()
         
         try:
-            # 模拟工具执行
-            result = await self._simulate_tool_execution(call)
+            if self.pool:
+                result = await self.pool.call_tool(call.name, call.parameters, timeout)
+            else:
+                try:
+                    result = await asyncio.wait_for(self._simulate_tool_execution(call), timeout)
+                except asyncio.TimeoutError:
+                    raise MCPException("TIMEOUT", f"Tool call timed out after {timeout:.1f}s", tool_name=call.name)
             
             return MCPToolResult(
                 id=call.id,
@@ -306,7 +442,7 @@ class MCPClient:
                 tool_name=call.name,
                 success=False,
                 error={
-                    "code": "EXECUTION_ERROR",
+                    "code": e.code if isinstance(e, MCPException) else "EXECUTION_ERROR",
                     "message": str(e),
                     "details": None
                 },
@@ -391,8 +527,86 @@ class MCPClient:
         """生成调用ID"""
         return f"call_{int(time.time() * 1000)}_{hash(time.time()) % 10000:04d}"
     
-    def _generate_cache_key(self, name: str, parameters: Dict[str, Any]) -> str:
-        """生成缓存键"""
+    def is_mutating(self, name: str) -> bool:
+        """工具是否会修改集群状态（命名空间下的工具按去掉前缀的名称匹配 mutating_tools）"""
+        tool = self.tools.get(name)
+        if tool is None:
+            return name in self.config.mutating_tools
+        return self._is_mutating(tool, self._cache_policy(tool))
+    
+    @staticmethod
+    def _config_names(tool: MCPTool) -> List[str]:
+        """匹配配置用的工具名：暴露的名称，以及去掉命名空间前缀的名称"""
+        return [tool.name, tool.base_name] if tool.base_name and tool.base_name != tool.name else [tool.name]
+    
+    def _declared_policy(self, tool: MCPTool) -> Optional[ToolCachePolicy]:
+        """配置或工具自带的缓存策略，配置优先"""
+        for name in self._config_names(tool):
+            if name in self.config.cache_policies:
+                return self.config.cache_policies[name]
+        return tool.cache_policy
+    
+    def _is_mutating(self, tool: MCPTool, policy: ToolCachePolicy) -> bool:
+        return bool(policy.invalidates) or tool.read_only_hint is False or \
+            any(name in self.config.mutating_tools for name in self._config_names(tool))
+    
+    def _is_retryable(self, tool: MCPTool, mutating: bool) -> bool:
+        """重试是否安全：幂等或只读，且不是修改类工具；未声明的远程工具可能有副作用，不重试"""
+        if tool.idempotent_hint:
+            return True
+        if mutating:
+            return False
+        return bool(tool.read_only_hint) or self._declared_policy(tool) is not None
+    
+    def _cache_policy(self, tool: MCPTool) -> ToolCachePolicy:
+        """工具的缓存策略：配置优先于工具自带的；都没有时只缓存服务器声明只读的工具，按全部参数缓存"""
+        policy = self._declared_policy(tool)
+        if policy is None:
+            mutating = any(name in self.config.mutating_tools for name in self._config_names(tool))
+            return ToolCachePolicy(cacheable=bool(tool.read_only_hint) and not mutating)
+        return policy
+    
+    @staticmethod
+    def _resource_tags(
+        kinds: List[str],
+        policy: ToolCachePolicy,
+        parameters: Dict[str, Any],
+        for_read: bool
+    ) -> List[str]:
+        """资源的依赖标签
+        
+        读取结果带 "<类型>"（任意修改都失效）和 "<类型>:<命名空间>"，未指定命名空间时为 "<类型>:*"；
+        修改指定了命名空间时使 "<类型>:<命名空间>" 和 "<类型>:*" 失效，否则使整个 "<类型>" 失效。
+        """
+        namespace = parameters.get(policy.namespace_param)
+        tags = []
+        for kind in kinds:
+            if for_read:
+                tags += [kind, f"{kind}:{namespace or '*'}"]
+            elif namespace:
+                tags += [f"{kind}:{namespace}", f"{kind}:*"]
+            else:
+                tags.append(kind)
+        return tags
+    
+    def _invalidate_cache(self, name: str, policy: ToolCachePolicy, parameters: Dict[str, Any]) -> None:
+        """修改类工具调用成功后使相关缓存失效，未声明影响的资源类型时清空全部缓存"""
+        if policy.invalidates:
+            count = self.cache.invalidate(self._resource_tags(policy.invalidates, policy, parameters, for_read=False))
+        else:
+            count = self.cache.invalidate_all()
+        if count:
+            logger.debug(f"{name} 调用成功，{count} 条缓存结果失效")
+    
+    def _generate_cache_key(
+        self,
+        name: str,
+        parameters: Dict[str, Any],
+        key_params: Optional[List[str]] = None
+    ) -> str:
+        """生成缓存键，指定了 key_params 时只用这些参数"""
+        if key_params is not None:
+            parameters = {key: parameters[key] for key in key_params if key in parameters}
         param_str = json.dumps(parameters, sort_keys=True)
         return f"{name}:{hashlib.md5(param_str.encode()).hexdigest()}"
     
@@ -405,14 +619,9 @@ class MCPClient:
         else:
             self.stats.failed_calls += 1
         
-        # 更新平均执行时间
-        total_time = self.stats.average_execution_time * (self.stats.total_calls - 1) + execution_time
-        self.stats.average_execution_time = total_time / self.stats.total_calls
-        
-        # 更新缓存命中率
+        # 平均执行时间和缓存命中率按累计值计算
+        self._total_execution_time += execution_time
+        self.stats.average_execution_time = self._total_execution_time / self.stats.total_calls
         if from_cache:
-            cache_hits = round(self.stats.cache_hit_rate * (self.stats.total_calls - 1))
-            self.stats.cache_hit_rate = (cache_hits + 1) / self.stats.total_calls
-        else:
-            cache_hits = round(self.stats.cache_hit_rate * (self.stats.total_calls - 1))
-            self.stats.cache_hit_rate = cache_hits / self.stats.total_calls 
\ No newline at end of file
+            self._cache_hits += 1
+        self.stats.cache_hit_rate = self._cache_hits / self.stats.total_calls
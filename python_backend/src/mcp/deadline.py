@@ -0,0 +1,39 @@
+"""
+请求截止时间
+一条消息从收到起有一个总的处理时限，保存在 contextvar 中随调用链（含 gather/create_task
+创建的子任务）向下传递；LLM 调用和工具调用的超时都不超过剩余时间
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+
+# 当前请求的截止时间（time.monotonic()），未设置时为 None
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(at: float) -> Iterator[None]:
+    """在 with 块内设置截止时间，已有更早的截止时间时保持不变"""
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_remaining() -> Optional[float]:
+    """距截止时间的秒数（可能为负），未设置截止时间时返回 None"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def clamp_timeout(timeout: float) -> float:
+    """把超时时间限制在剩余时间内，已过截止时间时返回 0"""
+    remaining = time_remaining()
+    if remaining is None:
+        return timeout
+    return max(min(timeout, remaining), 0.0)
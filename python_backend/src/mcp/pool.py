@@ -0,0 +1,330 @@
+"""
+MCP 服务器池
+连接多个 MCP 服务器（例如每个集群一个、每类工具一个），按工具名前缀（命名空间）路由调用；
+多个服务器暴露同一工具时互为副本，按进行中请求数最少分配，每个服务器独立维护健康状态和统计
+"""
+
+import asyncio
+import json
+import time
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from .types import MCPTool, MCPClientConfig, MCPServerConfig, MCPException
+from .transport import MCPTransport, TransportStats, PROTOCOL_VERSION, create_transport
+
+
+CLIENT_INFO = {"name": "dingtalk-k8s-bot", "version": "1.0.0"}
+
+# 命名空间与工具名的分隔符（OpenAI 函数名只允许字母、数字、_ 和 -）
+NAMESPACE_SEPARATOR = "__"
+
+# 说明服务器本身有问题的错误，工具返回的业务错误不影响健康状态
+SERVER_ERROR_CODES = {"TIMEOUT", "CONNECTION_LOST", "TRANSPORT_ERROR"}
+
+
+class ServerHealth(str, Enum):
+    """服务器健康状态"""
+    HEALTHY = "healthy"
+    UNHEALTHY = "unhealthy"
+    DOWN = "down"
+
+
+class ServerStats(BaseModel):
+    """单个MCP服务器的统计信息"""
+    name: str = Field(..., description="服务器名称")
+    namespace: Optional[str] = Field(None, description="工具命名空间")
+    health: ServerHealth = Field(default=ServerHealth.DOWN, description="健康状态")
+    tools: int = Field(default=0, description="提供的工具数")
+    in_flight: int = Field(default=0, description="进行中的调用数")
+    max_in_flight: int = Field(default=0, description="最大同时进行的调用数")
+    calls: int = Field(default=0, description="调用次数")
+    failures: int = Field(default=0, description="服务器错误次数（超时、断连等）")
+    consecutive_failures: int = Field(default=0, description="连续服务器错误次数")
+    average_latency: float = Field(default=0, description="平均调用耗时(ms)")
+    reconnects: int = Field(default=0, description="重连成功次数")
+    last_error: Optional[str] = Field(None, description="最近一次服务器错误")
+    transport: Optional[TransportStats] = Field(None, description="传输层统计")
+
+
+class MCPServerConnection:
+    """一个MCP服务器的连接、工具列表和健康状态"""
+
+    def __init__(self, server: MCPServerConfig, config: MCPClientConfig, on_tools_changed: Callable[[], None]):
+        self.server = server
+        self.config = config
+        self.name = server.name
+        self.transport: Optional[MCPTransport] = None
+        self.server_info: Dict[str, Any] = {}
+        self.tools: List[MCPTool] = []
+        self.stats = ServerStats(name=server.name, namespace=server.namespace)
+        self.retry_at = 0.0
+        self._on_tools_changed = on_tools_changed
+        self._latency_total = 0.0
+        self._background: Set[asyncio.Task] = set()
+        self._closing = False
+
+    async def connect(self) -> None:
+        """建立传输、完成 initialize 握手并获取工具列表"""
+        transport = create_transport(self.server, self.config)
+        transport.on_notification = self._handle_notification
+        try:
+            await transport.start()
+            result = await transport.request("initialize", {
+                "protocolVersion": PROTOCOL_VERSION,
+                "capabilities": {},
+                "clientInfo": CLIENT_INFO
+            }, timeout=self.config.timeout / 1000)
+            await transport.notify("notifications/initialized")
+            self.transport = transport
+            self.server_info = result.get("serverInfo") or {}
+            self.tools = await self.list_tools()
+        except BaseException:
+            self.transport = None
+            await transport.close()
+            raise
+
+        # 握手完成后才监听断开，握手失败由调用方处理
+        transport.on_close = self._handle_closed
+        if transport.is_closed:
+            self.transport = None
+            await transport.close()
+            raise MCPException("CONNECTION_LOST", f"MCP server '{self.name}' closed the connection")
+        self.stats.health = ServerHealth.HEALTHY
+        self.stats.consecutive_failures = 0
+        logger.info(
+            f"MCP 服务器 {self.name} 已连接: {self.server_info.get('name', 'unknown')} "
+            f"(协议 {result.get('protocolVersion')}, {transport.name}, {len(self.tools)} 个工具)"
+        )
+
+    async def close(self) -> None:
+        self._closing = True
+        for task in list(self._background):
+            task.cancel()
+        if self.transport:
+            transport, self.transport = self.transport, None
+            transport.on_close = None
+            await transport.close()
+        self.stats.health = ServerHealth.DOWN
+
+    async def list_tools(self) -> List[MCPTool]:
+        """分页获取工具列表"""
+        tools: List[MCPTool] = []
+        cursor = None
+        while True:
+            result = await self.transport.request(
+                "tools/list", {"cursor": cursor} if cursor else {}, timeout=self.config.timeout / 1000
+            )
+            for tool in result.get("tools", []):
+                annotations = tool.get("annotations") or {}
+                tools.append(MCPTool(
+                    name=tool["name"],
+                    description=tool.get("description") or "",
+                    input_schema=tool.get("inputSchema") or {"type": "object", "properties": {}},
+                    provider=self.name,
+                    read_only_hint=annotations.get("readOnlyHint"),
+                    idempotent_hint=annotations.get("idempotentHint")
+                ))
+            cursor = result.get("nextCursor")
+            if not cursor:
+                self.stats.tools = len(tools)
+                return tools
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+        """通过 tools/call 调用工具，工具返回 isError 时抛出普通异常"""
+        if self.transport is None:
+            raise MCPException("CONNECTION_LOST", f"MCP server '{self.name}' is not connected")
+        result = await self.transport.request(
+            "tools/call", {"name": name, "arguments": arguments},
+            timeout=self.config.timeout / 1000 if timeout is None else timeout
+        )
+        content = result.get("content") or []
+        texts = [item.get("text", "") for item in content if item.get("type") == "text"]
+        if result.get("isError"):
+            raise Exception("\n".join(texts) or "Tool execution failed")
+
+        # 优先使用结构化结果；单个文本内容是 JSON 时解析后返回，便于后续压缩和格式化
+        if result.get("structuredContent") is not None:
+            return result["structuredContent"]
+        if len(texts) == 1 and len(content) == 1:
+            try:
+                return json.loads(texts[0])
+            except ValueError:
+                return texts[0]
+        if len(texts) == len(content):
+            return "\n".join(texts)
+        return content
+
+    def is_available(self, now: float) -> bool:
+        """是否可以接收调用：健康，或不健康但已到重试时间（放行探测）"""
+        if self.transport is None:
+            return False
+        return self.stats.health == ServerHealth.HEALTHY or now >= self.retry_at
+
+    def record_success(self, latency_ms: float) -> None:
+        self._observe(latency_ms)
+        self.stats.consecutive_failures = 0
+        if self.stats.health == ServerHealth.UNHEALTHY:
+            logger.info(f"MCP 服务器 {self.name} 恢复")
+            self.stats.health = ServerHealth.HEALTHY
+
+    def record_failure(self, error: MCPException, latency_ms: float) -> None:
+        self._observe(latency_ms)
+        self.stats.failures += 1
+        self.stats.consecutive_failures += 1
+        self.stats.last_error = str(error)
+        if self.stats.health == ServerHealth.HEALTHY and \
+                self.stats.consecutive_failures >= self.config.server_failure_threshold:
+            logger.warning(f"MCP 服务器 {self.name} 连续失败 {self.stats.consecutive_failures} 次，标记为不健康")
+            self.stats.health = ServerHealth.UNHEALTHY
+        if self.stats.health == ServerHealth.UNHEALTHY:
+            self.retry_at = time.monotonic() + self.config.server_retry_interval
+
+    def get_stats(self) -> ServerStats:
+        stats = self.stats.model_copy()
+        stats.transport = self.transport.stats.model_copy() if self.transport else None
+        return stats
+
+    def _observe(self, latency_ms: float) -> None:
+        self._latency_total += latency_ms
+        self.stats.average_latency = self._latency_total / self.stats.calls if self.stats.calls else 0
+
+    def _handle_notification(self, method: str, params: Dict[str, Any]) -> None:
+        """工具列表变化时重新获取"""
+        if method == "notifications/tools/list_changed":
+            self._spawn(self._refresh_tools())
+
+    async def _refresh_tools(self) -> None:
+        try:
+            self.tools = await self.list_tools()
+            self._on_tools_changed()
+        except Exception as e:
+            logger.warning(f"重新获取 MCP 服务器 {self.name} 的工具失败: {e}")
+
+    def _handle_closed(self, error: MCPException) -> None:
+        """连接意外断开：标记为不可用，按间隔重连"""
+        logger.error(f"MCP 服务器 {self.name} 连接断开: {error}")
+        self.transport = None
+        self.stats.health = ServerHealth.DOWN
+        self.stats.last_error = str(error)
+        self._on_tools_changed()
+        self.schedule_reconnect()
+
+    def schedule_reconnect(self) -> None:
+        if not self._closing:
+            self._spawn(self._reconnect_loop())
+
+    async def _reconnect_loop(self) -> None:
+        while not self._closing:
+            await asyncio.sleep(self.config.server_retry_interval)
+            try:
+                await self.connect()
+            except Exception as e:
+                logger.warning(f"MCP 服务器 {self.name} 重连失败: {e}")
+                continue
+            self.stats.reconnects += 1
+            self._on_tools_changed()
+            return
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+
+class MCPServerPool:
+    """多个MCP服务器的连接、工具路由和负载均衡"""
+
+    def __init__(self, config: MCPClientConfig, servers: List[MCPServerConfig], on_tools_changed: Callable[[], None]):
+        self.config = config
+        self.servers: Dict[str, MCPServerConnection] = {
+            server.name: MCPServerConnection(server, config, on_tools_changed) for server in servers
+        }
+        # 暴露的工具名 -> [(服务器, 服务器上的工具名)]
+        self.routes: Dict[str, List[Tuple[MCPServerConnection, str]]] = {}
+
+    async def connect(self) -> None:
+        """并发连接所有服务器，部分失败时其余服务器照常使用，失败的按间隔重连"""
+        servers = list(self.servers.values())
+        results = await asyncio.gather(*(server.connect() for server in servers), return_exceptions=True)
+        failed = []
+        for server, result in zip(servers, results):
+            if isinstance(result, BaseException):
+                logger.error(f"MCP 服务器 {server.name} 连接失败: {result}")
+                server.stats.last_error = str(result)
+                failed.append(server)
+        if len(failed) == len(servers):
+            raise MCPException("CONNECTION_FAILED", "Failed to connect to any MCP server", str(results[0]))
+        for server in failed:
+            server.schedule_reconnect()
+
+    async def close(self) -> None:
+        await asyncio.gather(*(server.close() for server in self.servers.values()))
+        self.routes = {}
+
+    def build_tools(self) -> List[MCPTool]:
+        """合并各服务器的工具并重建路由表，同名工具（同一命名空间）视为副本"""
+        tools: Dict[str, MCPTool] = {}
+        routes: Dict[str, List[Tuple[MCPServerConnection, str]]] = {}
+        for server in self.servers.values():
+            if server.transport is None:
+                continue
+            for tool in server.tools:
+                name = tool.name
+                if server.server.namespace:
+                    name = f"{server.server.namespace}{NAMESPACE_SEPARATOR}{tool.name}"
+                routes.setdefault(name, []).append((server, tool.name))
+                if name not in tools:
+                    tools[name] = tool.model_copy(update={
+                        "name": name, "base_name": tool.name, "provider": server.server.namespace or server.name
+                    })
+        self.routes = routes
+        return list(tools.values())
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+        """把调用路由到提供该工具、进行中请求最少的可用服务器"""
+        server, remote_name = self._pick(name)
+        server.stats.calls += 1
+        server.stats.in_flight += 1
+        server.stats.max_in_flight = max(server.stats.max_in_flight, server.stats.in_flight)
+        start_time = time.monotonic()
+        try:
+            result = await server.call_tool(remote_name, arguments, timeout)
+        except MCPException as e:
+            if e.code in SERVER_ERROR_CODES:
+                server.record_failure(e, (time.monotonic() - start_time) * 1000)
+            else:
+                server.record_success((time.monotonic() - start_time) * 1000)
+            raise
+        except Exception:
+            # 工具返回的错误说明服务器本身正常
+            server.record_success((time.monotonic() - start_time) * 1000)
+            raise
+        finally:
+            server.stats.in_flight -= 1
+        server.record_success((time.monotonic() - start_time) * 1000)
+        return result
+
+    def get_stats(self) -> List[ServerStats]:
+        return [server.get_stats() for server in self.servers.values()]
+
+    def _pick(self, name: str) -> Tuple[MCPServerConnection, str]:
+        replicas = self.routes.get(name)
+        if not replicas:
+            raise MCPException("TOOL_NOT_FOUND", f"No MCP server provides tool '{name}'", tool_name=name)
+
+        now = time.monotonic()
+        candidates = [(server, remote) for server, remote in replicas if server.is_available(now)]
+        if not candidates:
+            # 全部不健康时仍尝试已连接的副本，而不是直接失败
+            candidates = [(server, remote) for server, remote in replicas if server.transport is not None]
+        if not candidates:
+            raise MCPException("SERVER_UNAVAILABLE", f"All MCP servers providing '{name}' are down", tool_name=name)
+        # 进行中请求最少；相同时选累计调用少的，使副本之间轮流分配
+        server, remote = min(candidates, key=lambda item: (item[0].stats.in_flight, item[0].stats.calls))
+        if server.stats.health == ServerHealth.UNHEALTHY:
+            # 每个重试间隔只放行一个探测调用
+            server.retry_at = now + self.config.server_retry_interval
+        return server, remote
@@ -0,0 +1,151 @@
+"""
+MCP 工具结果缓存
+LRU + TTL（条数和内存上限），按单调时钟计时；过期条目按过期时间排成小顶堆，
+每次读写时顺带清理，不依赖同一个键被再次读取。条目可以带依赖标签，按标签批量失效
+"""
+
+import heapq
+import itertools
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Iterable, List, Set, Tuple
+from pydantic import BaseModel, Field
+
+
+class ResultCacheStats(BaseModel):
+    """工具结果缓存统计信息"""
+    lookups: int = Field(default=0, description="查询次数")
+    hits: int = Field(default=0, description="命中次数")
+    misses: int = Field(default=0, description="未命中次数（含已过期）")
+    stores: int = Field(default=0, description="写入次数")
+    evictions: int = Field(default=0, description="超出条数或内存上限被淘汰的条数")
+    expirations: int = Field(default=0, description="过期清理的条数")
+    invalidations: int = Field(default=0, description="按依赖标签失效的条数")
+    oversized: int = Field(default=0, description="超过内存上限未缓存的结果数")
+    entries: int = Field(default=0, description="当前缓存条数")
+    bytes: int = Field(default=0, description="当前占用内存(字节，按JSON大小估算)")
+    hit_rate: float = Field(default=0, description="命中率")
+
+
+class ResultCache:
+    """带 TTL 和 LRU 淘汰的工具结果缓存"""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (过期时间, 结果, 占用字节数, 依赖标签)，按最近使用排序
+        self._entries: "OrderedDict[str, Tuple[float, Any, int, FrozenSet[str]]]" = OrderedDict()
+        # 依赖标签 -> 带该标签的 key
+        self._tags: Dict[str, Set[str]] = {}
+        # (过期时间, 序号, key)；键被覆盖或删除后留下的旧记录在弹出时跳过
+        self._expiry: List[Tuple[float, int, str]] = []
+        self._sequence = itertools.count()
+        self._bytes = 0
+        self.stats = ResultCacheStats()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """查询缓存，未命中或已过期时返回 default"""
+        self.stats.lookups += 1
+        self.purge_expired()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return entry[1]
+
+    def put(self, key: str, value: Any, ttl: float, tags: Iterable[str] = ()) -> None:
+        """写入缓存，ttl 单位为秒；tags 为结果依赖的数据，用于 invalidate"""
+        self.purge_expired()
+        size = _estimate_size(value)
+        if size > self.max_bytes:
+            self.stats.oversized += 1
+            return
+
+        if key in self._entries:
+            self._remove(key)
+        expire_at = time.monotonic() + ttl
+        tags = frozenset(tags)
+        self._entries[key] = (expire_at, value, size, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        self._bytes += size
+        heapq.heappush(self._expiry, (expire_at, next(self._sequence), key))
+        self.stats.stores += 1
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.stats.evictions += 1
+
+        # 覆盖和淘汰留下的旧记录过多时重建堆
+        if len(self._expiry) > 2 * len(self._entries) + 64:
+            self._expiry = [(entry[0], next(self._sequence), k) for k, entry in self._entries.items()]
+            heapq.heapify(self._expiry)
+
+    def purge_expired(self) -> int:
+        """清理所有已过期的条目，返回清理的条数"""
+        now = time.monotonic()
+        purged = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            expire_at, _, key = heapq.heappop(self._expiry)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == expire_at:
+                self._remove(key)
+                purged += 1
+        self.stats.expirations += purged
+        return purged
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        """删除带有任一标签的条目，返回删除的条数"""
+        keys = set()
+        for tag in tags:
+            keys.update(self._tags.get(tag, ()))
+        for key in keys:
+            self._remove(key)
+        self.stats.invalidations += len(keys)
+        return len(keys)
+
+    def invalidate_all(self) -> int:
+        """删除全部条目并计入失效次数，返回删除的条数"""
+        count = len(self._entries)
+        self.clear()
+        self.stats.invalidations += count
+        return count
+
+    def clear(self) -> None:
+        """清空缓存"""
+        self._entries.clear()
+        self._expiry.clear()
+        self._tags.clear()
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> ResultCacheStats:
+        """获取统计信息"""
+        self.purge_expired()
+        stats = self.stats.model_copy()
+        stats.entries = len(self._entries)
+        stats.bytes = self._bytes
+        stats.hit_rate = stats.hits / stats.lookups if stats.lookups else 0
+        return stats
+
+    def _remove(self, key: str) -> None:
+        _, _, size, tags = self._entries.pop(key)
+        self._bytes -= size
+        for tag in tags:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+
+
+def _estimate_size(value: Any) -> int:
+    """按紧凑 JSON 的字节数估算结果占用的内存"""
+    if isinstance(value, str):
+        return len(value.encode())
+    return len(json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str).encode())
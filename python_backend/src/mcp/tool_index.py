@@ -0,0 +1,99 @@
+"""
+工具检索索引
+工具目录生成时，从工具名、描述、分类和参数（名称与描述）中提取词项，
+按 BM25 风格的 idf 加权，为每个请求给出按相关度排序的工具
+"""
+
+import math
+import re
+from typing import Dict, Iterable, List, Set, Tuple
+
+from .types import MCPTool
+
+
+# 各字段命中时的权重：工具名最能说明用途，参数描述最泛
+FIELD_WEIGHTS = {
+    "name": 3.0,
+    "category": 1.0,
+    "description": 2.0,
+    "parameters": 1.0,
+}
+
+ASCII_WORD = re.compile(r"[a-z0-9]+")
+CJK_RUN = re.compile(r"[一-鿿]+")
+
+# 不参与检索的常见词，中文为常见的动词和疑问词
+STOP_WORDS = {
+    "the", "a", "an", "of", "to", "in", "for", "and", "or", "is", "are", "my", "me",
+    "查看", "获取", "列出", "显示", "帮我", "一下", "哪些", "什么", "现在", "看看", "请帮",
+}
+
+
+def tokenize(text: str) -> Set[str]:
+    """提取词项：英文按单词（去掉复数 s），中文按相邻两字"""
+    text = text.lower()
+    terms = set()
+    for word in ASCII_WORD.findall(text):
+        if len(word) > 3 and word.endswith("s"):
+            word = word[:-1]
+        terms.add(word)
+    for run in CJK_RUN.findall(text):
+        if len(run) == 1:
+            terms.add(run)
+        terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    return terms - STOP_WORDS
+
+
+class ToolIndex:
+    """某一版本工具集合的只读检索索引"""
+
+    __slots__ = ("names", "_fields", "_idf")
+
+    def __init__(self, tools: Iterable[MCPTool]):
+        self.names: Tuple[str, ...] = ()
+        # 工具名 -> {词项: 命中字段的权重和}
+        self._fields: Dict[str, Dict[str, float]] = {}
+        document_frequency: Dict[str, int] = {}
+
+        for tool in tools:
+            fields = {
+                "name": tool.name.replace("-", " ").replace("_", " "),
+                "category": tool.category or "",
+                "description": tool.description,
+                "parameters": " ".join(_parameter_texts(tool.input_schema)),
+            }
+            weights: Dict[str, float] = {}
+            for field, text in fields.items():
+                for term in tokenize(text):
+                    weights[term] = weights.get(term, 0.0) + FIELD_WEIGHTS[field]
+            self._fields[tool.name] = weights
+            for term in weights:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+
+        self.names = tuple(self._fields)
+        total = len(self.names)
+        self._idf = {
+            term: math.log(1 + (total - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+    def score(self, query: str) -> List[Tuple[str, float]]:
+        """按相关度降序返回 (工具名, 得分)，不含得分为 0 的工具"""
+        terms = tokenize(query)
+        scores = []
+        for name, weights in self._fields.items():
+            score = sum(weights[term] * self._idf[term] for term in terms if term in weights)
+            if score > 0:
+                scores.append((name, score))
+        scores.sort(key=lambda item: item[1], reverse=True)
+        return scores
+
+
+def _parameter_texts(schema: Dict) -> List[str]:
+    properties = schema.get("properties", {}) if isinstance(schema, dict) else {}
+    texts = []
+    for name, spec in properties.items():
+        texts.append(name.replace("_", " "))
+        if isinstance(spec, dict) and spec.get("description"):
+            texts.append(spec["description"])
+    return texts
@@ -0,0 +1,426 @@
+"""
+MCP 传输层
+JSON-RPC 2.0 over stdio（子进程，按行分帧）和 HTTP+SSE（GET 建立事件流，POST 发送消息）；
+同一连接上的并发请求按 id 复用，响应乱序到达时按 id 分发给对应的请求方
+"""
+
+import abc
+import asyncio
+import itertools
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urljoin
+import httpx
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from .types import MCPClientConfig, MCPServerConfig, MCPException
+
+
+PROTOCOL_VERSION = "2024-11-05"
+
+# 单次从子进程 stdout 读取的字节数
+READ_CHUNK_BYTES = 64 * 1024
+
+# JSON-RPC 错误码
+METHOD_NOT_FOUND = -32601
+
+
+class TransportStats(BaseModel):
+    """MCP 传输统计信息"""
+    transport: str = Field(..., description="传输方式")
+    requests: int = Field(default=0, description="发出的请求数")
+    responses: int = Field(default=0, description="收到的响应数")
+    notifications: int = Field(default=0, description="收到的通知数")
+    server_requests: int = Field(default=0, description="服务端发来的请求数")
+    pending: int = Field(default=0, description="等待响应的请求数")
+    max_pending: int = Field(default=0, description="同时等待响应的最大请求数")
+    waiting: int = Field(default=0, description="因等待响应的请求过多而排队的请求数")
+    timeouts: int = Field(default=0, description="超时的请求数")
+    frames: int = Field(default=0, description="解析的消息帧数")
+    invalid_frames: int = Field(default=0, description="无法解析的消息帧数")
+    bytes_sent: int = Field(default=0, description="发送的字节数")
+    bytes_received: int = Field(default=0, description="接收的字节数")
+
+
+class LineFramer:
+    """按换行符增量切分消息帧，跨多次读取的半帧留在缓冲区"""
+
+    def __init__(self, max_frame_bytes: int, keep_empty: bool = False):
+        self.max_frame_bytes = max_frame_bytes
+        self.keep_empty = keep_empty
+        self._buffer = bytearray()
+        # 缓冲区中已确认没有换行符的前缀长度，避免大帧分多次到达时重复扫描
+        self._scanned = 0
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """写入新读到的数据，返回其中完整的帧（不含换行符）"""
+        self._buffer.extend(data)
+        frames = []
+        start = 0
+        while True:
+            index = self._buffer.find(b"\n", max(start, self._scanned))
+            if index < 0:
+                break
+            frame = bytes(self._buffer[start:index]).rstrip(b"\r")
+            if frame or self.keep_empty:
+                frames.append(frame)
+            start = index + 1
+            self._scanned = 0
+        del self._buffer[:start]
+        self._scanned = len(self._buffer)
+
+        if len(self._buffer) > self.max_frame_bytes:
+            raise MCPException("FRAME_TOO_LARGE", f"MCP message exceeds {self.max_frame_bytes} bytes")
+        return frames
+
+
+class SSEParser:
+    """增量解析 text/event-stream，返回 (事件类型, 数据)"""
+
+    def __init__(self, max_frame_bytes: int):
+        self._lines = LineFramer(max_frame_bytes, keep_empty=True)
+        self._event = ""
+        self._data: List[str] = []
+
+    def feed(self, data: bytes) -> List[Tuple[str, str]]:
+        events = []
+        for line in self._lines.feed(data):
+            if not line:
+                # 空行结束一个事件
+                if self._data:
+                    events.append((self._event or "message", "\n".join(self._data)))
+                self._event, self._data = "", []
+                continue
+            if line.startswith(b":"):
+                continue
+            field, _, value = line.decode().partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                self._event = value
+            elif field == "data":
+                self._data.append(value)
+        return events
+
+
+class MCPTransport(abc.ABC):
+    """JSON-RPC 会话：请求 id 分配、响应分发、并发上限和服务端消息处理"""
+
+    name = "base"
+
+    def __init__(self, server: MCPServerConfig, config: MCPClientConfig):
+        self.server = server
+        self.config = config
+        self.stats = TransportStats(transport=self.name)
+        # 收到服务端通知时回调 (method, params)
+        self.on_notification: Optional[Callable[[str, Dict[str, Any]], None]] = None
+        # 连接断开时回调
+        self.on_close: Optional[Callable[[MCPException], None]] = None
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        # 等待响应的请求数上限，超出时新请求排队（背压）
+        self._slots = asyncio.Semaphore(config.max_pending_requests)
+        self._closed: Optional[MCPException] = None
+        self._background: Set[asyncio.Task] = set()
+
+    @abc.abstractmethod
+    async def start(self) -> None:
+        """建立连接"""
+
+    async def close(self) -> None:
+        """关闭连接，等待响应的请求以 CONNECTION_LOST 失败"""
+        for task in list(self._background):
+            task.cancel()
+        self._fail_pending(MCPException("CONNECTION_LOST", "MCP transport closed"))
+
+    @abc.abstractmethod
+    async def _send(self, message: Dict[str, Any]) -> None:
+        """发送一条消息，写缓冲区满时等待（背压）"""
+
+    @property
+    def is_closed(self) -> bool:
+        return self._closed is not None
+
+    async def request(self, method: str, params: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> Any:
+        """发送请求并等待对应 id 的响应"""
+        if self._closed:
+            raise self._closed
+
+        # 排队等待名额、发送和等待响应合计不超过 timeout
+        limit = timeout
+        expires = None if timeout is None else time.monotonic() + timeout
+        self.stats.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            raise MCPException("TIMEOUT", f"MCP request '{method}' timed out after {limit:g}s waiting for a slot")
+        finally:
+            self.stats.waiting -= 1
+        if expires is not None:
+            timeout = max(expires - time.monotonic(), 0.001)
+
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self.stats.requests += 1
+        self.stats.pending = len(self._pending)
+        self.stats.max_pending = max(self.stats.max_pending, self.stats.pending)
+
+        async def send_and_wait() -> Any:
+            await self._send_checked({"jsonrpc": "2.0", "id": request_id, "method": method, "params": params or {}})
+            return await future
+
+        try:
+            return await asyncio.wait_for(send_and_wait(), timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            self._cancel_remote(request_id, "timeout")
+            raise MCPException("TIMEOUT", f"MCP request '{method}' timed out after {limit:g}s")
+        except asyncio.CancelledError:
+            self._cancel_remote(request_id, "cancelled")
+            raise
+        finally:
+            self._pending.pop(request_id, None)
+            if future.done() and not future.cancelled():
+                # 发送失败时连接断开设置的异常无人等待，在此取走避免告警
+                future.exception()
+            self.stats.pending = len(self._pending)
+            self._slots.release()
+
+    async def notify(self, method: str, params: Optional[Dict[str, Any]] = None) -> None:
+        """发送通知（无响应）"""
+        message: Dict[str, Any] = {"jsonrpc": "2.0", "method": method}
+        if params is not None:
+            message["params"] = params
+        await self._send_checked(message)
+
+    async def _send_checked(self, message: Dict[str, Any]) -> None:
+        if self._closed:
+            raise self._closed
+        try:
+            await self._send(message)
+        except MCPException:
+            raise
+        except Exception as e:
+            raise MCPException("TRANSPORT_ERROR", "Failed to send MCP message", str(e))
+
+    def _encode(self, message: Dict[str, Any]) -> bytes:
+        # 紧凑 JSON 中不含换行符，可以直接按行分帧
+        data = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode()
+        self.stats.bytes_sent += len(data)
+        return data
+
+    def _receive(self, frame: bytes) -> None:
+        """处理收到的一帧"""
+        try:
+            message = json.loads(frame)
+        except ValueError:
+            self.stats.invalid_frames += 1
+            logger.warning(f"无法解析的 MCP 消息: {frame[:200]!r}")
+            return
+        self.stats.frames += 1
+
+        for item in message if isinstance(message, list) else [message]:
+            if not isinstance(item, dict):
+                self.stats.invalid_frames += 1
+            elif "method" in item:
+                self._handle_server_message(item)
+            elif "id" in item:
+                self._resolve(item)
+
+    def _resolve(self, message: Dict[str, Any]) -> None:
+        future = self._pending.get(message["id"])
+        if future is None or future.done():
+            # 已超时或已取消的请求
+            return
+        self.stats.responses += 1
+        error = message.get("error")
+        if error:
+            future.set_exception(MCPException(
+                "RPC_ERROR", error.get("message", "MCP request failed"), error.get("data")
+            ))
+        else:
+            future.set_result(message.get("result"))
+
+    def _handle_server_message(self, message: Dict[str, Any]) -> None:
+        if "id" not in message:
+            self.stats.notifications += 1
+            if self.on_notification:
+                self.on_notification(message["method"], message.get("params") or {})
+            return
+
+        self.stats.server_requests += 1
+        if message["method"] == "ping":
+            reply: Dict[str, Any] = {"jsonrpc": "2.0", "id": message["id"], "result": {}}
+        else:
+            reply = {"jsonrpc": "2.0", "id": message["id"],
+                     "error": {"code": METHOD_NOT_FOUND, "message": f"Method not found: {message['method']}"}}
+        self._spawn(self._send_checked(reply))
+
+    def _cancel_remote(self, request_id: int, reason: str) -> None:
+        """通知服务端放弃已不再等待的请求"""
+        if not self._closed:
+            self._spawn(self.notify("notifications/cancelled", {"requestId": request_id, "reason": reason}))
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+
+    def _background_done(self, task: asyncio.Task) -> None:
+        self._background.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.debug(f"MCP 后台发送失败: {task.exception()}")
+
+    def _fail_pending(self, error: MCPException) -> None:
+        """连接断开：所有等待中的请求失败"""
+        first = self._closed is None
+        self._closed = self._closed or error
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        if first and self.on_close:
+            self.on_close(error)
+
+
+class StdioTransport(MCPTransport):
+    """启动 MCP 服务器子进程，通过 stdin/stdout 按行收发 JSON-RPC 消息"""
+
+    name = "stdio"
+
+    def __init__(self, server: MCPServerConfig, config: MCPClientConfig):
+        super().__init__(server, config)
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._write_lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        if not self.server.server_command:
+            raise MCPException("INVALID_CONFIG", "server_command is required for the stdio transport")
+        self._process = await asyncio.create_subprocess_exec(
+            *self.server.server_command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env={**os.environ, **self.server.server_env}
+        )
+        self._spawn(self._read_loop())
+        self._spawn(self._drain_stderr())
+        logger.info(f"MCP 服务器 {self.server.name} 进程已启动: pid={self._process.pid}")
+
+    async def close(self) -> None:
+        process = self._process
+        if process and process.returncode is None:
+            process.stdin.close()
+            try:
+                await asyncio.wait_for(process.wait(), timeout=2)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        await super().close()
+
+    async def _send(self, message: Dict[str, Any]) -> None:
+        data = self._encode(message) + b"\n"
+        async with self._write_lock:
+            self._process.stdin.write(data)
+            # 子进程读得慢时在这里等待
+            await self._process.stdin.drain()
+
+    async def _read_loop(self) -> None:
+        framer = LineFramer(self.config.max_frame_bytes)
+        error = MCPException("CONNECTION_LOST", "MCP server process exited")
+        try:
+            while True:
+                data = await self._process.stdout.read(READ_CHUNK_BYTES)
+                if not data:
+                    break
+                self.stats.bytes_received += len(data)
+                for frame in framer.feed(data):
+                    self._receive(frame)
+        except MCPException as e:
+            error = e
+            self._process.kill()
+        finally:
+            self._fail_pending(error)
+
+    async def _drain_stderr(self) -> None:
+        """转发子进程的 stderr，避免管道写满阻塞子进程"""
+        while True:
+            line = await self._process.stderr.readline()
+            if not line:
+                break
+            logger.debug(f"[MCP {self.server.name}] {line.decode(errors='replace').rstrip()}")
+
+
+class SSETransport(MCPTransport):
+    """HTTP+SSE：GET 建立事件流，服务端在 endpoint 事件中给出 POST 地址，响应通过事件流返回"""
+
+    name = "sse"
+
+    def __init__(self, server: MCPServerConfig, config: MCPClientConfig):
+        super().__init__(server, config)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._endpoint: Optional[str] = None
+
+    async def start(self) -> None:
+        if not self.server.server_url:
+            raise MCPException("INVALID_CONFIG", "server_url is required for the sse transport")
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.config.timeout / 1000, read=None),
+            limits=httpx.Limits(max_connections=self.config.max_concurrent_calls + 1)
+        )
+        endpoint_ready = asyncio.get_running_loop().create_future()
+        self._spawn(self._read_loop(endpoint_ready))
+        try:
+            self._endpoint = await asyncio.wait_for(endpoint_ready, timeout=self.config.timeout / 1000)
+        except BaseException:
+            await self.close()
+            raise
+        logger.info(f"MCP 服务器 {self.server.name} SSE 连接已建立: {self._endpoint}")
+
+    async def close(self) -> None:
+        await super().close()
+        if self._client:
+            await self._client.aclose()
+
+    async def _send(self, message: Dict[str, Any]) -> None:
+        response = await self._client.post(
+            self._endpoint, content=self._encode(message), headers={"Content-Type": "application/json"}
+        )
+        response.raise_for_status()
+
+    async def _read_loop(self, endpoint_ready: asyncio.Future) -> None:
+        parser = SSEParser(self.config.max_frame_bytes)
+        error = MCPException("CONNECTION_LOST", "MCP event stream closed")
+        try:
+            async with self._client.stream(
+                "GET", self.server.server_url, headers={"Accept": "text/event-stream"}
+            ) as response:
+                response.raise_for_status()
+                # 不指定 chunk_size：指定时 httpx 会攒满一块才返回，事件无法及时送达
+                async for chunk in response.aiter_bytes():
+                    self.stats.bytes_received += len(chunk)
+                    for event, data in parser.feed(chunk):
+                        if event == "endpoint" and not endpoint_ready.done():
+                            endpoint_ready.set_result(urljoin(self.server.server_url, data.strip()))
+                        elif event == "message":
+                            self._receive(data.encode())
+        except MCPException as e:
+            error = e
+        except httpx.HTTPError as e:
+            error = MCPException("CONNECTION_LOST", "MCP event stream failed", str(e))
+        finally:
+            if not endpoint_ready.done():
+                endpoint_ready.set_exception(error)
+            self._fail_pending(error)
+
+
+def create_transport(server: MCPServerConfig, config: MCPClientConfig) -> MCPTransport:
+    """按服务器配置创建传输"""
+    if server.transport == "stdio":
+        return StdioTransport(server, config)
+    if server.transport == "sse":
+        return SSETransport(server, config)
+    raise MCPException("INVALID_CONFIG", f"Unsupported MCP transport: {server.transport}")
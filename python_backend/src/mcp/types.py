@@ -16,6 +16,20 @@ class MCPConnectionStatus(str, Enum):
     ERROR = "error"
 
 
+class ToolCachePolicy(BaseModel):
+    """工具结果的缓存策略"""
+    cacheable: bool = Field(default=True, description="结果是否可以缓存")
+    ttl: Optional[float] = Field(None, gt=0, description="缓存有效期(s)，为空时使用 cache_timeout")
+    key_params: Optional[List[str]] = Field(None, description="组成缓存键的参数，为空时使用全部参数")
+    resource_kinds: List[str] = Field(
+        default_factory=list, description="结果依赖的资源类型（如 pod），这些资源被修改时缓存失效"
+    )
+    invalidates: List[str] = Field(
+        default_factory=list, description="调用成功后使哪些资源类型的缓存失效（修改类工具）"
+    )
+    namespace_param: str = Field(default="namespace", description="指定命名空间的参数名，失效时按命名空间匹配")
+
+
 class MCPTool(BaseModel):
     """MCP工具定义"""
     name: str = Field(..., description="工具名称")
@@ -24,6 +38,10 @@ class MCPTool(BaseModel):
     category: Optional[str] = Field(None, description="工具分类")
     version: Optional[str] = Field(None, description="工具版本")
     provider: Optional[str] = Field(None, description="工具提供者")
+    cache_policy: Optional[ToolCachePolicy] = Field(None, description="结果缓存策略，为空时按是否为修改类工具决定")
+    base_name: Optional[str] = Field(None, description="服务器上的工具名（不含命名空间前缀），为空时与 name 相同")
+    read_only_hint: Optional[bool] = Field(None, description="服务器声明的只读提示(annotations.readOnlyHint)，为空表示未声明")
+    idempotent_hint: Optional[bool] = Field(None, description="服务器声明的幂等提示(annotations.idempotentHint)，为空表示未声明")
 
 
 class MCPToolCall(BaseModel):
@@ -52,6 +70,18 @@ class MCPToolResult(BaseModel):
     timestamp: datetime = Field(default_factory=datetime.now, description="执行时间戳")
 
 
+class MCPServerConfig(BaseModel):
+    """单个MCP服务器的连接配置"""
+    name: str = Field(..., description="服务器名称")
+    transport: Literal["stdio", "sse"] = Field(..., description="传输方式")
+    server_command: List[str] = Field(default_factory=list, description="stdio 传输启动MCP服务器的命令")
+    server_env: Dict[str, str] = Field(default_factory=dict, description="stdio 传输的MCP服务器额外环境变量")
+    server_url: Optional[str] = Field(None, description="sse 传输的事件流地址")
+    namespace: Optional[str] = Field(
+        None, description="工具名前缀，工具以 <namespace>__<工具名> 暴露；命名空间相同的服务器上的同名工具互为副本"
+    )
+
+
 class MCPClientConfig(BaseModel):
     """MCP客户端配置"""
     timeout: int = Field(default=30000, description="超时时间(ms)")
@@ -60,6 +90,28 @@ class MCPClientConfig(BaseModel):
     max_concurrent_calls: int = Field(default=5, description="最大并发调用数")
     enable_cache: bool = Field(default=True, description="是否启用缓存")
     cache_timeout: int = Field(default=300000, description="缓存超时时间(ms)")
+    cache_max_entries: int = Field(default=1000, ge=1, description="最多缓存的工具结果数")
+    cache_max_bytes: int = Field(default=32 * 1024 * 1024, ge=1024, description="工具结果缓存占用内存上限(字节)")
+    cache_policies: Dict[str, ToolCachePolicy] = Field(
+        default_factory=dict, description="按工具名（可不含命名空间前缀）覆盖工具自带的缓存策略（如远程MCP服务器上的工具）"
+    )
+    mutating_tools: List[str] = Field(
+        default_factory=lambda: ["k8s-scale-deployment"],
+        description="会修改集群状态的工具（可不含命名空间前缀），调用成功后数据版本递增"
+    )
+    transport: Literal["mock", "stdio", "sse"] = Field(
+        default="mock", description="MCP传输方式，mock 使用内置的模拟工具"
+    )
+    server_command: List[str] = Field(default_factory=list, description="stdio 传输启动MCP服务器的命令")
+    server_env: Dict[str, str] = Field(default_factory=dict, description="stdio 传输的MCP服务器额外环境变量")
+    server_url: Optional[str] = Field(None, description="sse 传输的事件流地址")
+    max_pending_requests: int = Field(default=64, ge=1, description="单个连接上同时等待响应的请求数上限")
+    max_frame_bytes: int = Field(default=16 * 1024 * 1024, ge=1024, description="单条MCP消息的最大字节数")
+    servers: List[MCPServerConfig] = Field(
+        default_factory=list, description="多个MCP服务器，为空时按 transport 等字段连接单个服务器"
+    )
+    server_failure_threshold: int = Field(default=3, ge=1, description="服务器连续失败多少次后标记为不健康")
+    server_retry_interval: float = Field(default=30.0, gt=0, description="不健康或断开的服务器多久后重试(s)")
 
 
 class MCPStats(BaseModel):
@@ -70,6 +122,8 @@ class MCPStats(BaseModel):
     average_execution_time: float = Field(default=0, description="平均执行时间")
     cache_hit_rate: float = Field(default=0, description="缓存命中率")
     active_tools: int = Field(default=0, description="活跃工具数")
+    timeouts: int = Field(default=0, description="超时被取消的调用次数（按每次尝试计）")
+    retries: int = Field(default=0, description="重试次数")
 
 
 class FunctionCall(BaseModel):
@@ -93,12 +147,47 @@ class ChatMessage(BaseModel):
     function_call: Optional[FunctionCall] = Field(None, description="函数调用")
 
 
+class StepTiming(BaseModel):
+    """工具调用循环中单步的耗时"""
+    step: int = Field(..., description="步骤序号")
+    llm_ms: float = Field(default=0, description="LLM调用耗时(ms)")
+    tool_ms: float = Field(default=0, description="工具调用耗时(ms)")
+    tool_calls: List[str] = Field(default_factory=list, description="本步调用的工具")
+    tokens: int = Field(default=0, description="本步消耗的token数")
+
+
 class ProcessResult(BaseModel):
     """LLM处理结果"""
     content: str = Field(..., description="响应内容")
     function_calls: Optional[List[FunctionCallResult]] = Field(None, description="函数调用结果")
     conversation_id: Optional[str] = Field(None, description="会话ID")
     usage: Optional[Dict[str, int]] = Field(None, description="Token使用情况")
+    steps: Optional[List[StepTiming]] = Field(None, description="工具调用循环各步耗时")
+    stop_reason: Optional[Literal["completed", "max_steps", "token_budget", "deadline"]] = Field(
+        None, description="工具调用循环结束原因"
+    )
+    from_cache: bool = Field(default=False, description="是否来自回答缓存")
+    coalesced: bool = Field(default=False, description="是否合并到其他请求的处理结果（用量只计入发起处理的请求）")
+    estimated_prompt_tokens: Optional[int] = Field(None, description="发送前本地估算的提示词token数")
+
+
+class StreamEvent(BaseModel):
+    """流式处理进度事件"""
+    type: Literal["text", "tool_start", "tool_end"] = Field(..., description="事件类型")
+    text: Optional[str] = Field(None, description="增量文本(text事件)")
+    tool_name: Optional[str] = Field(None, description="工具名称(tool事件)")
+    arguments: Optional[str] = Field(None, description="工具参数(tool_start事件)")
+    success: Optional[bool] = Field(None, description="工具是否执行成功(tool_end事件)")
+    elapsed_ms: Optional[float] = Field(None, description="工具执行耗时(tool_end事件)")
+
+
+class ProviderConfig(BaseModel):
+    """LLM后端配置"""
+    name: Optional[str] = Field(None, description="后端名称，默认为提供商名称")
+    provider: Literal["openai", "zhipu", "qwen"] = Field(..., description="LLM提供商")
+    model: str = Field(..., description="模型名称")
+    api_key: str = Field(..., description="API密钥")
+    base_url: Optional[str] = Field(None, description="API基础URL，默认为提供商的OpenAI兼容接口")
 
 
 class LLMConfig(BaseModel):
@@ -109,6 +198,22 @@ class LLMConfig(BaseModel):
     base_url: Optional[str] = Field(None, description="API基础URL")
     temperature: float = Field(default=0.7, description="温度参数")
     max_tokens: int = Field(default=2000, description="最大Token数")
+    request_timeout: float = Field(default=60.0, gt=0, description="单次LLM调用的超时时间(s)，流式调用按整次计算")
+    connect_timeout: float = Field(default=10.0, gt=0, description="建立连接的超时时间(s)")
+    max_concurrency: int = Field(default=8, ge=1, description="同时进行的LLM调用数上限")
+    max_connections: int = Field(default=20, ge=1, description="连接池最大连接数")
+    max_keepalive_connections: int = Field(default=10, ge=0, description="连接池最大空闲长连接数")
+    max_agent_steps: int = Field(default=5, ge=1, description="一次对话中最多的工具调用轮数")
+    agent_token_budget: int = Field(default=20000, ge=1, description="一次对话累计消耗的token上限")
+    agent_deadline: float = Field(default=90.0, gt=0, description="一次对话的总耗时上限(s)")
+    fallback_providers: List[ProviderConfig] = Field(default_factory=list, description="备用LLM后端")
+    ewma_alpha: float = Field(default=0.3, gt=0, le=1, description="后端延迟和错误率EWMA的平滑系数")
+    circuit_failure_threshold: int = Field(default=3, ge=1, description="后端连续失败多少次后熔断")
+    circuit_cooldown: float = Field(default=30.0, gt=0, description="熔断后多久放行探测请求(s)")
+    failover_ratio: float = Field(
+        default=0.5, gt=0, le=1, description="还有备用后端时，单个后端最多占用剩余时间的比例，超时即切换"
+    )
+    shortcut_direct_mode: bool = Field(default=True, description="快捷指令参数明确时直接调用工具，不经过LLM")
 
 
 class MCPException(Exception):
@@ -8,6 +8,7 @@
 import asyncio
 import json
 import sys
+import time
 from typing import Dict, Any
 from loguru import logger
 
@@ -93,6 +94,132 @@ async def test_llm_processor():
         return False
 
 
+async def test_shortcut_fast_path():
+    """测试快捷指令直达工具调用"""
+    logger.info("⚡ 测试快捷指令直达...")
+    
+    try:
+        from src.llm.processor import EnhancedLLMProcessor
+        from src.llm.shortcuts import parse_shortcut_call
+        from src.mcp.client import MCPClient
+        from src.mcp.types import MCPClientConfig, LLMConfig
+        
+        mcp_client = MCPClient(MCPClientConfig())
+        await mcp_client.connect()
+        processor = EnhancedLLMProcessor(
+            LLMConfig(provider="openai", model="gpt-3.5-turbo", api_key="test-key"),
+            mcp_client
+        )
+        
+        # 参数明确：直接调用工具
+        call = parse_shortcut_call("/scale", "nginx 3 prod", mcp_client.tools)
+        assert call.tool_name == "k8s-scale-deployment"
+        assert call.parameters == {"name": "nginx", "replicas": 3, "namespace": "prod"}
+        call = parse_shortcut_call("/tool-k8s-get-logs", "pod_name=api-1 lines=50", mcp_client.tools)
+        assert call.parameters == {"pod_name": "api-1", "lines": 50}
+        
+        # 参数有歧义或缺失：交给LLM
+        assert parse_shortcut_call("/logs", "", mcp_client.tools) is None
+        assert parse_shortcut_call("/pods", "默认命名空间里异常的", mcp_client.tools) is None
+        assert parse_shortcut_call("/scale", "nginx 三个", mcp_client.tools) is None
+        
+        result = await processor.chat_with_shortcuts("/pods", "kube-system")
+        assert result.function_calls[0].function_call.name == "k8s-get-pods"
+        assert "kube-system" in result.content
+        
+        result = await processor.chat_with_shortcuts("/status", "")
+        assert "集群状态" in result.content
+        
+        await mcp_client.disconnect()
+        logger.success("✅ 快捷指令直达工具调用正常，未经过LLM")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 快捷指令直达测试失败: {e}")
+        return False
+
+
+async def test_conversation_memory():
+    """测试会话记忆"""
+    logger.info("🧠 测试会话记忆...")
+    
+    try:
+        from src.dingtalk.bot import DingTalkBot
+        from src.llm.memory import ConversationMemory, MemoryConfig
+        from src.llm.processor import EnhancedLLMProcessor
+        from src.mcp.client import MCPClient
+        from src.mcp.types import ProcessResult, FunctionCallResult, FunctionCall, MCPClientConfig, LLMConfig
+        
+        memory = ConversationMemory(MemoryConfig(
+            default_token_budget=300, keep_recent=4, max_conversations=2
+        ))
+        
+        await memory.record("conv-1", "/pods default", ProcessResult(
+            content="找到 2 个Pod",
+            function_calls=[FunctionCallResult(
+                function_call=FunctionCall(name="k8s-get-pods", arguments='{"namespace":"default"}'),
+                result={"items": [{"metadata": {"name": "nginx-1"}}]}
+            )]
+        ), "unknown-model")
+        
+        messages = memory.build_messages("conv-1", "系统提示", "第一个pod的日志呢", "unknown-model")
+        assert messages[0].role == "system" and messages[-1].content == "第一个pod的日志呢"
+        assert any("nginx-1" in m.content for m in messages), "工具结果未进入上下文"
+        
+        # 超过阈值后较早轮次被压缩为摘要，历史不超过预算
+        for i in range(20):
+            await memory.record("conv-1", f"问题{i} " + "内容" * 30, ProcessResult(content=f"回答{i} " + "详情" * 30), "unknown-model")
+        messages = memory.build_messages("conv-1", "系统提示", "继续", "unknown-model")
+        assert memory.get_stats().summaries > 0
+        assert any("摘要" in m.content for m in messages if m.role == "system")
+        
+        # 会话数上限，LRU淘汰
+        for conv in ("conv-2", "conv-3"):
+            await memory.record(conv, "你好", ProcessResult(content="你好"), "unknown-model")
+        stats = memory.get_stats()
+        assert stats.conversations == 2 and stats.evictions == 1
+        
+        # 超过 max_turns 的轮次先压缩进摘要，不会被直接丢弃
+        turns_memory = ConversationMemory(MemoryConfig(default_token_budget=100000, max_turns=6, keep_recent=4))
+        for i in range(5):
+            await turns_memory.record("conv-1", f"问题{i}", ProcessResult(content=f"回答{i}"), "unknown-model")
+        messages = turns_memory.build_messages("conv-1", "系统提示", "继续", "unknown-model")
+        assert len(messages) == 9 and "问题0" in messages[1].content and "问题4" in messages[-3].content
+        
+        # 开启 llm_summary 后由LLM处理器生成摘要
+        llm_server, base_url, requests = await start_mock_llm_server(lambda body: {"content": "LLM摘要: 查看过nginx-1"})
+        processor = EnhancedLLMProcessor(
+            LLMConfig(provider="openai", model="mock", api_key="test-key", base_url=base_url),
+            MCPClient(MCPClientConfig())
+        )
+        bot = DingTalkBot(
+            webhook_url="http://127.0.0.1:9/robot/send", llm_processor=processor,
+            memory_config=MemoryConfig(default_token_budget=300, keep_recent=4, llm_summary=True)
+        )
+        for i in range(10):
+            await bot.memory.record("conv-1", f"问题{i} " + "内容" * 30, ProcessResult(content=f"回答{i}"), "unknown-model")
+        # LLM摘要在后台生成，record 返回时先用抽取式摘要
+        messages = bot.memory.build_messages("conv-1", "系统提示", "继续", "unknown-model")
+        assert "- 用户: 问题" in messages[1].content
+        for _ in range(50):
+            messages = bot.memory.build_messages("conv-1", "系统提示", "继续", "unknown-model")
+            if "LLM摘要" in messages[1].content:
+                break
+            await asyncio.sleep(0.05)
+        assert requests and "LLM摘要: 查看过nginx-1" in messages[1].content
+        await bot.stop()
+        await processor.close()
+        llm_server.close()
+        await llm_server.wait_closed()
+        
+        logger.success(f"✅ 会话记忆正常: {stats.model_dump()}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 会话记忆测试失败: {e}")
+        return False
+
+
 async def test_dingtalk_bot():
     """测试钉钉机器人"""
     logger.info("📱 测试钉钉机器人...")
@@ -137,6 +264,1796 @@ async def test_dingtalk_bot():
         return False
 
 
+async def test_dispatcher():
+    """测试消息调度器"""
+    logger.info("📬 测试消息调度器...")
+    
+    try:
+        from src.dingtalk.dispatcher import MessageDispatcher, DispatcherConfig
+        
+        processed = []
+        
+        async def handler(item):
+            await asyncio.sleep(0.05)
+            processed.append(item)
+        
+        dispatcher = MessageDispatcher(handler, DispatcherConfig(worker_count=3, max_queue_size=10))
+        dispatcher.start()
+        
+        # 两个会话各3条消息，会话内保序，会话间并行
+        for i in range(3):
+            dispatcher.submit("conv-a", ("conv-a", i))
+            dispatcher.submit("conv-b", ("conv-b", i))
+        
+        await dispatcher.stop()
+        
+        for conv in ("conv-a", "conv-b"):
+            order = [i for c, i in processed if c == conv]
+            assert order == [0, 1, 2], f"{conv} 消息乱序: {order}"
+        
+        stats = dispatcher.get_stats()
+        assert stats.processed == 6 and stats.queue_depth == 0
+        logger.success(f"✅ 调度器保序处理成功，平均排队 {stats.average_wait_time:.1f}ms")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 消息调度器测试失败: {e}")
+        return False
+
+
+async def test_dedup():
+    """测试msgId幂等去重"""
+    logger.info("🔁 测试消息去重...")
+    
+    try:
+        from src.dingtalk.bot import DingTalkBot
+        from src.dingtalk.dedup import MessageDeduplicator, DedupConfig
+        
+        bot = DingTalkBot(webhook_url="https://test.webhook.url")
+        calls = []
+        
+        async def slow_handle(request):
+            calls.append(request.msgId)
+            await asyncio.sleep(0.1)
+        
+        bot.handle_message = slow_handle
+        
+        message = {
+            "msgId": "dup-msg-001",
+            "msgtype": "text",
+            "text": {"content": "查看集群状态"},
+            "chatbotUserId": "bot",
+            "conversationId": "conv",
+            "senderId": "user",
+            "senderNick": "测试用户",
+            "sessionWebhook": "https://test.session.webhook",
+            "createAt": 1640995200000,
+            "conversationType": "2"
+        }
+        
+        # 首个副本处理中时到达的重投消息应附着到同一结果
+        first, retry = await asyncio.gather(
+            bot.process_webhook(message),
+            bot.process_webhook(message)
+        )
+        late_retry = await bot.process_webhook(message)
+        
+        assert calls == ["dup-msg-001"], f"重复处理: {calls}"
+        assert first["success"] and retry["duplicate"] and late_retry["duplicate"]
+        
+        # 容量上限
+        dedup = MessageDeduplicator(DedupConfig(max_entries=2))
+        for i in range(5):
+            dedup.claim(f"msg-{i}")
+        stats = dedup.get_stats()
+        assert stats.entries == 2 and stats.evicted == 3
+        
+        await bot.stop()
+        logger.success(f"✅ 消息去重正常: {bot.deduplicator.get_stats().model_dump()}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 消息去重测试失败: {e}")
+        return False
+
+
+async def test_chunked_delivery():
+    """测试长消息分段与续页"""
+    logger.info("✂️ 测试长消息分段...")
+    
+    try:
+        from src.dingtalk.bot import DingTalkBot
+        from src.dingtalk.chunking import ChunkingConfig, split_markdown
+        
+        log_lines = "\n".join(f"[INFO] line {i}: request handled" for i in range(200))
+        long_content = "### 📋 日志\n\n```log\n" + log_lines + "\n```\n\n" + \
+            "\n".join(f"• pod-{i} Running" for i in range(100))
+        
+        chunks = split_markdown(long_content, 1000)
+        assert all(len(chunk) <= 1000 for chunk in chunks)
+        # 代码块被拆开时每段围栏都应成对
+        assert all(chunk.count("```") % 2 == 0 for chunk in chunks)
+        assert "line 199" in "".join(chunks) and "pod-99" in "".join(chunks)
+        
+        bot = DingTalkBot(
+            webhook_url="https://test.webhook.url",
+            chunking_config=ChunkingConfig(max_message_length=1000, parts_per_reply=2)
+        )
+        sent = []
+        
+        async def fake_process(request, route=None):
+            return long_content
+        
+        async def fake_send(webhook, message):
+            sent.append(message.markdown["text"] if message.markdown else message.text["content"])
+            return True
+        
+        bot._process_message = fake_process
+        bot._send_response = fake_send
+        
+        message = {
+            "msgId": "chunk-msg-001",
+            "msgtype": "text",
+            "text": {"content": "查看日志"},
+            "chatbotUserId": "bot",
+            "conversationId": "conv-chunk",
+            "senderId": "user",
+            "senderNick": "测试用户",
+            "sessionWebhook": "https://test.session.webhook",
+            "createAt": 1640995200000,
+            "conversationType": "2"
+        }
+        await bot.process_webhook(message)
+        assert len(sent) == 2 and "/more" in sent[-1]
+        
+        # /more 翻页直到取完
+        for i in range(len(chunks)):
+            await bot.process_webhook({**message, "msgId": f"more-{i}", "text": {"content": "/more"}})
+        assert "没有更多内容" in sent[-1]
+        assert "pod-99" in "".join(sent)
+        
+        await bot.stop()
+        logger.success(f"✅ 长消息分段正常，共 {len(chunks)} 段")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 长消息分段测试失败: {e}")
+        return False
+
+
+async def test_intent_router():
+    """测试意图路由"""
+    logger.info("🧭 测试意图路由...")
+    
+    try:
+        from src.dingtalk.router import Intent, IntentRouter, KeywordAutomaton
+        
+        router = IntentRouter(shortcuts=["/pods", "/logs", "/tool-k8s-get-pods"])
+        
+        cases = {
+            "/pods default": Intent.SHORTCUT,
+            "/more": Intent.MORE,
+            "帮我看看Pod状态": Intent.AI,
+            "help me": Intent.HELP,
+            "你好": Intent.DEFAULT,
+            "   ": Intent.EMPTY
+        }
+        for content, expected in cases.items():
+            route = router.classify(content)
+            assert route.intent == expected, f"{content!r}: {route.intent} != {expected}"
+        
+        route = router.classify("/tool-k8s-get-pods  kube-system")
+        assert route.known_command and route.argument == "kube-system"
+        assert router.classify("你好", [{"dingtalkId": "bot"}], "bot").intent == Intent.AI
+        
+        # 重叠关键词在一次扫描内全部命中
+        automaton = KeywordAutomaton([(k, "k") for k in ("he", "she", "his", "hers")])
+        assert [k for k, _ in automaton.search("ushers")] == ["she", "he", "hers"]
+        
+        assert router.is_markdown("**粗体**") and not router.is_markdown("纯文本")
+        logger.success("✅ 意图路由分类正确")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 意图路由测试失败: {e}")
+        return False
+
+
+async def read_mock_request(reader):
+    """读取一个HTTP请求，返回 (路径, JSON请求体)，连接关闭时返回 None"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode().partition(":")
+        if name.lower() == "content-length":
+            length = int(value.strip())
+    body = json.loads(await reader.readexactly(length)) if length else {}
+    return request_line.decode().split()[1], body
+
+
+def write_mock_json(writer, status, payload):
+    """写入JSON响应"""
+    data = json.dumps(payload).encode()
+    writer.write(
+        f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+    )
+
+
+async def start_mock_dingtalk_server(responder=None):
+    """启动本地模拟钉钉Webhook服务，返回 (server, url, 收到的消息列表)"""
+    received = []
+    
+    async def handle(reader, writer):
+        try:
+            while True:
+                request = await read_mock_request(reader)
+                if request is None:
+                    break
+                body = request[1]
+                received.append(body)
+                
+                status, payload = responder(body) if responder else (200, {"errcode": 0, "errmsg": "ok"})
+                write_mock_json(writer, status, payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, f"http://127.0.0.1:{port}/robot/send", received
+
+
+async def start_mock_mcp_sse_server():
+    """启动 HTTP+SSE 形式的模拟MCP服务，返回 (close, 事件流地址, 会话)，测试结束时调用 await close()"""
+    from mock_mcp_server import MCPServerSession
+    
+    outbox = asyncio.Queue()
+    session = MCPServerSession(outbox.put)
+    tasks = set()
+    
+    def track(task):
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    
+    async def handle(reader, writer):
+        track(asyncio.current_task())
+        try:
+            while True:
+                request = await read_mock_request(reader)
+                if request is None:
+                    break
+                path, body = request
+                if path.startswith("/sse"):
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n")
+                    writer.write(b"event: endpoint\ndata: /messages?session=1\n\n")
+                    await writer.drain()
+                    while True:
+                        message = await outbox.get()
+                        writer.write(f"event: message\ndata: {json.dumps(message, ensure_ascii=False)}\n\n".encode())
+                        await writer.drain()
+                writer.write(b"HTTP/1.1 202 Accepted\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+                track(asyncio.create_task(session.handle(body)))
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+    
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    
+    async def close():
+        server.close()
+        for task in list(tasks):
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await server.wait_closed()
+    
+    return close, f"http://127.0.0.1:{port}/sse", session
+
+
+async def start_mock_llm_server(reply, delay=0.0):
+    """启动本地 OpenAI 兼容的模拟LLM服务，返回 (server, base_url, 收到的请求列表)
+    
+    reply(body) 返回 {"content": str, "tool_calls": [{"id", "name", "arguments"}]}，
+    或 {"error_status": int} 模拟服务端错误；
+    delay 为每次响应前的延迟(s)，可以是 callable(body)。
+    """
+    requests = []
+    
+    def chunk(delta, finish_reason=None, usage=None):
+        return {
+            "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": "mock",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+            "usage": usage
+        }
+    
+    async def handle(reader, writer):
+        try:
+            while True:
+                request = await read_mock_request(reader)
+                if request is None:
+                    break
+                body = request[1]
+                requests.append(body)
+                wait = delay(body) if callable(delay) else delay
+                if wait:
+                    await asyncio.sleep(wait)
+                
+                result = reply(body)
+                if "error_status" in result:
+                    write_mock_json(writer, result["error_status"], {"error": {"message": "mock error"}})
+                    await writer.drain()
+                    continue
+                content = result.get("content", "")
+                tool_calls = [
+                    {"id": tc["id"], "type": "function",
+                     "function": {"name": tc["name"], "arguments": tc["arguments"]}}
+                    for tc in result.get("tool_calls", [])
+                ]
+                usage = {"prompt_tokens": 10, "completion_tokens": max(1, len(content) // 4),
+                         "total_tokens": 10 + max(1, len(content) // 4)}
+                
+                if not body.get("stream"):
+                    message = {"role": "assistant", "content": content or None}
+                    if tool_calls:
+                        message["tool_calls"] = tool_calls
+                    write_mock_json(writer, 200, {
+                        "id": "chatcmpl-mock", "object": "chat.completion", "created": 0, "model": "mock",
+                        "choices": [{"index": 0, "message": message,
+                                     "finish_reason": "tool_calls" if tool_calls else "stop"}],
+                        "usage": usage
+                    })
+                    await writer.drain()
+                    continue
+                
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n")
+                events = [chunk({"role": "assistant", "content": ""})]
+                events += [chunk({"content": content[i:i + 8]}) for i in range(0, len(content), 8)]
+                events += [chunk({"tool_calls": [{"index": i, **tc}]}) for i, tc in enumerate(tool_calls)]
+                events += [chunk({}, "tool_calls" if tool_calls else "stop"), chunk(None, usage=usage)]
+                for event in events:
+                    writer.write(f"data: {json.dumps(event)}\n\n".encode())
+                    await writer.drain()
+                    await asyncio.sleep(0.005)
+                writer.write(b"data: [DONE]\n\n")
+                await writer.drain()
+                break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+    
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, f"http://127.0.0.1:{port}/v1", requests
+
+
+async def test_http_client():
+    """测试共享出站HTTP客户端"""
+    logger.info("🔌 测试出站HTTP客户端...")
+    
+    try:
+        from src.dingtalk.http_client import DingTalkHTTPClient, HTTPClientConfig
+        
+        server, url, received = await start_mock_dingtalk_server()
+        client = DingTalkHTTPClient(HTTPClientConfig(max_connections=5))
+        
+        for i in range(3):
+            response = await client.post_json(url, {"msgtype": "text", "text": {"content": f"msg-{i}"}})
+            assert response.status_code == 200
+        
+        # 顺序发送的消息应复用同一个保活连接
+        stats = client.get_stats()
+        host_stats = next(iter(stats["hosts"].values()))
+        assert len(received) == 3 and host_stats["requests"] == 3
+        assert stats["total_connections"] == 1, f"连接未复用: {stats}"
+        
+        await client.close()
+        server.close()
+        await server.wait_closed()
+        logger.success(f"✅ 出站HTTP客户端连接复用正常: {host_stats}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 出站HTTP客户端测试失败: {e}")
+        return False
+
+
+async def test_outbound_sender():
+    """测试出站限流与合并"""
+    logger.info("🚦 测试出站限流...")
+    
+    try:
+        from src.dingtalk.http_client import DingTalkHTTPClient
+        from src.dingtalk.sender import OutboundSender, SenderConfig
+        
+        attempts = []
+        
+        def responder(body):
+            attempts.append(body)
+            # 第一次请求返回钉钉限流错误码
+            if len(attempts) == 1:
+                return 200, {"errcode": 130101, "errmsg": "send too fast"}
+            return 200, {"errcode": 0, "errmsg": "ok"}
+        
+        server, url, received = await start_mock_dingtalk_server(responder)
+        http_client = DingTalkHTTPClient()
+        sender = OutboundSender(http_client, SenderConfig(
+            rate_per_minute=600, burst=1, retry_backoff=0.05
+        ))
+        
+        first = asyncio.create_task(sender.send(url, {"msgtype": "text", "text": {"content": "第一条"}}))
+        # 等第一条进入发送流程后再入队，后续消息会在排队中被合并
+        await asyncio.sleep(0.02)
+        for i in range(3):
+            await sender.send(url, {"msgtype": "markdown", "markdown": {"title": "t", "text": f"第{i + 2}条"}}, wait=False)
+        
+        assert await first
+        await sender.close()
+        
+        stats = sender.get_stats()
+        # 限流重试1次 + 后续3条合并为1条
+        assert stats.throttled == 1 and stats.retries == 1
+        assert stats.merged == 2 and stats.sent == 2, stats
+        assert "第4条" in received[-1]["markdown"]["text"]
+        
+        # 关闭超时：正在发送的消息也要通知等待方，不能一直挂起
+        async def hang(reader, writer):
+            await reader.read()
+            writer.close()
+        
+        hang_server = await asyncio.start_server(hang, "127.0.0.1", 0)
+        hang_url = f"http://127.0.0.1:{hang_server.sockets[0].getsockname()[1]}/robot/send"
+        slow_sender = OutboundSender(http_client, SenderConfig(max_retries=0))
+        pending = asyncio.create_task(slow_sender.send(hang_url, {"msgtype": "text", "text": {"content": "x"}}))
+        await asyncio.sleep(0.05)
+        await slow_sender.close(timeout=0.1)
+        assert await asyncio.wait_for(pending, 1) is False
+        assert slow_sender.get_stats().dropped == 1
+        
+        await http_client.close()
+        for s in (server, hang_server):
+            s.close()
+            await s.wait_closed()
+        logger.success(f"✅ 出站限流正常: {stats.model_dump()}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 出站限流测试失败: {e}")
+        return False
+
+
+async def test_llm_client_limits():
+    """测试LLM调用的并发上限、超时和取消"""
+    logger.info("⏱️ 测试LLM调用并发与超时...")
+    
+    try:
+        from src.llm.processor import EnhancedLLMProcessor
+        from src.mcp.client import MCPClient
+        from src.mcp.types import MCPClientConfig, LLMConfig, ChatMessage, MCPException
+        
+        def delay(body):
+            return 2.0 if "slow" in body["messages"][-1]["content"] else 0.2
+        
+        llm_server, base_url, requests = await start_mock_llm_server(lambda body: {"content": "ok"}, delay)
+        mcp_client = MCPClient(MCPClientConfig())
+        processor = EnhancedLLMProcessor(
+            LLMConfig(provider="openai", model="mock", api_key="test-key", base_url=base_url,
+                      max_concurrency=2, request_timeout=0.5),
+            mcp_client
+        )
+        
+        # 4 个调用、并发上限 2：分两批完成
+        start_time = time.monotonic()
+        results = await asyncio.gather(*[
+            processor.chat([ChatMessage(role="user", content=f"fast {i}")]) for i in range(4)
+        ])
+        elapsed = time.monotonic() - start_time
+        stats = processor.get_stats()
+        assert all(r.content == "ok" for r in results)
+        assert stats.max_in_flight == 2 and stats.completed == 4 and elapsed >= 0.4, (stats, elapsed)
+        
+        # 超时后抛出 LLM_TIMEOUT 并释放名额
+        try:
+            await processor._complete([{"role": "user", "content": "slow"}])
+            assert False, "应当超时"
+        except MCPException as e:
+            assert e.code == "LLM_TIMEOUT"
+        
+        # 取消调用方任务时请求中断
+        task = asyncio.create_task(processor.chat([ChatMessage(role="user", content="slow")]))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        
+        stats = processor.get_stats()
+        assert stats.timeouts == 1 and stats.cancelled == 1 and stats.in_flight == 0 and stats.waiting == 0, stats
+        
+        await processor.close()
+        
+        # 关闭处理器只取消调用本身，调用方（调度器 worker）收到错误后继续运行
+        processor = EnhancedLLMProcessor(
+            LLMConfig(provider="openai", model="mock", api_key="test-key", base_url=base_url, request_timeout=5),
+            mcp_client
+        )
+        task = asyncio.create_task(processor.chat([ChatMessage(role="user", content="slow")]))
+        await asyncio.sleep(0.1)
+        await processor.close()
+        try:
+            await task
+            assert False, "应当返回 LLM_CLOSED"
+        except MCPException as e:
+            assert e.code == "LLM_CLOSED" and not task.cancelled(), e
+        
+        llm_server.close()
+        await llm_server.wait_closed()
+        logger.success(f"✅ LLM调用并发与超时控制正常: {stats}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ LLM调用并发与超时测试失败: {e}")
+        return False
+
+
+async def test_parallel_tool_calls():
+    """测试并行执行LLM请求的工具调用"""
+    logger.info("🔀 测试并行工具调用...")
+    
+    try:
+        from src.llm.processor import EnhancedLLMProcessor
+        from src.mcp.client import MCPClient
+        from src.mcp.types import MCPClientConfig, LLMConfig, ChatMessage
+        
+        namespaces = ["default", "production", "staging"]
+        
+        def reply(body):
+            if any(m["role"] == "tool" for m in body["messages"]):
+                return {"content": "三个命名空间的Pod都正常"}
+            calls = [
+                {"id": f"call_{ns}", "name": "k8s-get-pods", "arguments": json.dumps({"namespace": ns})}
+                for ns in namespaces
+            ]
+            # 缺少必填参数，调用会失败
+            calls.append({"id": "call_logs", "name": "k8s-get-logs", "arguments": "{}"})
+            return {"tool_calls": calls}
+        
+        llm_server, base_url, requests = await start_mock_llm_server(reply)
+        mcp_client = MCPClient(MCPClientConfig(enable_cache=False))
+        await mcp_client.connect()
+        processor = EnhancedLLMProcessor(
+            LLMConfig(provider="openai", model="mock", api_key="test-key", base_url=base_url),
+            mcp_client
+        )
+        
+        events = []
+        
+        async def progress(event):
+            events.append(event.type)
+        
+        start_time = time.monotonic()
+        result = await processor.chat(
+            [ChatMessage(role="user", content="比较三个命名空间的pod")], enable_tools=True, progress=progress
+        )
+        elapsed = time.monotonic() - start_time
+        
+        # 所有调用都在第一个调用结束前开始
+        tool_events = [e for e in events if e.startswith("tool_")]
+        assert tool_events == ["tool_start"] * 4 + ["tool_end"] * 4, tool_events
+        
+        calls = result.function_calls
+        assert [c.function_call.arguments for c in calls[:3]] == [json.dumps({"namespace": ns}) for ns in namespaces]
+        assert all(c.result and not c.error for c in calls[:3]) and calls[3].error
+        
+        # 第二次请求：一条带全部 tool_calls 的 assistant 消息，随后按顺序的 tool 消息
+        followup = requests[1]["messages"][-5:]
+        assert followup[0]["role"] == "assistant" and len(followup[0]["tool_calls"]) == 4
+        assert [m["tool_call_id"] for m in followup[1:]] == ["call_default", "call_production", "call_staging", "call_logs"]
+        assert "error" in json.loads(followup[4]["content"])
+        
+        await processor.close()
+        await mcp_client.disconnect()
+        llm_server.close()
+        await llm_server.wait_closed()
+        logger.success(f"✅ 并行工具调用正常，4 个调用耗时 {elapsed * 1000:.0f}ms")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 并行工具调用测试失败: {e}")
+        return False
+
+
+async def test_agent_loop():
+    """测试多步工具调用循环及其预算"""
+    logger.info("🔁 测试多步工具调用循环...")
+    
+    try:
+        from src.llm.processor import EnhancedLLMProcessor
+        from src.mcp.client import MCPClient
+        from src.mcp.types import MCPClientConfig, LLMConfig, ChatMessage
+        
+        # get-pods -> describe-pod -> get-logs -> 回答
+        plan = [
+            ("k8s-get-pods", {"namespace": "default"}),
+            ("k8s-describe-pod", {"pod_name": "nginx-deployment-1"}),
+            ("k8s-get-logs", {"pod_name": "nginx-deployment-1", "lines": 20}),
+        ]
+        
+        def reply(body):
+            done = sum(1 for m in body["messages"] if m["role"] == "tool")
+            if done < len(plan) and body.get("tools"):
+                name, arguments = plan[done]
+                return {"tool_calls": [{"id": f"call_{done}", "name": name, "arguments": json.dumps(arguments)}]}
+            return {"content": f"诊断完成，共参考 {done} 个工具结果"}
+        
+        llm_server, base_url, requests = await start_mock_llm_server(reply)
+        mcp_client = MCPClient(MCPClientConfig())
+        await mcp_client.connect()
+        messages = [ChatMessage(role="user", content="nginx为什么重启")]
+        
+        def make_processor(**budget):
+            return EnhancedLLMProcessor(
+                LLMConfig(provider="openai", model="mock", api_key="test-key", base_url=base_url, **budget),
+                mcp_client
+            )
+        
+        # 预算充足：一次对话内完成三轮工具调用
+        processor = make_processor()
+        result = await processor.chat(messages, enable_tools=True)
+        assert result.stop_reason == "completed" and len(result.steps) == 4, result.steps
+        assert [s.tool_calls for s in result.steps] == [["k8s-get-pods"], ["k8s-describe-pod"], ["k8s-get-logs"], []]
+        assert all(s.llm_ms > 0 for s in result.steps) and result.steps[0].tool_ms > 0
+        assert result.usage["total_tokens"] == sum(s.tokens for s in result.steps)
+        assert result.content.startswith("诊断完成，共参考 3 个")
+        await processor.close()
+        
+        # 轮数用完：最后一次调用不再提供工具
+        processor = make_processor(max_agent_steps=1)
+        requests.clear()
+        result = await processor.chat(messages, enable_tools=True)
+        assert result.stop_reason == "max_steps" and "tools" not in requests[-1]
+        assert result.content.startswith("诊断完成，共参考 1 个")
+        await processor.close()
+        
+        # token 预算用完：基于已获取的结果直接回答
+        processor = make_processor(agent_token_budget=1)
+        requests.clear()
+        result = await processor.chat(messages, enable_tools=True)
+        assert result.stop_reason == "token_budget" and len(requests) == 1
+        assert result.content.startswith("⚠️") and "nginx-deployment-1" in result.content
+        await processor.close()
+        
+        await mcp_client.disconnect()
+        llm_server.close()
+        await llm_server.wait_closed()
+        logger.success("✅ 多步工具调用循环及预算控制正常")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 多步工具调用循环测试失败: {e}")
+        return False
+
+
+async def test_tool_catalog():
+    """测试版本化的工具目录"""
+    logger.info("📚 测试工具目录...")
+    
+    try:
+        from src.dingtalk.bot import DingTalkBot, DingTalkWebhookRequest
+        from src.llm.processor import EnhancedLLMProcessor
+        from src.mcp.client import MCPClient
+        from src.mcp.types import MCPClientConfig, LLMConfig, MCPTool
+        
+        mcp_client = MCPClient(MCPClientConfig())
+        await mcp_client.connect()
+        catalog = mcp_client.get_catalog()
+        assert catalog.version == 1 and len(catalog.openai_tools) == len(mcp_client.tools)
+        assert catalog.openai_tools[0]["function"]["name"] == "k8s-get-pods"
+        assert json.loads(catalog.openai_tools_json)[0]["type"] == "function"
+        
+        # 工具未变化时重新发现不会产生新版本
+        await mcp_client._discover_tools()
+        assert mcp_client.get_catalog() is catalog
+        
+        processor = EnhancedLLMProcessor(
+            LLMConfig(provider="openai", model="mock", api_key="test-key"), mcp_client
+        )
+        bot = DingTalkBot(webhook_url="http://127.0.0.1:9/robot/send", llm_processor=processor)
+        await bot.refresh_routes()
+        assert "/tool-k8s-describe-pod" in await processor.get_available_shortcuts()
+        
+        # 新增工具后目录升级版本，机器人在下一条消息前刷新路由
+        mcp_client._set_tools(list(mcp_client.tools.values()) + [MCPTool(
+            name="k8s-get-events",
+            description="获取集群事件",
+            input_schema={"type": "object", "properties": {"namespace": {"type": "string"}}}
+        )])
+        assert mcp_client.get_catalog().version == 2 and "/tool-k8s-get-events" in mcp_client.catalog.shortcuts
+        assert "/tool-k8s-get-events" in await processor.get_available_shortcuts()
+        assert bot._routes_version == 1
+        assert bot.router.classify("/tool-k8s-get-events").known_command is False
+        
+        await bot.refresh_routes()
+        assert bot._routes_version == 2 and bot.router.classify("/tool-k8s-get-events").known_command
+        
+        # 未注册的指令直接返回帮助，不交给LLM
+        request = DingTalkWebhookRequest(
+            msgId="m-1", msgtype="text", text={"content": "/tool-k8s-delete-all"}, chatbotUserId="bot",
+            conversationId="c-1", conversationType="2", senderId="u-1", senderNick="u",
+            sessionWebhook="http://127.0.0.1:9/robot/send", createAt=0
+        )
+        reply = await bot._process_message(request)
+        assert reply.startswith("❓ 未知指令: /tool-k8s-delete-all"), reply
+        
+        await processor.close()
+        await bot.stop()
+        await mcp_client.disconnect()
+        logger.success(f"✅ 工具目录正常，当前版本 v{mcp_client.catalog.version}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 工具目录测试失败: {e}")
+        return False
+
+
+async def test_tool_result_compaction():
+    """测试工具结果压缩"""
+    logger.info("🗜️ 测试工具结果压缩...")
+    
+    try:
+        from src.llm.compaction import ToolResultCompactor, CompactionConfig
+        
+        pods = {"items": [
+            {
+                "metadata": {"name": f"api-{i}", "namespace": "prod", "uid": "x" * 36,
+                             "labels": {"app": "api", "pod-template-hash": "abc123"}},
+                "status": {"phase": "Running" if i % 7 else "CrashLoopBackOff",
+                           "containerStatuses": [{"restartCount": i % 7 == 0 and 12 or 0}]},
+                "spec": {"nodeName": "node-1", "containers": [{"name": "api", "image": "api:1.4",
+                                                              "resources": {"limits": {"cpu": "1"}}}]}
+            }
+            for i in range(200)
+        ]}
+        
+        compactor = ToolResultCompactor(CompactionConfig(max_tokens=600))
+        text = compactor.compact("k8s-get-pods", {"items": pods["items"][:3]})
+        # 只保留投影字段，同构列表渲染为表格
+        assert text.split("\n")[1] == "name|namespace|phase|restarts|node|images", text
+        assert text.split("\n")[2] == "api-0|prod|CrashLoopBackOff|12|node-1|api:1.4"
+        assert "uid" not in text and "resources" not in text
+        
+        # 超出预算时按行截断并注明省略的行数
+        text = compactor.compact("k8s-get-pods", pods)
+        assert "[已截断: 共 200 行" in text and "api-0|" in text
+        
+        # 日志截断时保留末尾
+        logs = {"pod_name": "api-0", "content": "\n".join(f"line {i}" for i in range(2000))}
+        text = compactor.compact("k8s-get-logs", logs)
+        assert text.startswith("[已截断") and text.endswith("line 1999\"}")
+        
+        # 其他结果使用紧凑 JSON
+        assert compactor.compact("k8s-scale-deployment", {"deployment_name": "nginx", "success": True}) == \
+            '{"deployment_name":"nginx","success":true}'
+        
+        stats = compactor.get_stats()
+        assert stats.results == 4 and stats.truncated == 2 and stats.saved_ratio > 0.5, stats
+        logger.success(f"✅ 工具结果压缩正常: {stats.original_tokens} → {stats.compacted_tokens} tokens")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 工具结果压缩测试失败: {e}")
+        return False
+
+
+async def test_answer_cache():
+    """测试LLM回答缓存"""
+    logger.info("🗃️ 测试LLM回答缓存...")
+    
+    try:
+        from src.llm.processor import EnhancedLLMProcessor
+        from src.llm.answer_cache import AnswerCacheConfig
+        from src.mcp.client import MCPClient
+        from src.mcp.types import MCPClientConfig, LLMConfig, ChatMessage
+        
+        def reply(body):
+            if any(m["role"] == "tool" for m in body["messages"]):
+                return {"content": "集群状态健康"}
+            return {"tool_calls": [{"id": "call_1", "name": "k8s-get-pods", "arguments": "{}"}]}
+        
+        llm_server, base_url, requests = await start_mock_llm_server(reply)
+        mcp_client = MCPClient(MCPClientConfig(enable_cache=False))
+        await mcp_client.connect()
+        processor = EnhancedLLMProcessor(
+            LLMConfig(provider="openai", model="mock", api_key="test-key", base_url=base_url),
+            mcp_client,
+            answer_cache_config=AnswerCacheConfig(ttl_seconds=60)
+        )
+        
+        def ask(content):
+            return processor.chat([ChatMessage(role="user", content=content)], enable_tools=True)
+        
+        first = await ask("集群状态怎么样？")
+        assert not first.from_cache and len(requests) == 2
+        
+        # 空白、大小写和结尾标点不同的同一个问题命中缓存
+        second = await ask("  集群状态怎么样 ")
+        assert second.from_cache and second.content == first.content and len(requests) == 2
+        
+        # 修改类请求不走缓存
+        await ask("把nginx扩容到3个副本")
+        await ask("把nginx扩容到3个副本")
+        assert len(requests) == 6
+        
+        # 修改类工具调用成功后数据版本变化，旧回答不再命中
+        version = mcp_client.data_version
+        await mcp_client.call_tool("k8s-scale-deployment", {"name": "nginx", "replicas": 3})
+        assert mcp_client.data_version != version
+        third = await ask("集群状态怎么样？")
+        assert not third.from_cache and len(requests) == 8
+        
+        stats = processor.answer_cache.get_stats()
+        assert stats.hits == 1 and stats.bypassed == 2 and stats.tokens_saved > 0, stats
+        
+        await processor.close()
+        await mcp_client.disconnect()
+        llm_server.close()
+        await llm_server.wait_closed()
+        logger.success(f"✅ LLM回答缓存正常: {stats}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ LLM回答缓存测试失败: {e}")
+        return False
+
+
+async def test_usage_ledger():
+    """测试token用量账本和配额"""
+    logger.info("📊 测试用量账本与配额...")
+    
+    try:
+        from src.dingtalk.bot import DingTalkBot
+        from src.llm.processor import EnhancedLLMProcessor
+        from src.llm.answer_cache import AnswerCacheConfig
+        from src.llm.usage import UsageLedger, UsageLedgerConfig
+        from src.mcp.client import MCPClient
+        from src.mcp.types import MCPClientConfig, LLMConfig, ProcessResult
+        
+        llm_server, base_url, requests = await start_mock_llm_server(lambda body: {"content": "好的，" * 40})
+        dingtalk_server, webhook_url, received = await start_mock_dingtalk_server()
+        mcp_client = MCPClient(MCPClientConfig())
+        await mcp_client.connect()
+        processor = EnhancedLLMProcessor(
+            LLMConfig(provider="openai", model="mock", api_key="test-key", base_url=base_url),
+            mcp_client,
+            answer_cache_config=AnswerCacheConfig(enabled=False)
+        )
+        
+        def message(msg_id, content, sender="alice"):
+            return {
+                "msgId": msg_id, "msgtype": "text", "text": {"content": content},
+                "chatbotUserId": "bot", "conversationId": "group-1", "senderId": sender,
+                "senderNick": sender, "sessionWebhook": webhook_url, "conversationType": "2", "createAt": 0,
+                "atUsers": [{"dingtalkId": "bot"}]
+            }
+        
+        def last_reply():
+            return received[-1].get("markdown", {}).get("text") or received[-1]["text"]["content"]
+        
+        # soft 模式：超出配额后降级为不带工具和历史的精简回答
+        bot = DingTalkBot(
+            webhook_url=webhook_url, llm_processor=processor,
+            usage_config=UsageLedgerConfig(user_token_quota=60, quota_mode="soft")
+        )
+        await bot.process_webhook(message("u-1", "帮我看看集群"))
+        assert "tools" in requests[-1]
+        await bot.process_webhook(message("u-2", "再看看节点"))
+        assert "tools" not in requests[-1] and len(requests[-1]["messages"]) == 2
+        assert "精简回答" in last_reply()
+        await bot.process_webhook(message("u-3", "/pods default"))
+        
+        users = bot.usage.query("user")
+        assert users[0].key == "alice" and users[0].requests == 3 and users[0].total_tokens > 60
+        assert users[0].estimated_prompt_tokens > 0
+        shortcuts = {s.key: s.requests for s in bot.usage.query("shortcut")}
+        assert shortcuts == {"chat": 2, "/pods": 1}, shortcuts
+        assert bot.usage.series("group", "group-1")[0]["requests"] == 3
+        await bot.stop()
+        
+        # hard 模式：超出配额直接拒绝，不调用LLM
+        bot = DingTalkBot(
+            webhook_url=webhook_url, llm_processor=processor,
+            usage_config=UsageLedgerConfig(group_token_quota=60, quota_mode="hard")
+        )
+        await bot.process_webhook(message("h-1", "帮我看看集群", "bob"))
+        count = len(requests)
+        await bot.process_webhook(message("h-2", "再看看节点", "carol"))
+        assert len(requests) == count and "本群token额度已用完" in last_reply()
+        # 需要交给 LLM 的快捷指令同样受配额限制，直达工具的不受影响
+        await bot.process_webhook(message("h-3", "/pods 默认命名空间里异常的", "carol"))
+        assert len(requests) == count and "本群token额度已用完" in last_reply()
+        await bot.process_webhook(message("h-4", "/pods default", "carol"))
+        assert len(requests) == count and "额度" not in last_reply()
+        await bot.stop()
+        
+        # 命中回答缓存不消耗token，只计入缓存次数
+        ledger = UsageLedger()
+        answer = ProcessResult(content="ok", usage={"prompt_tokens": 100, "completion_tokens": 50})
+        ledger.record("dave", "group-2", "mock", answer, 10)
+        for _ in range(2):
+            ledger.record("dave", "group-2", "mock", answer.model_copy(update={"from_cache": True}), 1)
+        summary = ledger.query("user")[0]
+        assert summary.total_tokens == 150 and summary.cached == 2 and summary.requests == 3, summary
+        assert ledger.check_quota("dave", "group-2").user_tokens == 150
+        
+        await processor.close()
+        await mcp_client.disconnect()
+        for server in (llm_server, dingtalk_server):
+            server.close()
+            await server.wait_closed()
+        logger.success(f"✅ 用量账本与配额正常: {users[0].model_dump()}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 用量账本与配额测试失败: {e}")
+        return False
+
+
+async def test_provider_failover():
+    """测试多LLM后端的路由、熔断和切换"""
+    logger.info("🔀 测试LLM后端路由与切换...")
+    
+    try:
+        from src.llm.processor import EnhancedLLMProcessor
+        from src.llm.answer_cache import AnswerCacheConfig
+        from src.mcp.client import MCPClient
+        import httpx
+        from src.llm.providers import ProviderPool
+        from src.mcp.types import MCPClientConfig, LLMConfig, ChatMessage, ProviderConfig
+        
+        primary_mode = {"mode": "slow"}
+        
+        def primary_reply(body):
+            if primary_mode["mode"] == "error":
+                return {"error_status": 500}
+            return {"content": "来自主后端"}
+        
+        def primary_delay(body):
+            return 2.0 if primary_mode["mode"] == "slow" else 0
+        
+        primary_server, primary_url, primary_requests = await start_mock_llm_server(primary_reply, primary_delay)
+        qwen_server, qwen_url, qwen_requests = await start_mock_llm_server(lambda body: {"content": "来自千问"})
+        
+        processor = EnhancedLLMProcessor(
+            LLMConfig(
+                provider="openai", model="mock", api_key="test-key", base_url=primary_url,
+                fallback_providers=[ProviderConfig(provider="qwen", model="qwen-plus", api_key="k", base_url=qwen_url)],
+                request_timeout=2.0, failover_ratio=0.2,
+                circuit_failure_threshold=2, circuit_cooldown=0.3
+            ),
+            MCPClient(MCPClientConfig()),
+            answer_cache_config=AnswerCacheConfig(enabled=False)
+        )
+        
+        async def ask(text):
+            return await processor.chat([ChatMessage(role="user", content=text)])
+        
+        # 未观测过的后端排在已观测的健康后端之后，不会因为得分为 0 抢走流量
+        async with httpx.AsyncClient() as http_client:
+            pool = ProviderPool(processor.config, http_client)
+            assert [b.name for b in pool.candidates()] == ["openai", "qwen"]
+            pool.begin(pool.backends[0])
+            pool.record_success(pool.backends[0], 800)
+            assert [b.name for b in pool.candidates()] == ["openai", "qwen"]
+        
+        # 主后端响应过慢：用掉分到的时间后切换到千问，整体不超过截止时间
+        start_time = time.monotonic()
+        result = await ask("q1")
+        elapsed = time.monotonic() - start_time
+        assert result.content == "来自千问" and 0.35 < elapsed < 1.5, (result.content, elapsed)
+        assert qwen_requests[-1]["model"] == "qwen-plus"
+        
+        # 千问延迟更低，之后优先路由到千问
+        primary_mode["mode"] = "error"
+        count = len(primary_requests)
+        assert (await ask("q2")).content == "来自千问" and len(primary_requests) == count
+        
+        # 主后端连续失败达到阈值后熔断
+        backends = processor.providers.backends
+        backends[1].stats.ewma_latency_ms = 1e6
+        await ask("q3")
+        stats = {s.name: s for s in processor.get_provider_stats()}
+        assert stats["openai"].state == "open" and stats["openai"].circuit_opens == 1, stats
+        count = len(primary_requests)
+        await ask("q4")
+        assert len(primary_requests) == count
+        
+        # 冷却期后放行探测请求，成功即恢复
+        primary_mode["mode"] = "ok"
+        await asyncio.sleep(0.35)
+        assert (await ask("q5")).content == "来自主后端"
+        assert processor.get_provider_stats()[0].state == "closed"
+        
+        await processor.close()
+        for server in (primary_server, qwen_server):
+            server.close()
+            await server.wait_closed()
+        logger.success(f"✅ LLM后端路由与切换正常: {[s.model_dump() for s in processor.get_provider_stats()]}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ LLM后端路由与切换测试失败: {e}")
+        return False
+
+
+async def test_hedged_requests():
+    """测试LLM对冲请求"""
+    logger.info("🪃 测试LLM对冲请求...")
+    
+    try:
+        from src.llm.processor import EnhancedLLMProcessor
+        from src.llm.answer_cache import AnswerCacheConfig
+        from src.llm.hedging import HedgingConfig
+        from src.mcp.client import MCPClient
+        from src.mcp.types import MCPClientConfig, LLMConfig, ChatMessage
+        
+        # 内容为 slow 的请求中，第一个到达的响应很慢，之后的（对冲请求）正常
+        slow_seen = {"count": 0}
+        
+        def delay(body):
+            if body["messages"][-1]["content"] == "slow":
+                slow_seen["count"] += 1
+                return 1.5 if slow_seen["count"] % 2 == 1 else 0.02
+            return 0.02
+        
+        server, base_url, requests = await start_mock_llm_server(lambda body: {"content": "ok"}, delay)
+        
+        def make_processor(budget_ratio):
+            return EnhancedLLMProcessor(
+                LLMConfig(provider="openai", model="mock", api_key="test-key", base_url=base_url),
+                MCPClient(MCPClientConfig()),
+                answer_cache_config=AnswerCacheConfig(enabled=False),
+                hedging_config=HedgingConfig(
+                    enabled=True, percentile=90, min_samples=5, min_delay=0.1, budget_ratio=budget_ratio
+                )
+            )
+        
+        async def ask(processor, text):
+            return await processor.chat([ChatMessage(role="user", content=text)], enable_tools=False)
+        
+        processor = make_processor(0.5)
+        for i in range(6):
+            await ask(processor, f"warmup {i}")
+        assert processor.hedger.get_stats().hedged == 0
+        
+        # 首个请求卡住，对冲请求在P90附近发出并先返回
+        count = len(requests)
+        start_time = time.monotonic()
+        result = await ask(processor, "slow")
+        elapsed = time.monotonic() - start_time
+        stats = processor.hedger.get_stats()
+        assert result.content == "ok" and elapsed < 0.8, elapsed
+        assert len(requests) == count + 2
+        assert stats.hedged == 1 and stats.hedge_wins == 1 and stats.win_rate == 1.0, stats
+        assert stats.latency_p99_ms > stats.latency_p50_ms > 0
+        
+        # 没有对冲预算时只能等待原请求
+        no_budget = make_processor(0.0)
+        for i in range(5):
+            await ask(no_budget, f"warmup {i}")
+        start_time = time.monotonic()
+        await ask(no_budget, "slow")
+        no_budget_stats = no_budget.hedger.get_stats()
+        assert time.monotonic() - start_time >= 1.4
+        assert no_budget_stats.hedged == 0 and no_budget_stats.budget_exhausted == 1, no_budget_stats
+        
+        for p in (processor, no_budget):
+            await p.close()
+        server.close()
+        await server.wait_closed()
+        logger.success(f"✅ LLM对冲请求正常: {stats.model_dump()}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ LLM对冲请求测试失败: {e}")
+        return False
+
+
+async def test_request_coalescing():
+    """测试相同并发请求的合并"""
+    logger.info("🧲 测试请求合并...")
+    
+    try:
+        from src.llm.processor import EnhancedLLMProcessor
+        from src.llm.answer_cache import AnswerCacheConfig
+        from src.mcp.client import MCPClient
+        from src.mcp.types import MCPClientConfig, LLMConfig, ChatMessage
+        
+        server, base_url, requests = await start_mock_llm_server(lambda body: {"content": "集群正常"}, 0.3)
+        mcp_client = MCPClient(MCPClientConfig(enable_cache=False))
+        await mcp_client.connect()
+        processor = EnhancedLLMProcessor(
+            LLMConfig(provider="openai", model="mock", api_key="test-key", base_url=base_url),
+            mcp_client,
+            answer_cache_config=AnswerCacheConfig(enabled=False)
+        )
+        
+        def ask(text):
+            return asyncio.create_task(processor.chat([ChatMessage(role="user", content=text)]))
+        
+        # 规范化后相同的并发请求只调用一次LLM，其中一个请求方取消不影响其他人
+        tasks = [ask(text) for text in ["集群状态怎么样？", "集群状态怎么样", " 集群状态怎么样?", "集群状态怎么样"]]
+        await asyncio.sleep(0.05)
+        tasks[0].cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert isinstance(results[0], asyncio.CancelledError)
+        assert all(r.content == "集群正常" for r in results[1:])
+        assert len(requests) == 1 and results[1] is not results[2]
+        # 用量只计入发起处理的请求方（首个请求方已取消，其余都是合并得到的结果）
+        assert all(r.coalesced and r.usage is None for r in results[1:])
+        
+        # 所有请求方都取消时中止处理
+        tasks = [ask("节点状态") for _ in range(2)]
+        await asyncio.sleep(0.05)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        stats = processor.single_flight.get_stats()
+        assert stats.coalesced == 4 and stats.cancelled_waiters == 3 and stats.abandoned == 1, stats
+        assert stats.in_flight == 0
+        
+        # 快捷指令直接调用工具时同样合并，扩缩容不合并
+        before = mcp_client.get_stats().total_calls
+        results = await asyncio.gather(*[
+            processor.chat_with_shortcuts("/status", "", {"user_id": f"user{i}"}) for i in range(5)
+        ])
+        assert mcp_client.get_stats().total_calls == before + 1
+        assert all("集群状态" in r.content for r in results)
+        
+        before = mcp_client.get_stats().total_calls
+        await asyncio.gather(*[processor.chat_with_shortcuts("/scale", "nginx 3 default") for _ in range(2)])
+        assert mcp_client.get_stats().total_calls == before + 2
+        
+        await processor.close()
+        await mcp_client.disconnect()
+        server.close()
+        await server.wait_closed()
+        logger.success(f"✅ 请求合并正常: {processor.single_flight.get_stats().model_dump()}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 请求合并测试失败: {e}")
+        return False
+
+
+async def test_tool_selection():
+    """测试按相关度选择工具子集"""
+    logger.info("🎯 测试工具子集选择...")
+    
+    try:
+        from src.llm.processor import EnhancedLLMProcessor
+        from src.llm.answer_cache import AnswerCacheConfig
+        from src.llm.tool_selection import ToolSelector, ToolSelectionConfig
+        from src.mcp.client import MCPClient
+        from src.mcp.types import MCPClientConfig, MCPTool, LLMConfig, ChatMessage
+        
+        def tool(name, description, params, category="kubernetes"):
+            return MCPTool(name=name, description=description, category=category, input_schema={
+                "type": "object",
+                "properties": {p: {"type": "string", "description": d} for p, d in params.items()}
+            })
+        
+        mcp_client = MCPClient(MCPClientConfig())
+        await mcp_client.connect()
+        mcp_client._set_tools(list(mcp_client.tools.values()) + [
+            tool("prom-query", "执行 Prometheus 查询语句", {"query": "PromQL 查询语句"}, "monitoring"),
+            tool("prom-alerts", "列出正在触发的告警", {"severity": "告警级别"}, "monitoring"),
+            tool("node-list", "获取集群节点列表", {}),
+            tool("node-drain", "驱逐节点上的 Pod 并停止调度", {"node_name": "节点名称"}),
+            tool("k8s-get-services", "获取 Service 列表", {"namespace": "命名空间"}),
+            tool("k8s-get-configmaps", "获取 ConfigMap 列表", {"namespace": "命名空间"}),
+            tool("k8s-get-events", "获取集群事件", {"namespace": "命名空间"}),
+            tool("k8s-rollout-restart", "滚动重启 Deployment", {"name": "部署名称", "namespace": "命名空间"}),
+            tool("helm-list", "列出 Helm release", {"namespace": "命名空间"}, "helm"),
+            tool("helm-rollback", "回滚 Helm release 到指定版本", {"release": "release 名称", "revision": "版本号"}, "helm"),
+            tool("db-slow-queries", "查看数据库慢查询", {"database": "数据库名称"}, "database"),
+        ])
+        catalog = mcp_client.get_catalog()
+        
+        def reply(body):
+            if body["messages"][-1]["role"] == "tool":
+                return {"content": "处理完成"}
+            question = body["messages"][-1]["content"]
+            if "日志" in question or "告警" in question:
+                # 问告警时模型仍然要查日志：请求了子集之外的工具
+                return {"content": "", "tool_calls": [
+                    {"id": "call_1", "name": "k8s-get-logs", "arguments": '{"pod_name": "nginx-1"}'}
+                ]}
+            return {"content": "你好，有什么可以帮你"}
+        
+        server, base_url, requests = await start_mock_llm_server(reply)
+        processor = EnhancedLLMProcessor(
+            LLMConfig(provider="openai", model="mock", api_key="test-key", base_url=base_url),
+            mcp_client,
+            answer_cache_config=AnswerCacheConfig(enabled=False),
+            tool_selection_config=ToolSelectionConfig(top_k=3)
+        )
+        
+        def offered(body):
+            return [t["function"]["name"] for t in body.get("tools", [])]
+        
+        async def ask(text):
+            return await processor.chat([ChatMessage(role="user", content=text)], enable_tools=True)
+        
+        # 相关工具子集
+        result = await ask("查看 default 命名空间里 nginx 的 Pod 日志")
+        assert result.function_calls[0].function_call.name == "k8s-get-logs"
+        names = offered(requests[0])
+        assert "k8s-get-logs" in names and len(names) == 3 and not any(n.startswith("prom") for n in names), names
+        
+        # 没有相关工具：发送全部工具
+        await ask("你好")
+        assert len(offered(requests[-1])) == len(catalog)
+        
+        # 模型请求了子集之外的工具：之后的调用提供全部工具
+        count = len(requests)
+        await ask("集群现在有哪些告警")
+        assert "k8s-get-logs" not in offered(requests[count])
+        assert len(offered(requests[count + 1])) == len(catalog)
+        
+        stats = processor.tool_selector.get_stats()
+        assert stats.requests == 3 and stats.subset_requests == 2 and stats.full_fallbacks == 1, stats
+        assert stats.misses == 1 and stats.miss_rate == 0.5 and stats.prompt_tokens_saved > 0, stats
+        
+        # 近期共同使用的工具加分
+        selector = ToolSelector(ToolSelectionConfig(top_k=2))
+        query = "prometheus 查询 cpu 使用率"
+        assert selector.select(catalog, query, "mock").names == {"prom-query", "db-slow-queries"}
+        for _ in range(3):
+            selector.record_usage(["prom-query", "node-list"])
+        assert selector.select(catalog, query, "mock").names == {"prom-query", "node-list"}
+        
+        await processor.close()
+        await mcp_client.disconnect()
+        server.close()
+        await server.wait_closed()
+        logger.success(f"✅ 工具子集选择正常: {stats.model_dump()}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 工具子集选择测试失败: {e}")
+        return False
+
+
+async def test_mcp_transport():
+    """测试MCP stdio/SSE传输与JSON-RPC多路复用"""
+    logger.info("🔌 测试MCP传输...")
+    
+    try:
+        from src.mcp.client import MCPClient
+        from src.mcp.types import MCPClientConfig, MCPException
+        
+        # stdio：启动本地MCP服务器子进程
+        client = MCPClient(MCPClientConfig(
+            transport="stdio", server_command=[sys.executable, "mock_mcp_server.py"],
+            enable_cache=False, max_concurrent_calls=10, max_pending_requests=4
+        ))
+        await client.connect()
+        server = client.pool.servers["default"]
+        assert server.server_info["name"] == "mock-k8s"
+        assert len(client.tools) == 7, list(client.tools)  # 两页 tools/list
+        
+        # 同一连接上的并发请求按 id 分发；等待响应的请求不超过4个，其余排队
+        start_time = time.monotonic()
+        delays = [0.3, 0.1] * 4
+        results = await asyncio.gather(*[
+            client.call_tool("echo", {"value": str(i), "delay": delay}) for i, delay in enumerate(delays)
+        ])
+        elapsed = time.monotonic() - start_time
+        assert [r["echo"] for r in results] == [str(i) for i in range(8)]
+        stats = client.get_server_stats()[0].transport
+        assert stats.max_pending == 4 and 0.5 < elapsed < 1.5, (stats, elapsed)
+        
+        # 跨多次读取的大消息帧
+        big = await client.call_tool("big-output", {"size": 300000})
+        assert big == "x" * 300000
+        
+        # 工具返回错误、服务端发起的请求、结构化结果
+        try:
+            await client.call_tool("fail", {})
+            assert False, "应当失败"
+        except MCPException as e:
+            assert e.code == "EXECUTION_FAILED" and "boom" in e.message
+        assert await client.call_tool("ping-client", {}) == {"pong": True}
+        pods = await client.call_tool("k8s-get-pods", {"namespace": "prod"})
+        assert pods["items"][0]["metadata"]["namespace"] == "prod"
+        
+        # 服务端通知工具列表变化后重新发现工具
+        version = client.catalog.version
+        await client.call_tool("add-tool", {"name": "k8s-get-nodes"})
+        for _ in range(50):
+            if "k8s-get-nodes" in client.tools:
+                break
+            await asyncio.sleep(0.02)
+        assert "k8s-get-nodes" in client.tools and client.catalog.version == version + 1
+        
+        # 超时的请求不影响连接上的其他请求
+        try:
+            await server.transport.request("tools/call", {"name": "echo", "arguments": {"value": "x", "delay": 1}}, timeout=0.1)
+            assert False, "应当超时"
+        except MCPException as e:
+            assert e.code == "TIMEOUT"
+        assert (await client.call_tool("echo", {"value": "after"}))["echo"] == "after"
+        
+        process = server.transport._process
+        await client.disconnect()
+        assert process.returncode is not None and server.transport is None and client.pool is None
+        
+        # HTTP+SSE
+        close_server, url, session = await start_mock_mcp_sse_server()
+        client = MCPClient(MCPClientConfig(transport="sse", server_url=url, enable_cache=False))
+        await client.connect()
+        assert len(client.tools) == 7
+        results = await asyncio.gather(*[
+            client.call_tool("echo", {"value": str(i), "delay": 0.2 - i * 0.04}) for i in range(5)
+        ])
+        assert [r["echo"] for r in results] == [str(i) for i in range(5)]
+        assert session.max_concurrent == 5
+        assert (await client.call_tool("k8s-get-pods", {}))["items"][1]["metadata"]["name"] == "web-1"
+        assert await client.call_tool("ping-client", {}) == {"pong": True}
+        sse_stats = client.get_server_stats()[0].transport
+        await client.disconnect()
+        await close_server()
+        
+        logger.success(f"✅ MCP传输正常: stdio={stats.model_dump()}, sse={sse_stats.model_dump()}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ MCP传输测试失败: {e}")
+        return False
+
+
+async def test_mcp_server_pool():
+    """测试多MCP服务器的命名空间路由、副本负载均衡与健康状态"""
+    logger.info("🗂️ 测试MCP服务器池...")
+    
+    try:
+        from src.mcp.client import MCPClient
+        from src.mcp.types import MCPClientConfig, MCPServerConfig, MCPException
+        
+        command = [sys.executable, "mock_mcp_server.py"]
+        client = MCPClient(MCPClientConfig(
+            servers=[
+                MCPServerConfig(name="a", transport="stdio", server_command=command),
+                MCPServerConfig(name="b", transport="stdio", server_command=command),
+                MCPServerConfig(name="staging", transport="stdio", server_command=command, namespace="staging"),
+                MCPServerConfig(name="broken", transport="stdio", server_command=[sys.executable, "-c", "pass"], namespace="broken"),
+            ],
+            timeout=1000, retry_attempts=0, enable_cache=False, max_concurrent_calls=20,
+            server_failure_threshold=2, server_retry_interval=0.5
+        ))
+        # 部分服务器连接失败时其余照常使用
+        await client.connect()
+        assert len(client.tools) == 14 and "staging__k8s-get-pods" in client.tools, list(client.tools)
+        assert not any(name.startswith("broken__") for name in client.tools)
+        servers = {stats.name: stats for stats in client.get_server_stats()}
+        assert servers["broken"].health == "down" and servers["a"].health == "healthy"
+        
+        # 按命名空间路由
+        pods = await client.call_tool("staging__k8s-get-pods", {"namespace": "qa"})
+        assert pods["items"][0]["metadata"]["namespace"] == "qa"
+        
+        # 副本之间按进行中请求数分配
+        await asyncio.gather(*[client.call_tool("echo", {"value": str(i), "delay": 0.2}) for i in range(8)])
+        servers = {stats.name: stats for stats in client.get_server_stats()}
+        assert servers["a"].calls == 4 and servers["b"].calls == 4, servers
+        assert servers["a"].max_in_flight == 4 and servers["staging"].calls == 1
+        
+        # 工具返回的错误不影响健康状态
+        for _ in range(3):
+            try:
+                await client.call_tool("staging__fail", {})
+            except MCPException:
+                pass
+        assert client.get_server_stats()[2].health == "healthy"
+        
+        # 连续超时后标记为不健康，重试间隔后放行的探测调用成功则恢复
+        for _ in range(2):
+            try:
+                await client.call_tool("staging__echo", {"value": "slow", "delay": 1.5})
+                assert False, "应当超时"
+            except MCPException:
+                pass
+        staging = client.get_server_stats()[2]
+        assert staging.health == "unhealthy" and staging.consecutive_failures == 2, staging
+        await asyncio.sleep(0.5)
+        assert (await client.call_tool("staging__echo", {"value": "probe"}))["echo"] == "probe"
+        assert client.get_server_stats()[2].health == "healthy"
+        
+        # 副本断开后调用转到其余副本，之后在后台重连
+        client.pool.servers["b"].transport._process.kill()
+        for _ in range(50):
+            if client.get_server_stats()[1].health == "down":
+                break
+            await asyncio.sleep(0.02)
+        calls_a = client.get_server_stats()[0].calls
+        results = await asyncio.gather(*[client.call_tool("echo", {"value": str(i)}) for i in range(3)])
+        assert [r["echo"] for r in results] == ["0", "1", "2"]
+        assert client.get_server_stats()[0].calls == calls_a + 3
+        for _ in range(100):
+            if client.get_server_stats()[1].health == "healthy":
+                break
+            await asyncio.sleep(0.05)
+        b = client.get_server_stats()[1]
+        assert b.health == "healthy" and b.reconnects == 1, b
+        
+        await client.disconnect()
+        assert client.pool is None and client.get_server_stats() == []
+        
+        # 命名空间下的修改类工具按去掉前缀的名称识别：不缓存、不重试，并使缓存的读取结果失效；
+        # 未声明只读的远程工具不缓存
+        client = MCPClient(MCPClientConfig(
+            servers=[MCPServerConfig(name="prod", transport="stdio", server_command=command, namespace="prod")],
+            timeout=500, retry_attempts=2, retry_delay=10
+        ))
+        await client.connect()
+        assert client.is_mutating("prod__k8s-scale-deployment") and not client.is_mutating("prod__k8s-get-pods")
+        await client.call_tool("prod__k8s-get-pods", {"namespace": "prod"})
+        await client.call_tool("prod__k8s-get-pods", {"namespace": "prod"})
+        assert client.get_cache_stats().hits == 1
+        scale = {"name": "web", "replicas": 3}
+        assert [(await client.call_tool("prod__k8s-scale-deployment", scale))["calls"] for _ in range(2)] == [1, 2]
+        assert client.get_cache_stats().entries == 0
+        await client.call_tool("prod__k8s-get-pods", {"namespace": "prod"})
+        assert client.get_cache_stats().hits == 1
+        retries = client.get_stats().retries
+        try:
+            await client.call_tool("prod__k8s-scale-deployment", {**scale, "delay": 1})
+            assert False, "应当超时"
+        except MCPException as e:
+            assert e.code == "TIMEOUT", e
+        assert client.get_stats().retries == retries and client.get_cache_stats().entries == 0
+        
+        client.tools["prod__big-output"] = client.tools["prod__big-output"].model_copy(update={"read_only_hint": None})
+        for _ in range(2):
+            await client.call_tool("prod__big-output", {"size": 10})
+        assert client.get_cache_stats().hits == 1
+        await client.disconnect()
+        
+        logger.success(f"✅ MCP服务器池正常: a={servers['a'].calls}, b={servers['b'].calls}, staging={staging.model_dump(exclude={'transport'})}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ MCP服务器池测试失败: {e}")
+        return False
+
+
+async def test_request_deadline():
+    """测试工具调用超时、只读工具重试和请求截止时间的传递"""
+    logger.info("⏳ 测试请求截止时间...")
+    
+    try:
+        from src.dingtalk.dispatcher import MessageDispatcher, DispatcherConfig
+        from src.llm.processor import EnhancedLLMProcessor
+        from src.mcp.client import MCPClient
+        from src.mcp.deadline import deadline_scope, time_remaining
+        from src.mcp.types import MCPClientConfig, LLMConfig, ChatMessage, MCPException
+        
+        # 模拟工具执行需要0.2s以上：只读工具超时后重试，修改类工具不重试
+        client = MCPClient(MCPClientConfig(timeout=50, retry_attempts=2, retry_delay=10, enable_cache=False))
+        await client.connect()
+        for name, parameters in [("k8s-get-pods", {}), ("k8s-scale-deployment", {"name": "web", "replicas": 2})]:
+            try:
+                await client.call_tool(name, parameters)
+                assert False, "应当超时"
+            except MCPException as e:
+                assert e.code == "TIMEOUT", e
+        stats = client.get_stats()
+        assert stats.timeouts == 4 and stats.retries == 2 and stats.failed_calls == 2, stats
+        await client.disconnect()
+        
+        # 挂起的工具调用超时后取消，服务端收到取消通知，并发名额随之释放
+        close_server, url, session = await start_mock_mcp_sse_server()
+        client = MCPClient(MCPClientConfig(
+            transport="sse", server_url=url, timeout=300, retry_attempts=1, retry_delay=10,
+            max_concurrent_calls=1, enable_cache=False
+        ))
+        await client.connect()
+        try:
+            await client.call_tool("echo", {"value": "hung", "delay": 30})
+            assert False, "应当超时"
+        except MCPException as e:
+            assert e.code == "TIMEOUT", e
+        assert (await client.call_tool("echo", {"value": "next"}))["echo"] == "next"
+        for _ in range(50):
+            if len(session.cancelled) == 2:
+                break
+            await asyncio.sleep(0.02)
+        assert len(session.cancelled) == 2, session.cancelled
+        
+        # 请求剩余时间比 timeout 短时按剩余时间取消，过了截止时间不再发起调用
+        assert time_remaining() is None
+        start_time = time.monotonic()
+        with deadline_scope(time.monotonic() + 0.15):
+            with deadline_scope(time.monotonic() + 10):
+                try:
+                    await client.call_tool("echo", {"value": "slow", "delay": 5})
+                    assert False, "应当超时"
+                except MCPException as e:
+                    assert e.code == "TIMEOUT", e
+            tool_elapsed = time.monotonic() - start_time
+            failed_calls = client.get_stats().failed_calls
+            try:
+                await client.call_tool("echo", {"value": "late"})
+                assert False, "应当超过截止时间"
+            except MCPException as e:
+                assert e.code == "DEADLINE_EXCEEDED", e
+            assert client.get_stats().failed_calls == failed_calls + 1
+        assert tool_elapsed < 0.28, tool_elapsed
+        await client.disconnect()
+        await close_server()
+        
+        # LLM调用同样受请求截止时间限制，且不会在截止时间之后重试
+        llm_server, base_url, _ = await start_mock_llm_server(lambda body: {"content": "ok"}, 2.0)
+        processor = EnhancedLLMProcessor(
+            LLMConfig(provider="openai", model="mock", api_key="test-key", base_url=base_url),
+            MCPClient(MCPClientConfig())
+        )
+        start_time = time.monotonic()
+        with deadline_scope(time.monotonic() + 0.3):
+            try:
+                await processor.chat([ChatMessage(role="user", content="slow")])
+                assert False, "应当超时"
+            except MCPException as e:
+                assert e.code == "LLM_TIMEOUT", e
+        llm_elapsed = time.monotonic() - start_time
+        assert llm_elapsed < 1.0 and processor.get_stats().timeouts == 1, llm_elapsed
+        await processor.close()
+        llm_server.close()
+        await llm_server.wait_closed()
+        
+        # 调度器从消息入队起计算截止时间
+        remaining = []
+        
+        async def handler(item):
+            remaining.append(time_remaining())
+        
+        dispatcher = MessageDispatcher(handler, DispatcherConfig(worker_count=1, request_deadline=5))
+        dispatcher.submit("conversation", "message")
+        await asyncio.sleep(0.2)
+        dispatcher.start()
+        await dispatcher.stop()
+        assert remaining and 4.5 < remaining[0] < 4.85, remaining
+        
+        logger.success(
+            f"✅ 请求截止时间正常: 工具 {tool_elapsed * 1000:.0f}ms, LLM {llm_elapsed * 1000:.0f}ms, {stats}"
+        )
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 请求截止时间测试失败: {e}")
+        return False
+
+
+async def test_tool_result_cache():
+    """测试MCP工具结果缓存的LRU淘汰、内存上限和过期清理"""
+    logger.info("🗃️ 测试工具结果缓存...")
+    
+    try:
+        from src.mcp.client import MCPClient
+        from src.mcp.result_cache import ResultCache
+        from src.mcp.types import MCPClientConfig
+        
+        # 条数上限：淘汰最久未使用的条目
+        cache = ResultCache(max_entries=3, max_bytes=1024)
+        for key in ["a", "b", "c"]:
+            cache.put(key, {"key": key}, ttl=60)
+        assert cache.get("a") == {"key": "a"}
+        cache.put("d", {"key": "d"}, ttl=60)
+        assert cache.get("b") is None and cache.get("a") is not None and len(cache) == 3
+        
+        # 内存上限：按JSON大小计算，单个超过上限的结果不缓存
+        cache.put("big", "x" * 1010, ttl=60)
+        assert cache.get("big") == "x" * 1010 and len(cache) == 2, len(cache)
+        cache.put("huge", "x" * 2000, ttl=60)
+        assert cache.get("huge") is None
+        
+        # 过期条目在之后的任意读写时清理，不需要再次读取同一个键；空结果同样可以命中
+        cache.put("short", [], ttl=0.05)
+        assert cache.get("short", "miss") == []
+        await asyncio.sleep(0.1)
+        cache.put("e", 1, ttl=60)
+        stats = cache.get_stats()
+        assert stats.expirations == 1 and stats.entries == 3, stats
+        assert stats.evictions == 3 and stats.oversized == 1 and stats.hits == 4 and stats.misses == 2, stats
+        assert stats.bytes == sum(entry[2] for entry in cache._entries.values())
+        
+        # 覆盖写入大量键时过期堆不会无限增长
+        for i in range(500):
+            cache.put("e", i, ttl=60)
+        assert len(cache._expiry) <= 2 * len(cache) + 65
+        
+        # 客户端：命中缓存的调用不再执行工具，命中率按实际次数计算
+        client = MCPClient(MCPClientConfig(cache_max_entries=2))
+        await client.connect()
+        first = await client.call_tool("k8s-get-pods", {"namespace": "a"})
+        start_time = time.monotonic()
+        second = await client.call_tool("k8s-get-pods", {"namespace": "a"})
+        assert second == first and time.monotonic() - start_time < 0.1
+        await client.call_tool("k8s-get-pods", {"namespace": "b"})
+        await client.call_tool("k8s-get-pods", {"namespace": "c"})
+        stats = client.get_stats()
+        cache_stats = client.get_cache_stats()
+        assert stats.cache_hit_rate == 0.25 and cache_stats.entries == 2 and cache_stats.evictions == 1, cache_stats
+        await client.disconnect()
+        assert client.get_cache_stats().entries == 0
+        
+        logger.success(f"✅ 工具结果缓存正常: {cache_stats}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 工具结果缓存测试失败: {e}")
+        return False
+
+
+async def test_cache_policies():
+    """测试按工具声明的缓存策略和修改类调用触发的缓存失效"""
+    logger.info("🧹 测试缓存策略与失效...")
+    
+    try:
+        from src.mcp.client import MCPClient
+        from src.mcp.types import MCPClientConfig, MCPException, ToolCachePolicy
+        
+        client = MCPClient(MCPClientConfig(cache_policies={"k8s-get-logs": ToolCachePolicy(cacheable=False)}))
+        await client.connect()
+        
+        async def is_hit(name, parameters):
+            hits = client.get_cache_stats().hits
+            await client.call_tool(name, parameters)
+            return client.get_cache_stats().hits == hits + 1
+        
+        reads = [
+            ("k8s-get-pods", {"namespace": "prod"}),
+            ("k8s-get-pods", {"namespace": "staging"}),
+            ("k8s-get-pods", {}),
+            ("k8s-describe-pod", {"pod_name": "web-1", "namespace": "prod"}),
+        ]
+        for name, parameters in reads:
+            assert not await is_hit(name, parameters)
+        assert all([await is_hit(name, parameters) for name, parameters in reads])
+        
+        # key_params 之外的参数不影响缓存键；按配置不缓存的工具每次都执行
+        assert await is_hit("k8s-describe-pod", {"pod_name": "web-1", "namespace": "prod", "verbose": True})
+        await client.call_tool("k8s-get-logs", {"pod_name": "web-1"})
+        assert not await is_hit("k8s-get-logs", {"pod_name": "web-1"})
+        
+        # prod 扩缩容：prod 和未指定命名空间的 Pod 结果失效，staging 的保留；修改类结果不缓存
+        scale = {"name": "web", "replicas": 3, "namespace": "prod"}
+        await client.call_tool("k8s-scale-deployment", scale)
+        cache_stats = client.get_cache_stats()
+        assert cache_stats.invalidations == 3 and cache_stats.entries == 1, cache_stats
+        assert await is_hit("k8s-get-pods", {"namespace": "staging"})
+        assert not await is_hit("k8s-get-pods", {"namespace": "prod"})
+        assert not await is_hit("k8s-get-pods", {})
+        assert not await is_hit("k8s-scale-deployment", scale)
+        
+        # 与修改并发执行的读取不会把修改前的结果写入缓存
+        await asyncio.gather(
+            client.call_tool("k8s-get-pods", {"namespace": "qa"}),
+            client.call_tool("k8s-scale-deployment", {**scale, "namespace": "qa"})
+        )
+        assert not await is_hit("k8s-get-pods", {"namespace": "qa"})
+        
+        # 修改类调用超时：结果未知，同样让相关缓存失效
+        assert await is_hit("k8s-get-pods", {"namespace": "qa"})
+        client.config.timeout = 100
+        try:
+            await client.call_tool("k8s-scale-deployment", {**scale, "namespace": "qa"})
+            assert False, "修改类调用应超时"
+        except MCPException as e:
+            assert e.code == "TIMEOUT", e
+        client.config.timeout = MCPClientConfig().timeout
+        assert not await is_hit("k8s-get-pods", {"namespace": "qa"})
+        
+        # 未声明影响范围的修改类工具清空全部缓存
+        client.tools["k8s-scale-deployment"] = client.tools["k8s-scale-deployment"].model_copy(
+            update={"cache_policy": None}
+        )
+        await client.call_tool("k8s-scale-deployment", scale)
+        assert client.get_cache_stats().entries == 0
+        
+        cache_stats = client.get_cache_stats()
+        await client.disconnect()
+        logger.success(f"✅ 缓存策略与失效正常: {cache_stats}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 缓存策略与失效测试失败: {e}")
+        return False
+
+
+async def test_streaming_reply():
+    """测试流式回复"""
+    logger.info("🌊 测试流式回复...")
+    
+    try:
+        from src.dingtalk.bot import DingTalkBot
+        from src.dingtalk.http_client import DingTalkHTTPClient
+        from src.dingtalk.sender import SenderConfig
+        from src.dingtalk.streaming import StreamingConfig
+        from src.llm.processor import EnhancedLLMProcessor
+        from src.mcp.client import MCPClient
+        from src.mcp.types import MCPClientConfig, LLMConfig
+        
+        answer = "集群中共有2个Pod。\n\n两个Pod都处于Running状态，没有发现异常。建议继续观察资源使用情况。"
+        
+        def reply(body):
+            if any(m["role"] == "tool" for m in body["messages"]):
+                return {"content": answer}
+            return {"tool_calls": [{"id": "call_1", "name": "k8s-get-pods", "arguments": '{"namespace": "default"}'}]}
+        
+        llm_server, base_url, _ = await start_mock_llm_server(reply)
+        dingtalk_server, webhook_url, received = await start_mock_dingtalk_server()
+        
+        mcp_client = MCPClient(MCPClientConfig())
+        await mcp_client.connect()
+        processor = EnhancedLLMProcessor(
+            LLMConfig(provider="openai", model="mock", api_key="test-key", base_url=base_url),
+            mcp_client
+        )
+        http_client = DingTalkHTTPClient()
+        bot = DingTalkBot(
+            webhook_url=webhook_url,
+            llm_processor=processor,
+            http_client=http_client,
+            sender_config=SenderConfig(rate_per_minute=6000, burst=100, enable_merge=False),
+            streaming_config=StreamingConfig(enabled=True, min_interval=0, min_chars=5)
+        )
+        
+        result = await bot.process_webhook({
+            "msgId": "stream-msg-001",
+            "msgtype": "text",
+            "text": {"content": "查看集群pod状态"},
+            "chatbotUserId": "bot",
+            "conversationId": "conv-stream",
+            "senderId": "user",
+            "senderNick": "测试用户",
+            "sessionWebhook": webhook_url,
+            "createAt": 1640995200000,
+            "conversationType": "2"
+        })
+        await bot.stop()
+        
+        texts = [m.get("markdown", {}).get("text") or m.get("text", {}).get("content") for m in received]
+        assert result["success"], result
+        assert "k8s-get-pods" in texts[0], texts
+        # 已推送的段落不会在最终回复中重复
+        assert "集群中共有2个Pod" in "".join(texts[:-1]) and "集群中共有2个Pod" not in texts[-1]
+        assert "工具调用详情" in texts[-1]
+        
+        stats = bot.get_stats()["streaming"]
+        assert stats["replies"] == 1 and stats["average_first_byte_ms"] > 0
+        
+        await http_client.close()
+        await mcp_client.disconnect()
+        for server in (llm_server, dingtalk_server):
+            server.close()
+            await server.wait_closed()
+        logger.success(f"✅ 流式回复正常，推送 {len(texts)} 条: {stats}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 流式回复测试失败: {e}")
+        return False
+
+
 async def test_integration():
     """测试完整集成"""
     logger.info("🔗 测试系统集成...")
@@ -254,7 +2171,32 @@ async def run_all_tests():
         ("模块导入", test_imports),
         ("MCP客户端", test_mcp_client),
         ("LLM处理器", test_llm_processor), 
+        ("快捷指令直达", test_shortcut_fast_path),
+        ("会话记忆", test_conversation_memory),
         ("钉钉机器人", test_dingtalk_bot),
+        ("消息调度器", test_dispatcher),
+        ("出站HTTP客户端", test_http_client),
+        ("消息去重", test_dedup),
+        ("出站限流", test_outbound_sender),
+        ("长消息分段", test_chunked_delivery),
+        ("LLM调用并发与超时", test_llm_client_limits),
+        ("并行工具调用", test_parallel_tool_calls),
+        ("多步工具调用", test_agent_loop),
+        ("工具目录", test_tool_catalog),
+        ("工具结果压缩", test_tool_result_compaction),
+        ("LLM回答缓存", test_answer_cache),
+        ("用量账本与配额", test_usage_ledger),
+        ("LLM后端路由与切换", test_provider_failover),
+        ("LLM对冲请求", test_hedged_requests),
+        ("请求合并", test_request_coalescing),
+        ("工具子集选择", test_tool_selection),
+        ("MCP传输", test_mcp_transport),
+        ("MCP服务器池", test_mcp_server_pool),
+        ("请求截止时间", test_request_deadline),
+        ("工具结果缓存", test_tool_result_cache),
+        ("缓存策略与失效", test_cache_policies),
+        ("流式回复", test_streaming_reply),
+        ("意图路由", test_intent_router),
         ("API端点", test_fastapi_endpoints),
         ("系统集成", test_integration)
     ]